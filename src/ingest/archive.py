@@ -0,0 +1,153 @@
+"""
+Read-only access to the members of tar and zip archives without extracting them
+to the file system. Used to browse archives in place, see `paths.ArchiveEntry`.
+"""
+
+
+import os
+import logging
+import tarfile
+import zipfile
+
+
+# Archive types whose members can be read in any order without inflating the whole archive
+BROWSABLE_FILE_TYPES = {".tar", ".zip"}
+
+
+class ArchiveIndex:
+    """
+    Listing of the members of a single tar or zip archive. The archive is opened and
+    listed the first time one of its members is inspected and stays open until `close`
+    is called, reopening if it is inspected again. Member names are normalized into
+    relative paths without leading or trailing slashes, the root of the archive is "".
+    """
+
+    def __init__(self, extension, open_archive):
+        """
+        Constructs an index for an archive that has not been opened yet.
+        extension: string
+            extension of the archive, one of BROWSABLE_FILE_TYPES
+        open_archive: function() -> binary file object
+            opens the (seekable) archive file for reading
+        """
+        assert extension in BROWSABLE_FILE_TYPES, "Cannot browse archive type: "+extension
+
+        self.extension = extension
+        self._open_archive = open_archive
+        self._fileobj = None
+        self._archive = None
+        self._files = {}
+        self._dirs = {}
+        self._links = set()
+
+    def _load(self):
+        """ Opens & lists the archive if it is not already open """
+        if self._archive is not None:
+            return
+
+        self._files = {}
+        self._dirs = {}
+        self._links = set()
+
+        try:
+            self._fileobj = self._open_archive()
+            if self.extension == ".tar":
+                self._archive = tarfile.open(fileobj=self._fileobj, mode="r:*")
+                members = [(m.name, m.isdir(), m.issym() or m.islnk(), m.isfile(), m)
+                           for m in self._archive.getmembers()]
+            else:
+                self._archive = zipfile.ZipFile(self._fileobj, "r")
+                members = [(m.filename, m.filename.endswith("/"), False, True, m)
+                           for m in self._archive.infolist()]
+        except (OSError, EOFError, tarfile.TarError, zipfile.BadZipFile) as e:
+            logging.warning("Unable to list archive, treating it as empty: %s", e)
+            self.close()
+            return
+
+        self._dirs[""] = set()
+        for (name, is_dir, is_link, is_file, info) in members:
+            name = normalize_member_name(name)
+            if name == "":
+                continue
+
+            self._add_parents(name)
+            if is_dir:
+                self._dirs.setdefault(name, set())
+            elif is_link:
+                self._links.add(name)
+            elif is_file:
+                self._files[name] = info
+
+    def _add_parents(self, name):
+        """ Records every parent directory of the member name, archives may omit them """
+        parent = os.path.dirname(name)
+        self._dirs.setdefault(parent, set()).add(os.path.basename(name))
+        if parent != "":
+            self._add_parents(parent)
+
+    def exists(self, name):
+        """ Returns whether the member exists in the archive """
+        return self.is_dir(name) or self.is_file(name) or self.is_link(name)
+
+    def is_dir(self, name):
+        """ Returns whether the member is a directory, explicit or implied by its children """
+        self._load()
+        return name in self._dirs
+
+    def is_file(self, name):
+        """ Returns whether the member is a regular file """
+        self._load()
+        return name in self._files
+
+    def is_link(self, name):
+        """ Returns whether the member is a symbolic or hard link """
+        self._load()
+        return name in self._links
+
+    def listdir(self, name):
+        """ Returns the names of the children of the directory member, like `os.listdir` """
+        self._load()
+        if name not in self._dirs:
+            raise NotADirectoryError("Not a directory in archive: " + name)
+        return list(self._dirs[name])
+
+    def size(self, name):
+        """ Returns the uncompressed size of the file member in bytes """
+        self._load()
+        info = self._files[name]
+        return info.size if self.extension == ".tar" else info.file_size
+
+    def open(self, name):
+        """ Opens the file member for reading, returns a binary file object """
+        self._load()
+        if name not in self._files:
+            raise FileNotFoundError("Not a file in archive: " + name)
+
+        if self.extension == ".tar":
+            return self._archive.extractfile(self._files[name])
+        else:
+            return self._archive.open(self._files[name], "r")
+
+    def close(self):
+        """ Closes the archive, it will be reopened if inspected again """
+        if self._archive is not None:
+            self._archive.close()
+        if self._fileobj is not None:
+            self._fileobj.close()
+        self._archive = None
+        self._fileobj = None
+
+
+def normalize_member_name(name):
+    """
+    Normalizes a member name found in an archive into a relative path without leading
+    or trailing slashes. Names that would escape the archive root (`..`) become "".
+    name: string
+        member name as stored in the archive
+    return: string
+        normalized member name, "" for the archive root or unsafe names
+    """
+    name = os.path.normpath(name.replace("\\", "/")).lstrip("/")
+    if name == "." or name == ".." or name.startswith("../"):
+        return ""
+    return name
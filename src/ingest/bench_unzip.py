@@ -0,0 +1,164 @@
+"""
+Benchmarks unzipping a synthetic case the way a scan does: a single bundle tar holding
+many node archives, the common shape of a StorageGRID support bundle. The bundle is
+browsed in place and its node archives are unzipped to scratch space ahead of the walk
+by the extract threads of `--pipeline` (see `scan.extract_ahead`), each thread count
+timed in turn. With --7z the same logs are packed into one 7z archive instead and each
+7z backend is timed on it.
+
+Usage: python bench_unzip.py [--nodes N] [--log-mb MB] [--threads 1 2 4 8] [--7z]
+"""
+
+
+import os
+import time
+import shutil
+import random
+import argparse
+import tempfile
+
+import unzip
+import scan
+import paths
+import pipeline
+import incremental
+
+
+def write_node_logs(node_dir, log_mb, rand):
+    """ Writes a few files of random log lines, about log_mb megabytes in total """
+    words = ["ADE:", "CRMM", "NOTICE", "Transfer", "request", "completed", "successfully",
+             "bycast", "storage", "node", "error", "object", "CBID", "audit"]
+    os.makedirs(os.path.join(node_dir, "var", "local", "log"))
+    for name in ["bycast.log", "servermanager.log", "messages"]:
+        with open(os.path.join(node_dir, "var", "local", "log", name), "w") as f:
+            size = 0
+            while size < log_mb * 1000000 // 3:
+                line = " ".join(rand.choice(words) for _ in range(12))
+                line += " %016X\n" % rand.getrandbits(64)
+                f.write(line)
+                size += len(line)
+
+
+def build_case(work_dir, nodes, log_mb):
+    """
+    Builds a bundle tar of node .tar.gz archives, each holding a few log files.
+    work_dir: string
+        directory to build the case in
+    nodes: int
+        number of node archives in the bundle
+    log_mb: int
+        approximate uncompressed size of each node's logs in megabytes
+    return: string
+        path to the bundle tar
+    """
+    rand = random.Random(0)
+    bundle_dir = os.path.join(work_dir, "bundle")
+    os.makedirs(bundle_dir)
+    
+    for node in range(nodes):
+        node_dir = os.path.join(work_dir, "node" + str(node))
+        write_node_logs(node_dir, log_mb, rand)
+        shutil.make_archive(os.path.join(bundle_dir, "node" + str(node)), "gztar", node_dir)
+        shutil.rmtree(node_dir)
+    
+    bundle_tar = shutil.make_archive(os.path.join(work_dir, "input", "2001000001", "bundle"),
+                                     "tar", bundle_dir)
+    shutil.rmtree(bundle_dir)
+    return bundle_tar
+
+
+def build_7z_case(work_dir, nodes, log_mb):
+    """ Builds a bundle 7z archive holding every node's logs, returns its path """
+    import py7zr
+    rand = random.Random(0)
+    bundle_dir = os.path.join(work_dir, "bundle")
+    for node in range(nodes):
+        write_node_logs(os.path.join(bundle_dir, "node" + str(node)), log_mb, rand)
+    
+    bundle_7z = os.path.join(work_dir, "bundle.7z")
+    with py7zr.SevenZipFile(bundle_7z, "w") as z:
+        z.writeall(bundle_dir, "bundle")
+    shutil.rmtree(bundle_dir)
+    return bundle_7z
+
+
+def time_7z(bundle_7z, dest_dir, backend):
+    """ Returns the seconds taken to unzip the 7z bundle with the backend """
+    os.makedirs(dest_dir)
+    start = time.time()
+    unzip.extract_7z(bundle_7z, dest_dir, backend=backend)
+    elapsed = time.time() - start
+    shutil.rmtree(dest_dir)
+    return elapsed
+
+
+def time_search(bundle_tar, work_dir, threads):
+    """
+    Returns the seconds taken to unzip the node archives of the browsed bundle with the
+    thread count as extract threads. Node archives not unzipped ahead are unzipped by
+    the walk once it reaches them, like `scan.search_entries` does.
+    """
+    input_dir = os.path.dirname(os.path.dirname(bundle_tar))
+    history_dir = os.path.join(work_dir, "history")
+    scratch_dir = os.path.join(work_dir, "scratch")
+    worker_scan = incremental.WorkerScan(input_dir, history_dir, scratch_dir, "bench.txt",
+                                         "bench-log.txt", int(time.time()) + 3600)
+    bundle = paths.ArchiveEntry.from_archive(
+        paths.QuantumEntry(input_dir, os.path.relpath(bundle_tar, input_dir)))
+    
+    start = time.time()
+    config = pipeline.PipelineConfig(extract_threads=threads)
+    with pipeline.Pipeline(None, history_dir, config) as pipe:
+        members = [bundle/name for name in sorted(bundle.listdir())]
+        scan.extract_ahead(worker_scan, pipe, members)
+        for member in members:
+            unzipped = pipe.take_extracted(member)
+            if unzipped is None:
+                unzipped = scan.unzip_into_scratch(worker_scan, member, pipe.reading(member))
+            unzipped.delete()
+    elapsed = time.time() - start
+    bundle.close()
+    shutil.rmtree(history_dir)
+    shutil.rmtree(scratch_dir)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark nested archive extraction')
+    parser.add_argument('--nodes', dest='nodes', type=int, default=16,
+                        help='Number of node archives in the case')
+    parser.add_argument('--log-mb', dest='log_mb', type=int, default=8,
+                        help='Uncompressed megabytes of logs per node')
+    parser.add_argument('--threads', dest='threads', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='Extract thread counts to time')
+    parser.add_argument('--7z', dest='seven_zip', action='store_true',
+                        help='Compare the 7z backends instead of thread counts')
+    args = parser.parse_args()
+    
+    work_dir = tempfile.mkdtemp(prefix="bench-unzip-")
+    try:
+        if args.seven_zip:
+            bundle_7z = build_7z_case(work_dir, args.nodes, args.log_mb)
+            total_mb = args.nodes * args.log_mb
+            print("case: %d nodes x %d MB logs, 7z bundle %.1f MB" %
+                  (args.nodes, args.log_mb, os.path.getsize(bundle_7z) / 1000000))
+            for backend in ["py7zr", "patool"]:
+                elapsed = time_7z(bundle_7z, os.path.join(work_dir, "dest"), backend)
+                print("%-7s %7.2fs  %6.1f MB/s" % (backend, elapsed, total_mb / elapsed))
+            return
+        
+        bundle_tar = build_case(work_dir, args.nodes, args.log_mb)
+        print("case: %d nodes x %d MB logs, bundle %.1f MB" %
+              (args.nodes, args.log_mb, os.path.getsize(bundle_tar) / 1000000))
+        
+        baseline = None
+        for threads in args.threads:
+            elapsed = time_search(bundle_tar, work_dir, threads)
+            baseline = elapsed if baseline is None else baseline
+            print("threads=%-3d %7.2fs  speedup %.2fx" % (threads, elapsed, baseline / elapsed))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Persistent cache of unzipped archives, kept between scans so that rescanning a case
+(after a crash, an abort or a failure) does not decompress its archives again. Also
+reclaims the scratch directories left behind by scans that were killed.
+
+Cached trees are hard linked into the scratch directory, so a cache hit costs no data
+copies. The cache is only used when the cache & scratch directories share a file
+system (see `is_same_filesystem`), it would copy whole trees otherwise.
+"""
+
+
+import os
+import json
+import time
+import shutil
+import socket
+import hashlib
+import logging
+
+import paths
+import unzip
+
+
+# Name of the file marking which process owns a scratch directory
+SCRATCH_OWNER_FILE = ".scratch-owner"
+
+# Scratch directories without an owner file are reclaimed once they are this old (seconds)
+UNOWNED_SCRATCH_AGE = 24 * 60 * 60
+
+# Scratch directories owned by another host are reclaimed once untouched this long (seconds),
+# containers get a new host name on every restart so their owners can't be checked
+FOREIGN_SCRATCH_AGE = 7 * 24 * 60 * 60
+
+
+class ExtractionCache:
+    """
+    Directory of unzipped archives keyed by archive identity: the archive's absolute
+    path (`archive!/member` for members of browsed archives), size and modification time.
+    Each cached archive is a directory holding `meta.json` and `data`, the unzipped file
+    or directory. The total size is kept under a byte budget by evicting the least
+    recently used archives. Safe to share between processes: entries are published by
+    renaming and a reader that loses a race with eviction falls back to unzipping.
+    """
+
+    def __init__(self, cache_dir, budget_bytes):
+        """
+        Constructs a cache in the directory, creating it if needed.
+        cache_dir: string
+            directory holding the cached archives
+        budget_bytes: int
+            max total size of the cached archives
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.budget_bytes = budget_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key_for(self, compressed_entry):
+        """ Returns the cache key identifying the archive's current contents """
+        if isinstance(compressed_entry, paths.ArchiveEntry):
+            location = compressed_entry.vfspath
+        else:
+            location = compressed_entry.abspath
+        identity = [location, compressed_entry.getsize(), compressed_entry.getmtime()]
+        return hashlib.sha1(json.dumps(identity).encode("utf-8")).hexdigest()
+
+    def fetch(self, compressed_entry, dest_path):
+        """
+        Places the cached unzipped contents of the archive at the destination path.
+        compressed_entry: QuantumEntry
+            archive that would be unzipped
+        dest_path: string
+            path the unzipped file or directory should appear at, must not exist
+        return: bool
+            True if the contents came from the cache, False on a miss
+        """
+        entry_dir = os.path.join(self.cache_dir, self.key_for(compressed_entry))
+        data_path = os.path.join(entry_dir, "data")
+        if not os.path.lexists(data_path):
+            return False
+
+        try:
+            link_tree(data_path, dest_path)
+            # Still cached after linking, so eviction did not race the link
+            os.utime(os.path.join(entry_dir, "meta.json"))
+        except OSError as e:
+            logging.warning("Cached archive went missing, unzipping instead: %s", e)
+            remove_path(dest_path)
+            return False
+
+        logging.debug("Extraction cache hit: %s", compressed_entry.relpath)
+        return True
+
+    def store(self, compressed_entry, src_path):
+        """
+        Adds the unzipped contents of the archive to the cache, evicting the least
+        recently used archives to stay under the budget. Contents larger than the
+        whole budget are not cached.
+        compressed_entry: QuantumEntry
+            archive that was unzipped
+        src_path: string
+            path of the unzipped file or directory, left untouched
+        """
+        key = self.key_for(compressed_entry)
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_dir):
+            return
+
+        size = tree_size(src_path)
+        if size > self.budget_bytes:
+            logging.debug("Too large to cache: %s", compressed_entry.relpath)
+            return
+        self.evict(self.budget_bytes - size)
+
+        tmp_dir = os.path.join(self.cache_dir, "tmp-%d-%s" % (os.getpid(), key))
+        try:
+            os.makedirs(tmp_dir)
+            link_tree(src_path, os.path.join(tmp_dir, "data"))
+            with open(os.path.join(tmp_dir, "meta.json"), "w") as fd:
+                json.dump({"relpath": compressed_entry.relpath, "bytes": size}, fd)
+            os.rename(tmp_dir, entry_dir)
+        except OSError as e:
+            # Another process cached the same archive first, or the disk is full
+            logging.debug("Did not cache %s: %s", compressed_entry.relpath, e)
+            remove_path(tmp_dir)
+
+    def evict(self, max_bytes):
+        """ Evicts the least recently used archives until at most max_bytes are cached """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.startswith("tmp-"):
+                # Left behind by a killed process publishing or evicting an archive
+                if not is_pid_running(int(name.split("-")[1])):
+                    remove_path(os.path.join(self.cache_dir, name))
+                continue
+            meta_path = os.path.join(self.cache_dir, name, "meta.json")
+            try:
+                with open(meta_path, "r") as fd:
+                    size = json.load(fd)["bytes"]
+                entries.append((os.path.getmtime(meta_path), size, name))
+            except (OSError, ValueError, KeyError):
+                continue                    # being published, evicted or corrupt
+
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, name) in sorted(entries):
+            if total <= max_bytes:
+                break
+            logging.debug("Evicting cached archive: %s", name)
+            # Renamed first so that no reader ever links a partially deleted tree
+            evict_dir = os.path.join(self.cache_dir, "tmp-%d-evict-%s" % (os.getpid(), name))
+            try:
+                os.rename(os.path.join(self.cache_dir, name), evict_dir)
+            except OSError:
+                continue                    # already evicted by another process
+            remove_path(evict_dir)
+            total -= size
+
+
+def link_tree(src_path, dest_path):
+    """
+    Recreates the file or directory tree at the destination by hard linking every file,
+    copying files that cannot be linked (such as across file systems).
+    src_path: string
+        existing file or directory
+    dest_path: string
+        path to recreate the tree at, must not exist
+    """
+    if not os.path.isdir(src_path):
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        try:
+            os.link(src_path, dest_path)
+        except OSError:
+            shutil.copy2(src_path, dest_path)
+        return
+
+    shutil.copytree(src_path, dest_path, copy_function=link_or_copy)
+
+
+def link_or_copy(src, dest):
+    """ Hard links the file to the destination, copying it if it cannot be linked """
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+    return dest
+
+
+def tree_size(path):
+    """ Returns the total size in bytes of the file or of the files under the directory """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for name in filenames:
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return total
+
+
+def is_same_filesystem(path, other_path):
+    """ Returns whether both existing paths are on the same file system, so they can be hard linked """
+    return os.stat(path).st_dev == os.stat(other_path).st_dev
+
+
+def remove_path(path):
+    """ Removes the file or directory if it exists """
+    if os.path.isdir(path) and not os.path.islink(path):
+        unzip.delete_directory(path)
+    elif os.path.lexists(path):
+        unzip.delete_file(path)
+
+
+def claim_scratch_dir(scratch_dir):
+    """ Marks the scratch directory as owned by this process on this host """
+    with open(os.path.join(scratch_dir, SCRATCH_OWNER_FILE), "w") as fd:
+        fd.write("%s %d\n" % (socket.gethostname(), os.getpid()))
+
+
+def reclaim_scratch_dirs(scratch_root, prefix="scratch-space-"):
+    """
+    Deletes the scratch directories under the root whose owner is no longer running.
+    Directories owned by another host are deleted once they are FOREIGN_SCRATCH_AGE old.
+    Directories without an owner file (from older scans) are deleted once they are
+    UNOWNED_SCRATCH_AGE old. A running scan keeps its directory fresh, each case it unzips
+    adds & removes a directory in it.
+    scratch_root: string
+        directory holding the scratch directories
+    prefix: string
+        name prefix of scratch directories
+    return: int
+        number of scratch directories deleted
+    """
+    if not os.path.isdir(scratch_root):
+        return 0
+
+    reclaimed = 0
+    for name in os.listdir(scratch_root):
+        path = os.path.join(scratch_root, name)
+        if not name.startswith(prefix) or not os.path.isdir(path):
+            continue
+        if is_scratch_dir_owned(path):
+            continue
+
+        logging.info("Reclaiming orphaned scratch directory: %s", path)
+        if unzip.delete_directory(path):
+            reclaimed += 1
+    return reclaimed
+
+
+def is_scratch_dir_owned(scratch_dir):
+    """ Returns whether the scratch directory may still be in use by a running scan """
+    owner_path = os.path.join(scratch_dir, SCRATCH_OWNER_FILE)
+    try:
+        with open(owner_path, "r") as fd:
+            host, pid = fd.read().split()
+    except FileNotFoundError:
+        return time.time() - os.path.getmtime(scratch_dir) < UNOWNED_SCRATCH_AGE
+    except (OSError, ValueError):
+        return True
+
+    if host != socket.gethostname():
+        return time.time() - os.path.getmtime(scratch_dir) < FOREIGN_SCRATCH_AGE
+    return is_pid_running(int(pid))
+
+
+def is_pid_running(pid):
+    """ Returns whether a process with the pid is running on this host """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass                                # alive, owned by another user
+    return True
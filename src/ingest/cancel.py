@@ -0,0 +1,77 @@
+"""
+Cancellation of a scan, shared by the manager & its worker processes. The manager's
+signal handler sets an event the workers were handed when the pool started, and the
+workers check it between entries, between the files they unzip and between the
+chunks of the files they unzip or send, so that an aborted scan stops in moments
+instead of once every case being searched is done.
+
+Checks raise `Cancelled`, unwinding the search of the case to the worker's scan,
+which saves its checkpoint. The entry being searched is never marked scanned, so the
+next scan searches it again. A worker can also cancel the search of just its current
+case, see `watching`.
+"""
+
+
+import contextlib
+import multiprocessing
+
+
+# Event set once the scan is cancelled, shared with the workers (None until first used)
+_event = None
+
+# Function returning whether the work in progress in this process was taken away, see `watching`
+_lost = None
+
+
+class Cancelled(Exception):
+    """ Raised by `check` once the scan is cancelled """
+
+
+def shared_event():
+    """ Returns the event of this process, to hand to the workers started after this call """
+    global _event
+    if _event is None:
+        _event = multiprocessing.Event()
+    return _event
+
+
+def install(event):
+    """ Uses the event of the manager, in a worker process as it starts """
+    global _event
+    _event = event
+
+
+def request():
+    """ Cancels the scan, in this process & every worker sharing its event """
+    shared_event().set()
+
+
+def requested():
+    """ Returns whether the scan, or the work being watched, was cancelled """
+    return (_event is not None and _event.is_set()) or (_lost is not None and _lost())
+
+
+def check():
+    """ Raises Cancelled if the scan, or the work being watched, was cancelled """
+    if requested():
+        raise Cancelled("Scan was cancelled")
+
+
+@contextlib.contextmanager
+def watching(lost):
+    """
+    Also cancels the work done in the context once `lost()` returns True, such as the
+    search of a case another host reclaimed. None watches nothing.
+    """
+    global _lost
+    (previous, _lost) = (_lost, lost)
+    try:
+        yield
+    finally:
+        _lost = previous
+
+
+def clear():
+    """ Forgets a cancellation, before starting another scan """
+    if _event is not None:
+        _event.clear()
@@ -0,0 +1,174 @@
+"""
+Sizes & ingest durations of cases, recorded by earlier scans to order the next ones.
+The workers search cases in the order they are submitted, so a large case submitted
+last keeps one worker busy long after the rest of the pool has gone idle. Submitting
+the cases expected to take longest first (longest processing time first, LPT) leaves
+only short cases to finish at the end.
+
+A case is expected to take as long as the last scan that searched it took. Cases that
+were never recorded are sized from the top levels of their directories, which hold the
+node archives & directories, rather than walking them whole: that would cost as much
+metadata I/O as the search itself. The size is converted to seconds with the rate
+recorded for new cases, sized the same way, so that both kinds of cases can be compared.
+"""
+
+
+import os
+import json
+import time
+import logging
+
+
+# Name of the file in the history directory holding the recorded case stats
+CASE_STATS_FILE_NAME = "scan-history-case-stats.json"
+
+# Directory levels of a case listed to size it, the files below are left out
+MEASURE_DEPTH = 2
+
+
+class CaseStats:
+    """ Bytes & files of a case and the seconds a scan took to search it """
+
+    def __init__(self, nbytes=0, files=0, seconds=0.0):
+        """
+        Constructs the stats of a case.
+        nbytes: int
+            bytes of the files in the top levels of the case directory, see `measure_case`
+        files: int
+            number of files in the top levels of the case directory
+        seconds: float
+            seconds spent searching the case, summed over its sub-tasks if split
+        """
+        self.nbytes = nbytes
+        self.files = files
+        self.seconds = seconds
+
+    def __str__(self):
+        """ Returns a readable string representation of this object """
+        return "%d bytes, %d files, %.1fs" % (self.nbytes, self.files, self.seconds)
+
+    def to_json(self):
+        """ Returns the stats as a JSON compatible dict """
+        return {"bytes": self.nbytes, "files": self.files, "seconds": self.seconds}
+
+    @classmethod
+    def from_json(cls, obj):
+        """ Returns the stats read from a dict written by `to_json` """
+        return cls(int(obj["bytes"]), int(obj["files"]), float(obj["seconds"]))
+
+
+class CaseStatsStore:
+    """
+    Case stats recorded in the history directory. Only the manager reads & writes the
+    file, the workers hand their stats back with their results.
+    """
+
+    def __init__(self, history_dir):
+        """ Constructs the store, loading the stats recorded by earlier scans """
+        self.path = os.path.join(history_dir, CASE_STATS_FILE_NAME)
+        self.cases = {}
+        self.new_bytes = 0
+        self.new_seconds = 0.0
+        try:
+            with open(self.path, "r") as fd:
+                obj = json.load(fd)
+            self.cases = {case_num: CaseStats.from_json(stats)
+                          for (case_num, stats) in obj["cases"].items()}
+            self.new_bytes = int(obj["new_cases"]["bytes"])
+            self.new_seconds = float(obj["new_cases"]["seconds"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning("Ignored unreadable case stats %s: %s", self.path, e)
+            self.cases = {}
+            self.new_bytes = 0
+            self.new_seconds = 0.0
+
+    def get(self, case_num):
+        """ Returns the recorded stats of the case, None if it was never recorded """
+        return self.cases.get(case_num)
+
+    def record(self, case_num, stats):
+        """
+        Records the stats of a case the scan searched completely. Cases searched for
+        the first time add to the rate used to estimate the cases never recorded.
+        """
+        if case_num not in self.cases:
+            self.new_bytes += stats.nbytes
+            self.new_seconds += stats.seconds
+        self.cases[case_num] = stats
+
+    def prune(self, case_nums):
+        """ Forgets the cases that are not in the collection, such as deleted cases """
+        self.cases = {case_num: stats for (case_num, stats) in self.cases.items()
+                      if case_num in case_nums}
+
+    def save(self):
+        """ Writes the stats to the history directory, replacing the file at once """
+        obj = {
+            "cases": {case_num: stats.to_json() for (case_num, stats) in self.cases.items()},
+            "new_cases": {"bytes": self.new_bytes, "seconds": self.new_seconds},
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fd:
+            json.dump(obj, fd, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def seconds_per_byte(self):
+        """ Returns the rate new cases were searched at, None if no new case was recorded """
+        if self.new_bytes <= 0 or self.new_seconds <= 0:
+            return None
+        return self.new_seconds / self.new_bytes
+
+    def longest_first(self, case_dirs):
+        """
+        Orders the case directories by expected duration, longest first. Cases never
+        recorded are sized with `measure_case`, only by bytes until a rate is recorded.
+        case_dirs: list of (QuantumEntry, string)
+            case directories in the input directory & their case numbers
+        return: list of (QuantumEntry, string)
+            the same case directories, longest first, in input order when equal
+        """
+        start = time.time()
+        rate = self.seconds_per_byte()
+        costs = {}
+        for (case_dir, case_num) in case_dirs:
+            stats = self.get(case_num)
+            if stats is None:
+                stats = measure_case(case_dir)
+            costs[case_num] = stats.nbytes if rate is None else \
+                stats.seconds if case_num in self.cases else stats.nbytes * rate
+        ordered = sorted(case_dirs, key=lambda case: costs[case[1]], reverse=True)
+        logging.info("Ordered %d cases longest first in %.1fs", len(ordered), time.time() - start)
+        return ordered
+
+
+def measure_case(case_dir, depth=MEASURE_DEPTH):
+    """
+    Returns the bytes & files in the top directory levels of the case, with no duration.
+    Links are not followed, like the search does not.
+    case_dir: QuantumEntry
+        case directory in the input directory
+    depth: int
+        directory levels listed, the case directory being the first
+    """
+    stats = CaseStats()
+    dirs = [case_dir.abspath]
+    for _ in range(depth):
+        subdirs = []
+        for dirpath in dirs:
+            try:
+                entries = list(os.scandir(dirpath))
+            except OSError:
+                continue                        # deleted while listing
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    stats.nbytes += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+                stats.files += 1
+        dirs = subdirs
+    return stats
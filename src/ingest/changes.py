@@ -0,0 +1,287 @@
+"""
+Detection of the cases that changed since the last scan, so that a scan searches only
+the new or changed cases instead of every case in the input directory.
+
+Adding, deleting or renaming an entry updates the modification time of the directory
+holding it, so the signature of a case is the latest modification time of the
+directories in it, found without looking at every file. Signatures are recorded in
+the history directory once a scan completes, and a case whose signature differs from
+the recorded one is searched again. Files rewritten in place under the same name are
+not noticed this way.
+
+A file created before the scan's safe time may still be written after it, the scan
+then left it for later. Only the files of the directories modified since the case was
+recorded can be such files, those are looked at and a case holding a file modified
+after the safe time is not recorded, to be searched whole again by the next scan.
+
+The daemon also watches the input directory with inotify when inotify_simple is
+installed (an optional dependency, see `AVAILABLE`). Cases nothing happened in are
+then not even walked. inotify only sees changes made through the local kernel, so
+network filesystems are never watched, and the watcher is not trusted for cases
+without a recorded signature or after it lost events. A case it saw changing is
+searched even if its signature did not change, such as a file rewritten in place.
+"""
+
+
+import os
+import json
+import logging
+import threading
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+import fields
+
+
+# Whether the input directory can be watched with inotify
+AVAILABLE = inotify_simple is not None
+
+# Name of the file in the history directory holding the recorded case signatures
+SNAPSHOT_FILE_NAME = "scan-history-snapshot.json"
+
+# Filesystems changed by other hosts without inotify events on this one
+REMOTE_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "ceph",
+                      "glusterfs", "lustre", "fuse.sshfs"}
+
+
+def case_signature(case_dir, since=None):
+    """
+    Returns the latest modification time of the case directory & the directories under
+    it, and the latest one of those & of the files in the directories modified after
+    `since`, both in nanoseconds. Links are not followed, like the search does not.
+    case_dir: QuantumEntry
+        case directory in the input directory
+    since: int
+        signature recorded for the case, None to look at the files of every directory
+    return: (int, int)
+    """
+    (signature, latest) = (0, 0)
+    for (dirpath, dirnames, filenames) in os.walk(case_dir.abspath):
+        try:
+            mtime = os.stat(dirpath, follow_symlinks=False).st_mtime_ns
+        except OSError:
+            continue                                # deleted while walking
+        signature = max(signature, mtime)
+        latest = max(latest, mtime)
+        if since is not None and mtime <= since:
+            continue                                # nothing added since it was recorded
+        for name in filenames:
+            try:
+                stat = os.stat(os.path.join(dirpath, name), follow_symlinks=False)
+            except OSError:
+                continue
+            latest = max(latest, stat.st_mtime_ns)
+    return (signature, latest)
+
+
+def is_local_filesystem(path, mounts_path="/proc/mounts"):
+    """
+    Returns whether the directory is on a filesystem only changed through this host,
+    so that inotify sees every change. Unknown filesystems are taken as remote.
+    """
+    path = os.path.realpath(path)
+    (mount_point, fs_type) = ("", None)
+    try:
+        with open(mounts_path, "r") as fd:
+            for line in fd:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                point = parts[1].replace("\\040", " ")
+                if (path == point or path.startswith(point.rstrip("/") + "/")) and \
+                        len(point) >= len(mount_point):
+                    (mount_point, fs_type) = (point, parts[2])
+    except OSError:
+        return False
+    return fs_type is not None and fs_type not in REMOTE_FILESYSTEMS
+
+
+class ChangeFeed:
+    """
+    Cases changed since the last completed scan. `changed` is called before searching,
+    then `commit` once the scan completed or `abandon` if it did not, so that the
+    changes are not forgotten before they were searched.
+    """
+
+    def __init__(self, history_dir, watcher=None):
+        """
+        Constructs the feed, loading the signatures recorded by earlier scans.
+        history_dir: string
+            path to the history directory
+        watcher: ChangeWatcher
+            running watcher of the input directory, None to walk every case
+        """
+        self.path = os.path.join(history_dir, SNAPSHOT_FILE_NAME)
+        self.watcher = watcher
+        self.signatures = {}
+        self._pending = {}
+        self._taken = None
+        try:
+            with open(self.path, "r") as fd:
+                self.signatures = {case_num: int(sig) for (case_num, sig) in json.load(fd).items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            logging.warning("Ignored unreadable snapshot %s: %s", self.path, e)
+
+    def changed(self, case_dirs):
+        """
+        Returns the cases that changed since the last completed scan.
+        case_dirs: list of (QuantumEntry, string)
+            case directories in the input directory & their case numbers
+        return: list of (QuantumEntry, string)
+            the changed case directories, in the same order
+        """
+        watched = None
+        if self.watcher is not None:
+            self._taken = self.watcher.take()
+            watched = self._taken[1]
+
+        changed = []
+        for (case_dir, case_num) in case_dirs:
+            if watched is not None and case_num not in watched and case_num in self.signatures:
+                continue                            # nothing happened in it
+            recorded = self.signatures.get(case_num)
+            (signature, latest) = case_signature(case_dir, recorded)
+            self._pending[case_num] = (signature, latest)
+            if recorded != signature or \
+                    (watched is not None and case_num in watched):
+                changed.append((case_dir, case_num))
+        logging.info("Cases changed since the last scan: %d of %d%s", len(changed),
+                     len(case_dirs), "" if watched is None else " (watched)")
+        return changed
+
+    def commit(self, safe_time, listed=None):
+        """
+        Records the signatures of the cases checked by `changed`, once they were all
+        searched. Cases with a directory or file modified after the safe time hold
+        files the scan left for later, so they are left to be searched again.
+        safe_time: int
+            files modified after this time were not searched, in seconds
+        listed: collection of string
+            every case in the input directory, to forget the deleted ones, None to keep all
+        """
+        for (case_num, (signature, latest)) in self._pending.items():
+            if latest < safe_time * 10**9:
+                self.signatures[case_num] = signature
+            else:
+                self.signatures.pop(case_num, None)
+        if listed is not None:
+            self.signatures = {case_num: sig for (case_num, sig) in self.signatures.items()
+                               if case_num in listed}
+        self._pending = {}
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fd:
+            json.dump(self.signatures, fd, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        if self._taken is not None:
+            self.watcher.synced(self._taken[0])
+            self._taken = None
+
+    def abandon(self):
+        """ Forgets the signatures of a scan that did not complete, keeping its changes """
+        self._pending = {}
+        if self._taken is not None:
+            self.watcher.restore(self._taken[1])
+            self._taken = None
+
+
+class ChangeWatcher:
+    """
+    Watches the directories of the input directory with inotify from a thread,
+    collecting the case numbers of the cases something happened in.
+    """
+
+    # Events of entries added, deleted, renamed or written
+    MASK = 0 if inotify_simple is None else (
+        inotify_simple.flags.CREATE | inotify_simple.flags.DELETE |
+        inotify_simple.flags.MOVED_TO | inotify_simple.flags.MOVED_FROM |
+        inotify_simple.flags.CLOSE_WRITE)
+
+    def __init__(self, input_dir):
+        """ Starts watching the input directory, requires `AVAILABLE` """
+        assert AVAILABLE, "inotify_simple is not installed"
+        self.input_dir = input_dir
+        self._inotify = inotify_simple.INotify()
+        self._lock = threading.Lock()
+        self._watches = {}                          # watch descriptor -> relative path
+        self._changed = set()
+        self._epoch = 0
+        self._synced = False
+        self._stopped = threading.Event()
+        self._watch_tree("")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _watch_tree(self, relpath):
+        """ Watches the directory & every directory under it """
+        for (dirpath, dirnames, filenames) in os.walk(os.path.join(self.input_dir, relpath)):
+            try:
+                wd = self._inotify.add_watch(dirpath, self.MASK)
+            except OSError as e:
+                # Such as running out of watches, changes are no longer all seen
+                logging.warning("Unable to watch %s: %s", dirpath, e)
+                self._lost_events()
+                continue
+            self._watches[wd] = os.path.relpath(dirpath, self.input_dir)
+
+    def _lost_events(self):
+        """ Records that some changes were missed, until a scan walks every case again """
+        with self._lock:
+            self._epoch += 1
+            self._synced = False
+
+    def _run(self):
+        """ Collects the changed cases from the inotify events until stopped """
+        while not self._stopped.is_set():
+            for event in self._inotify.read(timeout=1000):
+                if event.mask & inotify_simple.flags.Q_OVERFLOW:
+                    logging.warning("Lost inotify events, every case is walked on the next scan")
+                    self._lost_events()
+                    continue
+                relpath = self._watches.get(event.wd)
+                if relpath is None:
+                    continue
+                if event.mask & inotify_simple.flags.IGNORED:
+                    del self._watches[event.wd]     # directory deleted
+                    continue
+                path = os.path.normpath(os.path.join(relpath, event.name))
+                case_num = fields.get_case_number(path.split(os.sep)[0])
+                if case_num != fields.MISSING_CASE_NUM:
+                    with self._lock:
+                        self._changed.add(case_num)
+                if event.mask & inotify_simple.flags.ISDIR and \
+                        event.mask & (inotify_simple.flags.CREATE | inotify_simple.flags.MOVED_TO):
+                    self._watch_tree(path)
+
+    def take(self):
+        """
+        Returns (epoch, changed cases) & starts collecting anew. The changed cases
+        are None if events were lost since the watcher was last synced.
+        """
+        with self._lock:
+            changed = set(self._changed) if self._synced else None
+            self._changed = set()
+            return (self._epoch, changed)
+
+    def synced(self, epoch):
+        """ Records that a scan searched every change taken at the epoch """
+        with self._lock:
+            if epoch == self._epoch:
+                self._synced = True
+
+    def restore(self, changed):
+        """ Puts back changed cases taken by a scan that did not complete """
+        if changed is not None:
+            with self._lock:
+                self._changed.update(changed)
+
+    def stop(self):
+        """ Stops watching """
+        self._stopped.set()
+        self._thread.join()
+        self._inotify.close()
@@ -0,0 +1,292 @@
+"""
+Coordination of several hosts ingesting the same input directory. Each host runs its
+own scans, claiming a case before searching it through a lease file in a directory
+shared by all hosts, such as one on the input volume:
+
+    <coordinate dir>/leases/<case>.lease        held by the host searching the case
+    <coordinate dir>/rounds/<n>/                history files of the cases of round n
+
+A round searches every case once. The history files of its cases are shared, so a
+case completed by any host is skipped by the others, and a case left partially
+searched by a host that died is resumed where it stopped by the host reclaiming it.
+Once every case of a round is done, the next scan of any host starts the next round.
+
+The host holding a lease rewrites it every `HEARTBEAT_SECONDS`. A lease that was not
+rewritten for `LEASE_SECONDS`, by the clock of the shared volume's server, has expired
+and may be reclaimed by another host. Leases are created exclusively (O_EXCL, which
+NFS v3 and later honour), so only one host claims a case at a time. The worker
+searching a case checks its `Lease` as it goes, and stops without touching the
+case's history once another host reclaimed it.
+"""
+
+
+import os
+import time
+import json
+import uuid
+import socket
+import shutil
+import logging
+import threading
+
+
+# Seconds a lease is held without a heartbeat before other hosts may reclaim it
+LEASE_SECONDS = 600
+
+# Seconds between heartbeats of the leases held by this host
+HEARTBEAT_SECONDS = 30
+
+
+def read_lease(path):
+    """
+    Returns (token, mtime) of the lease file, None if it does not exist. Raises OSError
+    if the shared volume could not be read.
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+    try:
+        with open(path, "r") as fd:
+            return (json.load(fd).get("token"), mtime)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, AttributeError):
+        return ("", mtime)                          # half written, expires like the others
+
+
+class Lease:
+    """
+    Lease of a case held by this host, handed to the worker searching the case so that
+    it stops once another host reclaimed the case. `lost` only reads the lease file
+    once every `check_seconds`, so that it can be called between entries.
+    """
+
+    def __init__(self, path, token, check_seconds=HEARTBEAT_SECONDS):
+        """ Constructs the lease of the lease file, held with the token """
+        self.path = path
+        self.token = token
+        self.check_seconds = check_seconds
+        self._lost = False
+        self._next_check = 0
+
+    def is_held(self):
+        """ Returns whether the lease file still holds the token, True if it cannot be read """
+        try:
+            seen = read_lease(self.path)
+        except OSError as e:
+            logging.warning("Unable to check lease %s: %s", self.path, e)
+            return True
+        return seen is not None and seen[0] == self.token
+
+    def lost(self):
+        """ Returns whether another host reclaimed the case, as of the last check """
+        if not self._lost and time.monotonic() >= self._next_check:
+            self._lost = not self.is_held()
+            self._next_check = time.monotonic() + self.check_seconds
+        return self._lost
+
+
+class Coordinator:
+    """ Leases held by this host & the round its scans take part in """
+
+    def __init__(self, coordinate_dir, host_id=None, *, lease_seconds=LEASE_SECONDS,
+                 heartbeat_seconds=HEARTBEAT_SECONDS):
+        """
+        Constructs the coordinator of this host, creating the shared directories.
+        coordinate_dir: string
+            directory shared by every host
+        host_id: string
+            name of this host in the leases, None for the host name & process id
+        """
+        self.coordinate_dir = coordinate_dir
+        self.host_id = host_id if host_id is not None else \
+            "%s-%d" % (socket.gethostname(), os.getpid())
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.leases_dir = os.path.join(coordinate_dir, "leases")
+        self.rounds_dir = os.path.join(coordinate_dir, "rounds")
+        os.makedirs(self.leases_dir, exist_ok=True)
+        os.makedirs(self.rounds_dir, exist_ok=True)
+        self.round_num = None
+        self._held = {}                             # case number -> lease token
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def round_dir(self):
+        """ Returns the directory of the history files of the cases of the joined round """
+        assert self.round_num is not None, "Must join a round first"
+        return os.path.join(self.rounds_dir, str(self.round_num))
+
+    def join_round(self):
+        """ Joins the latest round, starting the first one, returns its directory """
+        rounds = [int(name) for name in os.listdir(self.rounds_dir) if name.isdigit()]
+        self.round_num = max(rounds) if len(rounds) > 0 else 1
+        os.makedirs(self.round_dir, exist_ok=True)
+        logging.info("Joined ingest round %d as %s", self.round_num, self.host_id)
+        return self.round_dir
+
+    def is_done(self, case_num):
+        """ Returns whether any host completed the case in the joined round """
+        return os.path.exists(os.path.join(self.round_dir, case_num + ".txt")) and \
+            not os.path.exists(os.path.join(self.round_dir, case_num + "-log.txt"))
+
+    def finish_round(self, case_nums):
+        """
+        Starts the next round if every case of the input directory is done in the
+        joined round, deleting the rounds before the joined one.
+        case_nums: collection of string
+            every case in the input directory
+        return: bool
+            whether the joined round is over
+        """
+        if not all(self.is_done(case_num) for case_num in case_nums):
+            return False
+        os.makedirs(os.path.join(self.rounds_dir, str(self.round_num + 1)), exist_ok=True)
+        for name in os.listdir(self.rounds_dir):
+            if name.isdigit() and int(name) < self.round_num:
+                shutil.rmtree(os.path.join(self.rounds_dir, name), ignore_errors=True)
+        logging.info("Ingest round %d is over", self.round_num)
+        return True
+
+    def _lease_path(self, case_num):
+        """ Returns the path of the lease file of the case """
+        return os.path.join(self.leases_dir, case_num + ".lease")
+
+    def _write_lease(self, fd, token):
+        """ Writes the lease held by this host with the token to the open file """
+        with os.fdopen(fd, "w") as f:
+            json.dump({"host": self.host_id, "token": token, "round": self.round_num}, f)
+
+    def server_time(self):
+        """ Returns the current time of the shared volume, as the mtime of a file written now """
+        path = os.path.join(self.coordinate_dir, "clock-" + self.host_id)
+        with open(path, "w") as fd:
+            fd.write(self.host_id)
+        return os.stat(path).st_mtime
+
+    def claim(self, case_num):
+        """
+        Claims the case for this host if no other host holds a lease on it, reclaiming
+        an expired lease. Returns whether this host now holds the lease.
+        """
+        path = self._lease_path(case_num)
+        token = uuid.uuid4().hex
+        for _ in range(3):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._reclaim(case_num, path, token):
+                    return False
+                continue
+            self._write_lease(fd, token)
+            with self._lock:
+                self._held[case_num] = token
+            self._start_heartbeat()
+            return True
+        return False
+
+    def _reclaim(self, case_num, path, token):
+        """
+        Moves an expired lease out of the way, returns whether the case may be claimed.
+        The lease is renamed aside first, so only one host reclaims it, then put back if
+        another host claimed the case again in between.
+        """
+        seen = read_lease(path)
+        if seen is None:
+            return True                             # released in between
+        if self.server_time() - seen[1] <= self.lease_seconds:
+            return False
+        stale_path = "-".join([path, "stale", token])
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            return True
+        moved = read_lease(stale_path)
+        if moved is not None and moved[0] != seen[0]:
+            # A fresh lease of another host, give it back
+            try:
+                os.link(stale_path, path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        logging.warning("Reclaimed expired lease of case %s", case_num)
+        return True
+
+    def release(self, case_num):
+        """ Releases the lease of the case, if this host still holds it """
+        with self._lock:
+            token = self._held.pop(case_num, None)
+        if token is None:
+            return
+        path = self._lease_path(case_num)
+        seen = read_lease(path)
+        if seen is not None and seen[0] == token:
+            os.remove(path)
+
+    def release_all(self):
+        """ Releases every lease held by this host """
+        with self._lock:
+            case_nums = list(self._held)
+        for case_num in case_nums:
+            self.release(case_num)
+
+    @property
+    def held(self):
+        """ Returns the case numbers of the leases held by this host """
+        with self._lock:
+            return set(self._held)
+
+    def lease(self, case_num):
+        """ Returns the lease of the case for the worker searching it, None if not held """
+        with self._lock:
+            token = self._held.get(case_num)
+        if token is None:
+            return None
+        return Lease(self._lease_path(case_num), token, self.heartbeat_seconds)
+
+    def holds(self, case_num):
+        """ Returns whether this host still holds the lease of the case, reading the lease file """
+        lease = self.lease(case_num)
+        return lease is not None and lease.is_held()
+
+    def heartbeat(self):
+        """ Rewrites every lease held by this host, so that it does not expire """
+        with self._lock:
+            held = dict(self._held)
+        for (case_num, token) in held.items():
+            path = self._lease_path(case_num)
+            seen = read_lease(path)
+            if seen is None or seen[0] != token:
+                logging.critical("Lost the lease of case %s to another host", case_num)
+                with self._lock:
+                    self._held.pop(case_num, None)
+                continue
+            self._write_lease(os.open(path, os.O_WRONLY | os.O_TRUNC), token)
+
+    def _start_heartbeat(self):
+        """ Starts the heartbeat thread once this host holds a lease """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run_heartbeat, daemon=True)
+            self._thread.start()
+
+    def _run_heartbeat(self):
+        """ Sends heartbeats until closed """
+        while not self._stopped.wait(self.heartbeat_seconds):
+            try:
+                self.heartbeat()
+            except OSError as e:
+                logging.warning("Unable to renew leases: %s", e)
+
+    def close(self):
+        """ Releases every lease & stops the heartbeats """
+        self.release_all()
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._stopped.clear()
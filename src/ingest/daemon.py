@@ -0,0 +1,215 @@
+"""
+Job queue of the scan daemon. Run from cron, every scan pays for starting Python,
+importing its dependencies, starting the worker pool & connecting to Elasticsearch.
+`scan.py --daemon` keeps its worker pool & connections warm and runs the jobs dropped
+into the jobs directory one at a time, while `scan.py --submit` drops a job & follows
+its progress.
+
+Jobs move between the directories of the queue by renaming, so that a job is taken
+once and a daemon killed while running one picks it up again when it restarts:
+
+    incoming/<job>.json -> running/<job>.json -> finished/<job>.json
+
+The progress of every job is appended to progress/<job>.jsonl, one JSON object per
+line, the last one holding the state the job finished in.
+"""
+
+
+import os
+import json
+import time
+import logging
+import itertools
+
+import fields
+
+
+# Jobs the daemon runs: a scan of the input directory, of one case or of one path in a case
+JOB_KINDS = ("scan", "case", "path")
+
+# States a job finishes in
+FINISHED_STATES = ("done", "aborted", "failed")
+
+# Seconds between looks at the queue while it is empty
+POLL_SECONDS = 2
+
+# Jobs submitted by this process, telling apart those submitted at once
+_submitted = itertools.count()
+
+
+class Job:
+    """ A job dropped into the queue """
+
+    def __init__(self, job_id, kind, target, input_dir):
+        """
+        Constructs a job.
+        job_id: string
+            name of the job's files in the queue, sorting in the order jobs were submitted
+        kind: string
+            one of JOB_KINDS
+        target: string
+            case number of a case job, path relative to the input directory of a path job
+        input_dir: string
+            absolute path of the input directory the job was submitted for
+        """
+        assert kind in JOB_KINDS, "Unknown job kind: " + kind
+        self.job_id = job_id
+        self.kind = kind
+        self.target = target
+        self.input_dir = input_dir
+
+    def __str__(self):
+        """ Returns a readable string representation of this object """
+        return "%s %s %s" % (self.job_id, self.kind, self.target) if self.target else \
+               "%s %s" % (self.job_id, self.kind)
+
+    def to_json(self):
+        """ Returns the job as a JSON compatible dict """
+        return {"kind": self.kind, "target": self.target, "input_dir": self.input_dir}
+
+    @classmethod
+    def from_json(cls, job_id, obj):
+        """ Returns the job read from a dict written by `to_json` """
+        return cls(job_id, obj["kind"], obj["target"], obj["input_dir"])
+
+
+def parse_job(spec, input_dir):
+    """
+    Returns a new job from its command line form: "scan", "case:CASE_NUM" or
+    "path:PATH" with PATH relative to the input directory & inside a case.
+    Raises ValueError if the job is not valid.
+    spec: string
+        job given on the command line
+    input_dir: string
+        input directory the job is for
+    """
+    (kind, _, target) = spec.partition(":")
+    target = target.strip()
+    if kind == "scan":
+        target = ""
+    elif kind == "case":
+        if fields.get_case_number(target) == fields.MISSING_CASE_NUM:
+            raise ValueError("Not a case number: %s" % target)
+    elif kind == "path":
+        target = os.path.normpath(target)
+        parts = target.split(os.sep)
+        if os.path.isabs(target) or ".." in parts or len(parts) < 2 or \
+                fields.get_case_number(parts[0]) == fields.MISSING_CASE_NUM:
+            raise ValueError("Not a path inside a case of the input directory: %s" % target)
+    else:
+        raise ValueError("Expected scan, case:CASE_NUM or path:PATH: %s" % spec)
+
+    job_id = "%d-%d-%d" % (time.time_ns() // 1000, os.getpid(), next(_submitted))
+    return Job(job_id, kind, target, os.path.abspath(input_dir))
+
+
+class JobQueue:
+    """ Directories of the jobs waiting, running & finished, and of their progress """
+
+    def __init__(self, jobs_dir):
+        """ Constructs the queue in the jobs directory, creating its directories """
+        self.jobs_dir = jobs_dir
+        for name in ["incoming", "running", "finished", "progress"]:
+            os.makedirs(os.path.join(jobs_dir, name), exist_ok=True)
+
+    def _path(self, state_dir, job_id, ext=".json"):
+        """ Returns the path of the job's file in the directory """
+        return os.path.join(self.jobs_dir, state_dir, job_id + ext)
+
+    def submit(self, job):
+        """ Drops the job into the queue, written elsewhere first so it is never read half written """
+        tmp_path = self._path("progress", job.job_id, ".tmp")
+        with open(tmp_path, "w") as fd:
+            json.dump(job.to_json(), fd)
+        os.replace(tmp_path, self._path("incoming", job.job_id))
+
+    def recover(self):
+        """ Puts the jobs a killed daemon was running back at the front of the queue """
+        for name in os.listdir(os.path.join(self.jobs_dir, "running")):
+            logging.info("Requeued job interrupted by a previous daemon: %s", name)
+            os.replace(os.path.join(self.jobs_dir, "running", name),
+                       os.path.join(self.jobs_dir, "incoming", name))
+
+    def take(self):
+        """ Moves the oldest waiting job to running & returns it, None if no job waits """
+        for name in sorted(os.listdir(os.path.join(self.jobs_dir, "incoming"))):
+            (job_id, ext) = os.path.splitext(name)
+            if ext != ".json":
+                continue
+            try:
+                os.rename(self._path("incoming", job_id), self._path("running", job_id))
+            except FileNotFoundError:
+                continue                            # taken by another daemon
+            try:
+                with open(self._path("running", job_id), "r") as fd:
+                    return Job.from_json(job_id, json.load(fd))
+            except (OSError, ValueError, KeyError, AssertionError) as e:
+                logging.warning("Dropped unreadable job %s: %s", name, e)
+                self.finish(Job(job_id, "scan", "", ""), "failed", error=str(e))
+        return None
+
+    def report(self, job, state, **progress):
+        """ Appends the state & progress of the job to its progress file """
+        line = dict(progress, time=int(time.time()), state=state)
+        with open(self._path("progress", job.job_id, ".jsonl"), "a") as fd:
+            fd.write(json.dumps(line, sort_keys=True) + "\n")
+
+    def finish(self, job, state, **progress):
+        """ Reports the state the job finished in & moves it to finished """
+        assert state in FINISHED_STATES, "Unknown finished state: " + state
+        self.report(job, state, **progress)
+        os.replace(self._path("running", job.job_id), self._path("finished", job.job_id))
+
+    def follow(self, job, poll_seconds=POLL_SECONDS / 4):
+        """
+        Yields the progress reported by the job as it is appended, until it finishes.
+        job: Job
+            job that was submitted to the queue
+        """
+        path = self._path("progress", job.job_id, ".jsonl")
+        offset = 0
+        while True:
+            lines = []
+            if os.path.exists(path):
+                with open(path, "r") as fd:
+                    fd.seek(offset)
+                    lines = fd.readlines()
+                    if len(lines) > 0 and not lines[-1].endswith("\n"):
+                        lines.pop()                 # still being written
+                    offset += sum(len(line) for line in lines)
+            for line in lines:
+                progress = json.loads(line)
+                yield progress
+                if progress["state"] in FINISHED_STATES:
+                    return
+            time.sleep(poll_seconds)
+
+
+def serve(queue, run_job, should_stop, poll_seconds=POLL_SECONDS):
+    """
+    Runs the jobs of the queue one at a time until should_stop() returns True.
+    queue: JobQueue
+        queue the jobs are taken from
+    run_job: function(Job, report) -> return string
+        runs the job, calling report(**progress) as it goes, returns the finished state
+    should_stop: function() -> return bool
+        whether the daemon was asked to stop, checked between jobs
+    """
+    queue.recover()
+    logging.info("Waiting for jobs in %s", queue.jobs_dir)
+    while not should_stop():
+        job = queue.take()
+        if job is None:
+            time.sleep(poll_seconds)
+            continue
+
+        logging.info("Running job: %s", job)
+        queue.report(job, "running")
+        try:
+            state = run_job(job, lambda **progress: queue.report(job, "running", **progress))
+        except Exception as e:
+            logging.exception("Job failed: %s", job)
+            queue.finish(job, "failed", error=str(e))
+            continue
+        logging.info("Job %s: %s", state, job)
+        queue.finish(job, state)
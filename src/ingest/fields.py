@@ -15,6 +15,8 @@ import re
 import os
 import logging
 import paths
+import unzip
+import ratelimit
 
 
 MISSING_CASE_NUM = "Unknown"
@@ -58,6 +60,13 @@ VALID_LOG_FILENAMES = [
     "system_commands",
 ]
 
+# Files of a lumberjack directory that fields are extracted from
+LUMBERJACK_METADATA_FILES = [
+    "lumberjack.log",
+    "system_commands",
+    "os/etc/user_data",
+]
+
 class NodeFields:
     """
     Record representing possible fields for a StorageGRID Node. Can be used
@@ -70,8 +79,10 @@ class NodeFields:
         """
         Builds a NodeFields object by extracting relevant fields from the
         specified lumberjack directory (a directory with a lumberjack.log file).
+        The directory can be a path or a QuantumEntry (ex. a directory in an archive).
         """
-        assert os.path.isfile(os.path.join(lumber_dir, "lumberjack.log"))
+        lumber_dir = as_entry(lumber_dir)
+        assert (lumber_dir/"lumberjack.log").is_file()
         
         sg_ver = get_storage_grid_version(lumber_dir)
         platform = get_platform(lumber_dir)
@@ -153,11 +164,12 @@ class NodeFields:
 def get_category(lumber_dir):
     """
     Gets the category for a StorageGRID Node based on the lumberjack directory provided
-    lumber_dir : string
+    lumber_dir : string or QuantumEntry
         the lumberjack directory to search for category
     return : string
         the category of the directory or MISSING_CATEGORY if not found
     """
+    lumber_dir = as_path(lumber_dir)
     # Split the path by sub-directories
     splitPath = lumber_dir.replace('\\','/').split("/")
     start = splitPath[len(splitPath) - 1]
@@ -195,18 +207,18 @@ def get_storage_grid_version(lumber_dir):
     Example: if a line has storage-grid-release-10.4.100-12345678.0224,
     The major and major version would be 10 and the minor version is 4
 
-    lumber_dir: string
+    lumber_dir: string or QuantumEntry
         the path of the specified lumberjack directory
     return: tuple of major version and minor version if
         the version if found, otherwise MISSING SG_VER
     """
     SG_RELEASE = "storage-grid-release-"
-    sys_file = os.path.join(lumber_dir, "system_commands")
+    sys_file = as_entry(lumber_dir)/"system_commands"
 
     # use system_commands file to find version
-    if os.path.isfile(sys_file):
+    if sys_file.is_file():
         try:
-            with open(sys_file, "r") as file:
+            with sys_file.open("r") as file:
                 # read system_commands line by line
                 for line in file:
                     if SG_RELEASE in line:
@@ -223,14 +235,14 @@ def get_storage_grid_version(lumber_dir):
 def get_platform(lumber_dir):
     """
     Gets the platform of the node from the specified lumberjack directory.
-    lumber_dir: string
+    lumber_dir: string or QuantumEntry
         the path of the specified lumberjack directory
     return: string
         the platform if found, otherwise MISSING_PLATFORM
     """
-    user_data_file = paths.QuantumEntry(lumber_dir, "os/etc/user_data")
+    user_data_file = as_entry(lumber_dir)/"os/etc/user_data"
     if user_data_file.is_file():
-        with open(user_data_file.abspath, "r") as fd:
+        with user_data_file.open("r") as fd:
             for line in fd:
                 # Take part after "=" and remove other punctuation characters
                 if "HV_ENV" in line and "=" in line:
@@ -248,11 +260,12 @@ def get_time_span(lumber_dir):
     """
     Gets the time span represented by the given lumberjack directory.
     The time span format is two numbers with a dash between them (ex. 0000-0000)
-    lumber_dir: string
+    lumber_dir: string or QuantumEntry
         the path of the specified lumberjack directory
     return: string
         the time span with a dash in between, otherwise MISSING_TIME_SPAN
     """
+    lumber_dir = as_path(lumber_dir)
     match_obj = re.match(r"^([\d]+[-][\d]+)$", os.path.basename(lumber_dir))
     if match_obj is None:
         return MISSING_TIME_SPAN
@@ -264,11 +277,12 @@ def get_node_name(lumber_dir):
     """
     Gets the node name represented by the given lumberjack directory.
     The node name is located two directories above the lumberjack directory.
-    lumber_dir: string
+    lumber_dir: string or QuantumEntry
         the path of the specified lumberjack directory
     return: string
         the name of the node, empty string otherwise
     """
+    lumber_dir = as_path(lumber_dir)
     return os.path.basename(os.path.dirname(lumber_dir))
 
 
@@ -276,11 +290,12 @@ def get_grid_id(lumber_dir):
     """
     Gets the grid id represented by the given lumberjack directory.
     The grid id is located three directories above the lumberjack directory.
-    lumber_dir: string
+    lumber_dir: string or QuantumEntry
         the path of the specified lumberjack directory
     return: string
         the grid id, otherwise empty string
     """
+    lumber_dir = as_path(lumber_dir)
     return os.path.basename(os.path.dirname(os.path.dirname(lumber_dir)))
 
 
@@ -290,7 +305,7 @@ def extract_fields(lumber_dir, *, inherit_from):
     denoted by `lumber_dir` and returns a new NodeFields object with the fields.
     The object inherits missing values from `inherit_from` NodeFields object.
     All files under the `lumber_dir` are valid for extracting fields from.
-    lumber_dir: string
+    lumber_dir: string or QuantumEntry
         the path of the specified lumberjack directory
     inherit_from: NodeFields object
         object that is used to inherit missing values
@@ -304,6 +319,33 @@ def extract_fields(lumber_dir, *, inherit_from):
     return new_fields
 
 
+def as_entry(lumber_dir):
+    """
+    Returns the lumberjack directory as a QuantumEntry. Fields can be extracted
+    from a plain path or from an entry that is not on disk, such as an archive member.
+    lumber_dir: string or QuantumEntry
+        the path of the specified lumberjack directory
+    return: QuantumEntry
+        entry of the lumberjack directory
+    """
+    if isinstance(lumber_dir, paths.QuantumEntry):
+        return lumber_dir
+    return paths.QuantumEntry(lumber_dir, "")
+
+
+def as_path(lumber_dir):
+    """
+    Returns the path of the lumberjack directory, the absolute path of a QuantumEntry.
+    lumber_dir: string or QuantumEntry
+        the path of the specified lumberjack directory
+    return: string
+        path of the lumberjack directory
+    """
+    if isinstance(lumber_dir, paths.QuantumEntry):
+        return lumber_dir.abspath
+    return lumber_dir
+
+
 def contains_bycast(entry_path):
     """
     Returns true if the entry in question has the text string `bycast` in either
@@ -320,16 +362,53 @@ def contains_bycast(entry_path):
         return False
 
     try:
-        with open(entry_path, "r") as searchfile:
-            for line in searchfile:
-                if "bycast" in line:
-                    return True
+        with ratelimit.open_input(entry_path, "r") as searchfile:
+            return lines_contain_bycast(searchfile)
     except Exception as e:
         logging.warning('Error during "bycast" search: %s', str(e))
     
     return False
 
 
+def entry_contains_bycast(entry):
+    """
+    Same as `contains_bycast` except the contents are read through the QuantumEntry,
+    so entries that are not plain files on disk (ex. a streamed gzip log) are searched.
+    entry: QuantumEntry
+        the entry that is being inspected
+    return: bool
+        True if the entry contains "bycast"
+    """
+    if "bycast" in entry.abspath:
+        return True
+    
+    if not entry.exists() or entry.is_dir():
+        return False
+    
+    try:
+        with entry.open("r") as searchfile:
+            return lines_contain_bycast(searchfile)
+    except Exception as e:
+        logging.warning('Error during "bycast" search: %s', str(e))
+    
+    return False
+
+
+def lines_contain_bycast(searchfile):
+    """
+    Returns true if any line of the opened text file contains the string `bycast`.
+    searchfile: file object
+        text file opened for reading
+    return: bool
+        True if a line contains "bycast"
+    """
+    for line in searchfile:
+        if "bycast" in line:
+            return True
+    
+    return False
+
+
 def is_storagegrid(nodefields, entry):
     """
     Determines whether the entry is related to StorageGRID. Rejects files without
@@ -355,5 +434,28 @@ def is_storagegrid(nodefields, entry):
     if nodefields.node_name != MISSING_NODE_NAME:
         return True
     else:                                       
-        return valid_path and contains_bycast(entry.abspath)
+        return valid_path and entry_contains_bycast(entry)
+
 
+def is_extraction_candidate(member_path):
+    """
+    Determines whether an archive member is worth extracting. Accepts the files that
+    `is_storagegrid` could accept (by extension or filename), nested archives, and the
+    lumberjack metadata files that fields are extracted from. Core dumps, binaries,
+    databases and other files that would be thrown away are rejected.
+    member_path: string
+        path of the member relative to the root of its archive
+    return: bool
+        True if the member should be extracted
+    """
+    (filename, extension) = os.path.splitext(os.path.basename(member_path))
+    
+    if extension in VALID_LOG_EXTENSIONS or filename in VALID_LOG_FILENAMES:
+        return True
+    
+    if extension in unzip.SUPPORTED_FILE_TYPES:
+        return True
+    
+    member_path = member_path.replace("\\", "/")
+    return any(member_path == meta or member_path.endswith("/" + meta)
+               for meta in LUMBERJACK_METADATA_FILES)
@@ -0,0 +1,292 @@
+"""
+Governs the resources taken by the scan's worker pool. `os.cpu_count()` reports the
+processors of the host, not those of the container's cgroup, so the pool is sized from
+the cgroup's CPU & memory limits instead. Workers can grow without bound after a giant
+file, so a worker whose resident memory exceeds a ceiling after a case gets the pool
+recycled: its workers finish their cases & exit, and the next cases start on new ones.
+
+Extractions & bulk sends are heavy on the disks, memory & Elasticsearch, and each
+worker may run several at once through its threads. `extraction` & `sending` cap how
+many run at once across the whole pool, through semaphores shared by the workers.
+"""
+
+
+import gc
+import os
+import math
+import logging
+import contextlib
+import multiprocessing
+import concurrent.futures
+
+import cancel
+
+
+# Root of the cgroup filesystem
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Cgroup v1 memory limits at least this large mean unlimited
+UNLIMITED_MEMORY_BYTES = 2**60
+
+# Memory a worker needs at the least, fewer workers are started if the limit is lower
+MIN_WORKER_BYTES = 512 * 1024**2
+
+# Share of the memory limit the workers' resident memory may add up to
+WORKER_MEMORY_SHARE = 0.8
+
+# Seconds between checks for cancellation while waiting for a heavy operation slot
+SLOT_POLL_SECONDS = 1
+
+# Shared state of this worker process, see `_init_governed_worker`
+_recycle_event = None
+_rss_ceiling = None
+_extraction_slots = None
+_sending_slots = None
+
+
+def _read_first_line(path):
+    """ Returns the stripped first line of the file, None if it cannot be read """
+    try:
+        with open(path, "r") as fd:
+            return fd.readline().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_dirs(cgroup_root, controller, proc_cgroup_path="/proc/self/cgroup"):
+    """
+    Returns the directories holding the limits of this process's cgroup, most specific
+    first: its own cgroup, then the root of the hierarchy, as mounted in a container.
+    controller: string
+        cgroup v1 controller, such as "cpu" or "memory"
+    """
+    own_paths = {}
+    try:
+        with open(proc_cgroup_path, "r") as fd:
+            for line in fd:
+                (hierarchy, controllers, path) = line.strip().split(":", 2)
+                for name in controllers.split(",") if controllers else [""]:
+                    own_paths[name] = path
+    except (OSError, ValueError):
+        pass
+
+    dirs = []
+    if os.path.exists(os.path.join(cgroup_root, "cgroup.controllers")):
+        # cgroup v2, a single hierarchy
+        dirs.append(os.path.join(cgroup_root, own_paths.get("", "/").lstrip("/")))
+        dirs.append(cgroup_root)
+    else:
+        controller_root = os.path.join(cgroup_root, controller)
+        dirs.append(os.path.join(controller_root, own_paths.get(controller, "/").lstrip("/")))
+        dirs.append(controller_root)
+    return dirs
+
+
+def cgroup_cpu_limit(cgroup_root=CGROUP_ROOT, proc_cgroup_path="/proc/self/cgroup"):
+    """ Returns the processors the cgroup of this process may use, None if unlimited """
+    for cgroup_dir in _cgroup_dirs(cgroup_root, "cpu", proc_cgroup_path):
+        cpu_max = _read_first_line(os.path.join(cgroup_dir, "cpu.max"))
+        if cpu_max is not None:
+            (quota, _, period) = cpu_max.partition(" ")
+            if quota == "max":
+                return None
+            return int(quota) / int(period or 100000)
+        quota = _read_first_line(os.path.join(cgroup_dir, "cpu.cfs_quota_us"))
+        period = _read_first_line(os.path.join(cgroup_dir, "cpu.cfs_period_us"))
+        if quota is not None and period is not None:
+            return None if int(quota) < 0 else int(quota) / int(period)
+    return None
+
+
+def cgroup_memory_limit(cgroup_root=CGROUP_ROOT, proc_cgroup_path="/proc/self/cgroup"):
+    """ Returns the bytes of memory the cgroup of this process may use, None if unlimited """
+    for cgroup_dir in _cgroup_dirs(cgroup_root, "memory", proc_cgroup_path):
+        limit = _read_first_line(os.path.join(cgroup_dir, "memory.max"))
+        if limit is None:
+            limit = _read_first_line(os.path.join(cgroup_dir, "memory.limit_in_bytes"))
+        if limit is not None:
+            if limit == "max" or int(limit) >= UNLIMITED_MEMORY_BYTES:
+                return None
+            return int(limit)
+    return None
+
+
+def memory_limit(cgroup_root=CGROUP_ROOT):
+    """ Returns the bytes of memory this process may use, the cgroup's limit or the host's """
+    limit = cgroup_memory_limit(cgroup_root)
+    if limit is not None:
+        return limit
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def pool_size(cgroup_root=CGROUP_ROOT):
+    """
+    Returns the number of workers to start: one per processor this process may run on,
+    within the cgroup's CPU quota, and no more than fit in its memory limit.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_limit(cgroup_root)
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+    limit = cgroup_memory_limit(cgroup_root)
+    if limit is not None:
+        cpus = min(cpus, limit // MIN_WORKER_BYTES)
+    return max(1, cpus)
+
+
+def default_rss_ceiling(workers, cgroup_root=CGROUP_ROOT):
+    """ Returns each worker's share of the memory limit, the manager counting as one, None if unknown """
+    limit = memory_limit(cgroup_root)
+    if limit is None:
+        return None
+    return int(limit * WORKER_MEMORY_SHARE) // (workers + 1)
+
+
+def current_rss():
+    """ Returns the resident memory of this process, in bytes """
+    try:
+        with open("/proc/self/statm", "r") as fd:
+            return int(fd.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        # Peak rather than current, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextlib.contextmanager
+def _slot(semaphore):
+    """ Holds one of the semaphore's slots, None for no limit, giving up if the scan is cancelled """
+    if semaphore is None:
+        yield
+        return
+    while not semaphore.acquire(timeout=SLOT_POLL_SECONDS):
+        cancel.check()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def extraction():
+    """ Returns a context holding one of the pool's extraction slots """
+    return _slot(_extraction_slots)
+
+
+def sending():
+    """ Returns a context holding one of the pool's bulk send slots """
+    return _slot(_sending_slots)
+
+
+def _init_governed_worker(recycle_event, rss_ceiling, extraction_slots, sending_slots,
+                          initializer, initargs):
+    """ Initializes a worker of a WorkerPool with its shared state, then runs the pool's initializer """
+    global _recycle_event, _rss_ceiling, _extraction_slots, _sending_slots
+    _recycle_event = recycle_event
+    _rss_ceiling = rss_ceiling
+    _extraction_slots = extraction_slots
+    _sending_slots = sending_slots
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_governed(func, *args, **kwargs):
+    """ Runs the function in a worker, asking for the pool to be recycled if the worker grew too large """
+    try:
+        return func(*args, **kwargs)
+    finally:
+        if _rss_ceiling is not None and current_rss() > _rss_ceiling:
+            gc.collect()
+            rss = current_rss()
+            if rss > _rss_ceiling:
+                logging.info("Worker %d holds %d MiB, recycling the workers", os.getpid(),
+                             rss // 1024**2)
+                _recycle_event.set()
+
+
+class WorkerPool:
+    """
+    Process pool of the scan workers, see the module docstring. Submit no more calls
+    than there are workers at once, so that those submitted after a recycle start on
+    the new workers. Used as a context manager, shut down when leaving it.
+    """
+
+    def __init__(self, max_workers, initializer=None, initargs=(), *, rss_ceiling=None,
+                 max_extractions=None, max_senders=None):
+        """
+        Constructs the pool, its workers are started as calls are submitted.
+        max_workers: int
+            number of workers
+        initializer: function(*initargs)
+            called in each worker as it starts
+        rss_ceiling: int
+            resident bytes a worker may hold after a call before the pool is recycled,
+            None never recycles it
+        max_extractions: int
+            max archives unzipped at once across the pool, None for no limit
+        max_senders: int
+            max bulk sends to Elasticsearch at once across the pool, None for no limit
+        """
+        self.max_workers = max_workers
+        self.rss_ceiling = rss_ceiling
+        self.recycled = 0
+        self._initializer = initializer
+        self._initargs = initargs
+        self._recycle_event = multiprocessing.Event()
+        self._extraction_slots = None if max_extractions is None else \
+            multiprocessing.BoundedSemaphore(max_extractions)
+        self._sending_slots = None if max_senders is None else \
+            multiprocessing.BoundedSemaphore(max_senders)
+        self._executor = None
+        self._retired = []                          # (executor, its futures) finishing their calls
+        self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+    def submit(self, func, *args, **kwargs):
+        """ Schedules the call on a worker, recycling the workers first if one grew too large """
+        if self._recycle_event.is_set():
+            self.recycle()
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=_init_governed_worker,
+                initargs=(self._recycle_event, self.rss_ceiling, self._extraction_slots,
+                          self._sending_slots, self._initializer, self._initargs))
+        future = self._executor.submit(_run_governed, func, *args, **kwargs)
+        self._futures = [f for f in self._futures if not f.done()] + [future]
+        return future
+
+    def recycle(self):
+        """ Lets the current workers finish their calls & exit, later calls start new workers """
+        self._recycle_event.clear()
+        if self._executor is None:
+            return
+        self.recycled += 1
+        self._executor.shutdown(wait=False)
+        self._retired.append((self._executor, self._futures))
+        (self._executor, self._futures) = (None, [])
+
+        # Reap the workers retired earlier that are done
+        for (executor, futures) in list(self._retired):
+            if all(f.done() for f in futures):
+                executor.shutdown()
+                self._retired.remove((executor, futures))
+
+    def shutdown(self, wait=True):
+        """ Shuts down the current & retired workers """
+        for (executor, _) in self._retired:
+            executor.shutdown(wait=wait)
+        self._retired = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
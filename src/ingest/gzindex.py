@@ -0,0 +1,220 @@
+"""
+Resumable indexing of large gzip compressed logs. While a log is sent to Elasticsearch
+the line & uncompressed offset reached are checkpointed next to the scan history files.
+A later scan of the same log seeks to the checkpoint instead of sending every line again.
+
+When the optional `indexed_gzip` package is installed the checkpoint also keeps a zran
+style seek point index (a deflate window every INDEX_SPACING bytes), so resuming only
+inflates from the closest seek point. Without it the stream is re-inflated up to the
+checkpoint, which is still far cheaper than re-sending the lines.
+"""
+
+
+import os
+import json
+import time
+import hashlib
+import logging
+
+import paths
+import unzip
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+
+# Whether seek point indexes can be built & stored
+AVAILABLE = indexed_gzip is not None
+
+# Directory under the history directory holding the checkpoints
+CHECKPOINT_DIR_NAME = "scan-history-gzindex"
+
+# Only gzip logs at least this large (compressed bytes) are checkpointed
+MIN_CHECKPOINT_SIZE = 64 * 1024 * 1024
+
+# Uncompressed bytes between seek points in the index
+INDEX_SPACING = 16 * 1024 * 1024
+
+# Lines between checkpoints
+CHECKPOINT_LINES = 200000
+
+# Checkpoints not saved for this long are deleted when pruning (seconds)
+CHECKPOINT_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def prune(history_dir, max_age=None):
+    """
+    Deletes the checkpoint files not written for max_age seconds. Checkpoints are only
+    cleared once their log is fully sent, those of logs deleted, rotated away or given up
+    on are left behind, as are the temporary files of killed saves.
+    history_dir: string
+        directory containing the scan history
+    max_age: int
+        seconds after which a checkpoint file is stale, None for CHECKPOINT_MAX_AGE
+    return: int
+        number of files deleted
+    """
+    max_age = CHECKPOINT_MAX_AGE if max_age is None else max_age
+    checkpoint_dir = os.path.join(history_dir, CHECKPOINT_DIR_NAME)
+    if not os.path.isdir(checkpoint_dir):
+        return 0
+    
+    pruned = 0
+    for name in os.listdir(checkpoint_dir):
+        path = os.path.join(checkpoint_dir, name)
+        try:
+            if time.time() - os.path.getmtime(path) < max_age:
+                continue
+        except OSError:
+            continue                                # deleted by another process
+        if unzip.delete_file(path):
+            pruned += 1
+    return pruned
+
+
+class GzipCheckpoint:
+    """
+    Progress of sending a single gzip compressed log, stored in the history directory.
+    The log is opened through `open` at the last saved checkpoint. As lines are read,
+    `line_read` remembers candidate checkpoints, which are only saved once `acknowledge`
+    confirms every line before them was indexed. `clear` forgets the progress.
+    """
+
+    @classmethod
+    def for_entry(cls, entry, history_dir):
+        """
+        Returns a checkpoint for the entry if it is a gzip log large enough to be worth
+        resuming, otherwise None. Only gzip archives that are plain files qualify.
+        entry: QuantumEntry
+            entry that is about to be sent
+        history_dir: string
+            directory containing the scan history, None disables checkpoints
+        """
+        if history_dir is None or not isinstance(entry, paths.GzipEntry):
+            return None
+        if type(entry.archive) is not paths.QuantumEntry:
+            return None
+        if os.path.getsize(entry.archive.abspath) < MIN_CHECKPOINT_SIZE:
+            return None
+        return cls(entry, history_dir)
+
+    def __init__(self, entry, history_dir):
+        """ Constructs the checkpoint of the gzip entry, loading any saved progress """
+        self.entry = entry
+        self.checkpoint_dir = os.path.join(history_dir, CHECKPOINT_DIR_NAME)
+        key = hashlib.sha1(entry.relpath.encode("utf-8")).hexdigest()
+        self.progress_file = os.path.join(self.checkpoint_dir, key + ".json")
+        self.index_file = os.path.join(self.checkpoint_dir, key + ".idx")
+        self.signature = {"relpath": entry.relpath, "mtime": entry.getmtime(),
+                          "size": os.path.getsize(entry.archive.abspath)}
+
+        self.line = 0
+        self.offset = 0
+        self.acknowledged = 0
+        self.candidates = []
+        self.compressed_file = None
+        self.load()
+
+    def load(self):
+        """ Loads the saved progress, ignoring it if the log has changed since """
+        if not os.path.isfile(self.progress_file):
+            return
+        try:
+            with open(self.progress_file, "r") as fd:
+                progress = json.load(fd)
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable gzip checkpoint %s: %s", self.progress_file, e)
+            return
+
+        if progress.get("signature") != self.signature:
+            logging.debug("Gzip log changed since checkpoint: %s", self.entry.relpath)
+            self.clear()
+            return
+        self.line = progress["line"]
+        self.offset = progress["offset"]
+        self.acknowledged = self.line
+
+    def open(self):
+        """
+        Opens the log for binary reading, positioned at the saved checkpoint. The log
+        must be closed with `close` too once read.
+        """
+        if AVAILABLE:
+            index_file = self.index_file if os.path.isfile(self.index_file) else None
+            # Read through the rate limit, indexed_gzip leaves the file open
+            self.compressed_file = self.entry.open_archive()
+            try:
+                log_file = indexed_gzip.IndexedGzipFile(fileobj=self.compressed_file,
+                                                        drop_handles=False,
+                                                        spacing=INDEX_SPACING,
+                                                        index_file=index_file)
+            except Exception as e:
+                logging.warning("Ignoring unusable gzip index %s: %s", self.index_file, e)
+                self.compressed_file.seek(0)
+                log_file = indexed_gzip.IndexedGzipFile(fileobj=self.compressed_file,
+                                                        drop_handles=False,
+                                                        spacing=INDEX_SPACING)
+        else:
+            log_file = self.entry.open("rb")
+
+        if self.offset > 0:
+            logging.info("Resuming %s at line %d", self.entry.relpath, self.line + 1)
+            log_file.seek(self.offset)
+        return log_file
+
+    def close(self):
+        """ Closes the compressed file `open` read the log from, if it still is open """
+        if self.compressed_file is not None:
+            self.compressed_file.close()
+            self.compressed_file = None
+
+    def line_read(self, log_file, line_num, offset):
+        """
+        Notes that the line starting at the uncompressed offset is about to be sent.
+        Every CHECKPOINT_LINES lines the position becomes a candidate checkpoint, and the
+        latest acknowledged candidate is saved. Called from the thread reading `log_file`.
+        log_file: file object
+            log returned by `open`
+        line_num: int
+            number of the line, starting at 0
+        offset: int
+            uncompressed offset of the start of the line
+        """
+        if line_num == self.line or line_num % CHECKPOINT_LINES != 0:
+            return
+
+        self.candidates.append((line_num, offset))
+        acknowledged = self.acknowledged
+        ready = [c for c in self.candidates if c[0] <= acknowledged]
+        if len(ready) != 0:
+            self.candidates = [c for c in self.candidates if c[0] > acknowledged]
+            self.save(log_file, *ready[-1])
+
+    def acknowledge(self, line_count):
+        """ Notes that the first `line_count` lines of the log have been indexed """
+        self.acknowledged = line_count
+
+    def save(self, log_file, line_num, offset):
+        """ Saves the progress (& seek point index) so the log resumes at the line """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        if AVAILABLE:
+            log_file.export_index(self.index_file + ".tmp")
+            os.replace(self.index_file + ".tmp", self.index_file)
+
+        with open(self.progress_file + ".tmp", "w") as fd:
+            json.dump({"signature": self.signature, "line": line_num, "offset": offset}, fd)
+        os.replace(self.progress_file + ".tmp", self.progress_file)
+        self.line = line_num
+        self.offset = offset
+
+    def clear(self):
+        """ Forgets the saved progress, the log will be read from the start """
+        for path in [self.progress_file, self.index_file]:
+            if os.path.exists(path):
+                os.remove(path)
+        self.line = 0
+        self.offset = 0
+        self.acknowledged = 0
+        self.candidates = []
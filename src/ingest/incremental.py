@@ -10,10 +10,14 @@ import time
 import unzip
 
 import paths
+import fields
 
 # How often the history file updates current scanning location (in seconds)
 autosave_period = 120
 
+# Directory under the history directory holding the history files of case sub-tasks
+TASK_HISTORY_DIR_NAME = "scan-history-tasks"
+
 
 class TimePeriod:
     """
@@ -155,8 +159,11 @@ class ScanRecord:
 class Scan:
     """ Represents an active scan of the input directory """
 
-    def __init__(self, input_dir, history_dir, scratch_dir):
-        """ Constructs a Scan which operates on the given input directory. """
+    def __init__(self, input_dir, history_dir, scratch_dir, *, ram_scratch_dir=None):
+        """
+        Constructs a Scan which operates on the given input directory. Files are
+        unzipped into the scratch directory, or the RAM backed one if it is given.
+        """
         assert os.path.exists(input_dir), "File path must exist"
         
         # 6 minutes before current time
@@ -172,6 +179,7 @@ class Scan:
         
         os.makedirs(scratch_dir, exist_ok=True)     
         self.scratch_dir = scratch_dir              
+        self.ram_scratch_dir = ram_scratch_dir
 
         self.last_path = ""
         self.last_history_update = TimePeriod.ancient_history()
@@ -249,13 +257,37 @@ class Scan:
         if entry.is_dir():
             return True
  
-        modification_time = os.path.getmtime(entry.abspath)
+        modification_time = entry.getmtime()
         return modification_time in self.time_period
 
     def list_unscanned_entries(self, dir):
         """ Returns generator that yields unscanned entries, just forwards arguments """
         return list_unscanned_entries(dir, self.last_path)
 
+    @property
+    def scratch_dirs(self):
+        """ Returns every directory this scan unzips files into, on disk first """
+        if self.ram_scratch_dir is None:
+            return [self.scratch_dir]
+        return [self.scratch_dir, self.ram_scratch_dir]
+
+    def is_scratch_entry(self, entry):
+        """
+        Returns whether the entry was unzipped by this scan, so it is owned by
+        Logjam and should be deleted once scanned.
+        entry: QuantumEntry
+            entry that is being checked
+        """
+        return entry.srcpath in self.scratch_dirs
+
+    def exists_in_scratch(self, entry):
+        """
+        Returns whether the entry's relative path exists in any scratch directory.
+        entry: QuantumEntry
+            entry that is being checked
+        """
+        return any(entry.exists_in(d) for d in self.scratch_dirs)
+
     def complete_scan(self):
         """
         Completes the scan, writing out information to the history files
@@ -339,7 +371,7 @@ def list_unscanned_entries(dir, last_path):
     assert isinstance(last_path, str)
     
     # list of all entries in alphabetical order
-    entry_names = sorted_recursive_order(os.listdir(dir.abspath))
+    entry_names = sorted_recursive_order(dir.listdir())
     
     # Iterate entry_names in order and find the entry
     for e in range(len(entry_names)):       
@@ -436,9 +468,54 @@ def append_scan_record(path, scan_record):
     with open(path, "a") as file:
         file.write(str(scan_record)+"\n")
 
+def task_history_files(history_dir, case_num, task_key):
+    """
+    Returns the active & log history file names of a case sub-task, relative to the
+    history directory like those of a case, creating the directory holding them.
+    history_dir: string
+        path to the history directory
+    case_num: string
+        case number the sub-task belongs to
+    task_key: string
+        key identifying the sub-task within its case
+    return: tuple of strings
+        (active file name, log file name)
+    """
+    task_dir = os.path.join(history_dir, TASK_HISTORY_DIR_NAME)
+    os.makedirs(task_dir, exist_ok=True)
+    name = os.path.join(TASK_HISTORY_DIR_NAME, "-".join([case_num, task_key]))
+    return (name + ".txt", name + "-log.txt")
+
+
+def has_task_history(history_dir, case_num):
+    """ Returns whether any sub-task of the case has a history file """
+    task_dir = os.path.join(history_dir, TASK_HISTORY_DIR_NAME)
+    if not os.path.isdir(task_dir):
+        return False
+    return any(name.startswith(case_num + "-") for name in os.listdir(task_dir))
+
+
+def delete_task_history(history_dir, case_num, task_key=None):
+    """ Deletes the history files of every sub-task of the case, or only of the given one """
+    task_dir = os.path.join(history_dir, TASK_HISTORY_DIR_NAME)
+    if not os.path.isdir(task_dir):
+        return
+    prefix = case_num + "-" if task_key is None else "-".join([case_num, task_key])
+    for name in os.listdir(task_dir):
+        if name.startswith(prefix):
+            unzip.delete_file(os.path.join(task_dir, name))
+
+
+def delete_case_history(history_dir, case_num):
+    """ Deletes the history files of the case & its sub-tasks, so it is searched from the start """
+    for name in [case_num + ".txt", case_num + "-log.txt"]:
+        if os.path.exists(os.path.join(history_dir, name)):
+            unzip.delete_file(os.path.join(history_dir, name))
+    delete_task_history(history_dir, case_num)
+
 class WorkerScan(Scan):
     def __init__(self, input_dir, history_dir, scratch_dir, 
-                 history_active_file, history_log_file, safe_time):
+                 history_active_file, history_log_file, safe_time, *, ram_scratch_dir=None):
         """ Constructs a WorkerScan which operates on the given input directory. """
         assert os.path.exists(input_dir), "File path must exist"
 
@@ -457,6 +534,7 @@ class WorkerScan(Scan):
         
         os.makedirs(scratch_dir, exist_ok=True)     
         self.scratch_dir = scratch_dir              
+        self.ram_scratch_dir = ram_scratch_dir
         
         self.last_path = ""
         self.last_history_update = TimePeriod.ancient_history()
@@ -479,18 +557,23 @@ class ManagerScan(Scan):
         Program needs to halt the scan prematurely. Delete all the worker
         history files that has been done. Write out information to history
         files so that it can hopefully be picked up next time.
+        Cases are not submitted in input order (see `casestats`), so the scan only
+        moves past the cases that were completed before the first one that was not.
+        Completed cases after it keep their history files and are skipped next time.
         """
         assert not self._is_closed(), "Scan was internally closed"
         
-        tmp_dirs = sorted(os.listdir(self.history_dir), reverse=True)
-        for worker_history_file in tmp_dirs:
-            filename, _ = os.path.splitext(worker_history_file)
-            if os.path.exists(os.path.join(self.history_dir, filename + '-log' + ".txt")):
-                break
-            if 'scan-history' in filename:
-                continue
-            unzip.delete_file(os.path.join(self.history_dir, worker_history_file))
-            self.last_path = os.path.join(self.input_dir, filename)
+        search_dir = paths.QuantumEntry(self.input_dir, "")
+        for entry in list_unscanned_entries(search_dir, os.path.basename(self.last_path)):
+            case_num = fields.get_case_number(entry.relpath)
+            if not entry.is_dir() or case_num == fields.MISSING_CASE_NUM:
+                continue                            # never searched
+            worker_history_file = os.path.join(self.history_dir, case_num + ".txt")
+            if not os.path.exists(worker_history_file) or \
+                    os.path.exists(os.path.join(self.history_dir, case_num + "-log.txt")):
+                break                               # not started or partially searched
+            unzip.delete_file(worker_history_file)
+            self.last_path = entry.abspath
             self._save_state_to_file(force_save=True)
         
         # Internally close the Scan
@@ -500,7 +583,7 @@ class ManagerScan(Scan):
         """
         Completes the scan, writing out information to the history files
         to show that the scan was completed. Deletes all the worker history
-        files
+        files, including those of case sub-tasks
         """
         assert not self._is_closed(), "Scan was internally closed"
 
@@ -514,6 +597,9 @@ class ManagerScan(Scan):
                 unzip.delete_file(os.path.join(self.history_dir, worker_history_file))
             except:
                 continue
+        task_dir = os.path.join(self.history_dir, TASK_HISTORY_DIR_NAME)
+        if os.path.isdir(task_dir):
+            unzip.delete_directory(task_dir)
 
         # Internally close the Scan
         self._close()              
@@ -9,25 +9,51 @@ This file is for indexing files to Elasticsearch
 import os
 import time
 import shutil
+import contextlib
 import logging
+import zlib
 
 import elasticsearch
 from elasticsearch import Elasticsearch, helpers
 
 import paths
+import cancel
+import governor
+import gzindex
 
 
 INDEX_NAME = "logjam"
 ES_DOC_ID_MAX_SIZE = 512
 
+# Lines read between checks whether the scan was cancelled
+CANCEL_CHECK_LINES = 1000
 
-def set_data(file_entry, send_time, fields_obj):
-    """ Generator function used with bulk helper API """
+
+def set_data(file_entry, send_time, fields_obj, checkpoint=None):
+    """
+    Generator function used with bulk helper API. If a gzindex.GzipCheckpoint is
+    given, starts at its saved line and notes each line read so it can be saved.
+    Raises Cancelled every `CANCEL_CHECK_LINES` lines once the scan is cancelled.
+    A file that cannot be read to its end, such as a truncated or corrupt gzip log
+    being streamed, is skipped from the line it failed at with a warning.
+    """
     assert isinstance(file_entry, paths.QuantumEntry)
     
-    with open(file_entry.abspath, "rb") as log_file:
+    if checkpoint is not None:
+        log_file, start_line, offset = checkpoint.open(), checkpoint.line, checkpoint.offset
+        compressed_file = contextlib.closing(checkpoint)
+    else:
+        log_file, start_line, offset = file_entry.open("rb"), 0, 0
+        compressed_file = contextlib.nullcontext()
+    
+    with compressed_file, log_file:
         try:
-            for line_num,line in enumerate(log_file):
+            for line_num,line in enumerate(log_file, start_line):
+                if line_num % CANCEL_CHECK_LINES == 0:
+                    cancel.check()
+                if checkpoint is not None:
+                    checkpoint.line_read(log_file, line_num, offset)
+                    offset += len(line)
                 
                 # New Doc ID is the file's path + / + line number starting at 1
                 new_doc_id = (file_entry/str(line_num+1)).relpath
@@ -52,9 +78,14 @@ def set_data(file_entry, send_time, fields_obj):
             # Only supporting utf-8 for now. Skip others.
             logging.warning("Error reading %s. Non utf-8 encoding?", file_entry.abspath)
             return
+        
+        except (OSError, EOFError, zlib.error) as e:
+            # Truncated or corrupt, like unzipping it used to skip it
+            logging.warning("Error reading %s, skipping the rest of it: %s", file_entry.abspath, e)
+            return
 
 
-def send_to_es(es_obj, fields_obj, file_entry):
+def send_to_es(es_obj, fields_obj, file_entry, history_dir=None):
     """
     Sends the contents of the given file to ES with the attached
     fields. The system time of the call is also attached and sent
@@ -64,6 +95,8 @@ def send_to_es(es_obj, fields_obj, file_entry):
         object containing all the fields
     file_entry:
         file that is being sent to Elasticsearch
+    history_dir:
+        scan history directory, large gzip logs are checkpointed there to resume
     """
     #Epoch milliseconds
     send_time = int(round(time.time() * 1000))  
@@ -71,15 +104,24 @@ def send_to_es(es_obj, fields_obj, file_entry):
     try:
         error = False
         logging.debug("Indexing: %s", file_entry.relpath)
-        data = set_data(file_entry, send_time, fields_obj)
-        for success,info in helpers.parallel_bulk(es_obj,data,index=INDEX_NAME,doc_type='_doc'):
-            if not success:
-                error = True
+        checkpoint = gzindex.GzipCheckpoint.for_entry(file_entry, history_dir)
+        data = set_data(file_entry, send_time, fields_obj, checkpoint)
+        sent = 0 if checkpoint is None else checkpoint.line
+        with governor.sending():
+            for success,info in helpers.parallel_bulk(es_obj,data,index=INDEX_NAME,doc_type='_doc'):
+                if not success:
+                    error = True
+                elif not error and checkpoint is not None:
+                    # Results arrive in line order, lines before a failure are safe to skip
+                    sent += 1
+                    checkpoint.acknowledge(sent)
         
         if error:
             logging.critical("Unable to index: %s", file_entry.abspath)
             return False
         else:
+            if checkpoint is not None:
+                checkpoint.clear()
             logging.debug("Indexed: %s", file_entry.relpath)
             return True
 
@@ -91,3 +133,23 @@ def send_to_es(es_obj, fields_obj, file_entry):
         logging.warning("Error reading %s. Non utf-8 encoding?", file_entry.abspath)
         return False
 
+
+
+def send_batch(es_obj, actions):
+    """
+    Sends a batch of documents built by `set_data` to ES in a single bulk request.
+    es_obj:
+        Elasticsearch object
+    actions: list
+        documents that are being sent
+    return: bool
+        True if every document was indexed
+    """
+    try:
+        with governor.sending():
+            _, errors = helpers.bulk(es_obj, actions, index=INDEX_NAME, doc_type='_doc',
+                                     raise_on_error=False)
+    except elasticsearch.exceptions.ConnectionError as e:
+        logging.critical("Connection error sending batch to elastic search: %s", e)
+        return False
+    return len(errors) == 0
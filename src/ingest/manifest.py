@@ -0,0 +1,218 @@
+"""
+Manifests of archives: the names & sizes of their file members, read from the archive
+headers without unzipping anything to the file system. A scan uses them to skip archives
+holding nothing worth extracting (core dumps, databases, binaries) before inflating them.
+
+Manifests are cached as JSON in the history directory, keyed by the archive's relative
+path, size and modification time. The relative path of an archive is the same in the
+input and the scratch directories, so archives nested in other archives are only read
+once across rescans as well.
+"""
+
+
+import os
+import json
+import time
+import struct
+import hashlib
+import logging
+import tarfile
+import zipfile
+
+import unzip
+import archive
+import sevenzip
+
+
+# Directory under the history directory holding the manifests
+MANIFEST_DIR_NAME = "scan-history-manifests"
+
+# Manifests not written for this long are deleted when pruning (seconds)
+MANIFEST_MAX_AGE = 30 * 24 * 60 * 60
+
+
+class Manifest:
+    """
+    Regular file members of an archive with their uncompressed sizes. Reading a
+    compressed tarball inflates it, so its listing may stop at the first relevant
+    member, in which case the manifest is not complete.
+    """
+
+    def __init__(self, members, complete=True):
+        """
+        Constructs a manifest of the given members.
+        members: dict of string -> int
+            normalized member name to uncompressed size in bytes
+        complete: bool
+            False if only the members up to the first relevant one were listed
+        """
+        self.members = members
+        self.complete = complete
+
+    def is_relevant(self, member_filter):
+        """ Returns whether any member is accepted by the filter """
+        return any(member_filter(name) for name in self.members)
+
+    def to_json(self):
+        """ Returns the manifest as a JSON compatible dict """
+        return {"complete": self.complete, "members": self.members}
+
+    @classmethod
+    def from_json(cls, obj):
+        """ Returns the manifest stored in the JSON compatible dict """
+        return cls(obj["members"], obj["complete"])
+
+
+class ManifestStore:
+    """
+    Cache of archive manifests in the history directory, one JSON file per archive.
+    Safe to share between processes: manifests are written to a temporary file and
+    renamed into place.
+    """
+
+    def __init__(self, history_dir):
+        """ Constructs a store in the history directory, creating its directory if needed """
+        self.manifest_dir = os.path.join(history_dir, MANIFEST_DIR_NAME)
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+    def path_for(self, entry):
+        """ Returns the path of the manifest file of the archive's current contents """
+        identity = [entry.relpath, entry.getsize(), entry.getmtime()]
+        key = hashlib.sha1(json.dumps(identity).encode("utf-8")).hexdigest()
+        return os.path.join(self.manifest_dir, key + ".json")
+
+    def get(self, entry, member_filter=None):
+        """
+        Returns the manifest of the archive, reading it on a cache miss.
+        entry: QuantumEntry
+            archive that is being listed
+        member_filter: function(member_relpath) -> return bool
+            listing of compressed tarballs may stop at the first member it accepts
+        return: Manifest
+            the manifest, None if the archive's headers cannot be read
+        """
+        manifest_path = self.path_for(entry)
+        try:
+            with open(manifest_path, "r") as fd:
+                return Manifest.from_json(json.load(fd))
+        except (OSError, ValueError, KeyError):
+            pass                                # not cached yet, or corrupt
+
+        manifest = read_manifest(entry, member_filter)
+        if manifest is not None:
+            self.save(manifest_path, entry, manifest)
+        return manifest
+
+    def save(self, manifest_path, entry, manifest):
+        """ Writes the manifest of the archive to the manifest file """
+        tmp_path = "%s.tmp-%d" % (manifest_path, os.getpid())
+        try:
+            with open(tmp_path, "w") as fd:
+                json.dump(dict(manifest.to_json(), relpath=entry.relpath), fd)
+            os.replace(tmp_path, manifest_path)
+        except OSError as e:
+            logging.warning("Unable to save archive manifest: %s %s", entry.relpath, e)
+            if os.path.exists(tmp_path):
+                unzip.delete_file(tmp_path)
+
+    def is_relevant(self, entry, member_filter):
+        """
+        Returns whether the archive holds any member accepted by the filter. Archives
+        whose headers cannot be read are assumed relevant, unzipping them decides.
+        entry: QuantumEntry
+            archive that is being checked
+        member_filter: function(member_relpath) -> return bool
+            accepts the members worth extracting
+        """
+        manifest = self.get(entry, member_filter)
+        return manifest is None or manifest.is_relevant(member_filter)
+
+    def prune(self, max_age=None):
+        """
+        Deletes the manifests not written for max_age seconds (None uses MANIFEST_MAX_AGE),
+        along with temporary files left behind by killed processes.
+        return: int
+            number of files deleted
+        """
+        max_age = MANIFEST_MAX_AGE if max_age is None else max_age
+        pruned = 0
+        for name in os.listdir(self.manifest_dir):
+            path = os.path.join(self.manifest_dir, name)
+            try:
+                if time.time() - os.path.getmtime(path) < max_age:
+                    continue
+            except OSError:
+                continue                        # deleted by another process
+            if unzip.delete_file(path):
+                pruned += 1
+        return pruned
+
+
+def read_manifest(entry, member_filter=None):
+    """
+    Reads the manifest of a zip, tar, 7z or gzip archive from its headers. Zip & 7z
+    archives keep a listing, tar headers are read in a single pass (inflating the
+    stream of compressed tarballs, stopping at the first member accepted by the
+    filter) and gzip archives hold the single member named after them.
+    entry: QuantumEntry
+        archive that is being listed, any entry that can be opened
+    member_filter: function(member_relpath) -> return bool
+        listing of compressed tarballs stops at the first member it accepts, None lists all
+    return: Manifest
+        the manifest, None if the archive's headers cannot be read
+    """
+    try:
+        with entry.open("rb") as fd:
+            return read_manifest_from(fd, entry.relpath, member_filter)
+    except Exception as e:
+        # Corrupt, encrypted or unsupported, unzipping will tell
+        logging.debug("Unable to read archive manifest of %s: %s", entry.relpath, e)
+        return None
+
+
+def read_manifest_from(fd, relpath, member_filter):
+    """ Reads the manifest from the open archive, see `read_manifest` """
+    extension = os.path.splitext(relpath)[1]
+    if extension == ".zip":
+        with zipfile.ZipFile(fd, "r") as z:
+            return Manifest(named_sizes((m.filename, m.file_size)
+                                        for m in z.infolist() if not m.is_dir()))
+
+    if extension == ".tar":
+        with tarfile.open(fileobj=fd, mode="r:") as tar:
+            return Manifest(named_sizes((m.name, m.size) for m in tar if m.isfile()))
+
+    if unzip.is_compound_tar(relpath):
+        members = {}
+        with tarfile.open(fileobj=fd, mode="r|gz") as tar:
+            for m in tar:
+                name = archive.normalize_member_name(m.name)
+                if not m.isfile() or name == "":
+                    continue
+                members[name] = m.size
+                if member_filter is not None and member_filter(name):
+                    return Manifest(members, complete=False)
+        return Manifest(members)
+
+    if extension == ".7z":
+        if not sevenzip.AVAILABLE:
+            return None
+        return Manifest(sevenzip.list_members(fd))
+
+    if extension == ".gz":
+        # Trailer keeps the size modulo 4 GiB, good enough for a manifest
+        fd.seek(-4, os.SEEK_END)
+        size = struct.unpack("<I", fd.read(4))[0]
+        return Manifest({unzip.strip_zip_ext(os.path.basename(relpath)): size})
+
+    return None
+
+
+def named_sizes(pairs):
+    """ Returns the (name, size) pairs as a dict keyed by normalized name, unsafe names left out """
+    members = {}
+    for (name, size) in pairs:
+        name = archive.normalize_member_name(name)
+        if name != "":
+            members[name] = size
+    return members
@@ -5,9 +5,14 @@ Utility file system path functionality, such as the QuantumEntry class.
 """
 
 
+import io
 import os
+import gzip
+import shutil
 
 import unzip
+import archive
+import ratelimit
 
 
 class QuantumEntry:
@@ -18,12 +23,21 @@ class QuantumEntry:
     locating a file absolutely.
     
     The design of this class loosely mimics the Python library class `pathlib.Path`.
+    
+    Entries unzipped into scratch space carry the modification time of the archive
+    they came from, which is what the scan compares against its time period. It is
+    passed on to every entry appended to them, so the unzipped files on the file
+    system never need their own modification times changed.
     """
     
-    def __init__(self, source, relative):
-        """ Initializes an object with one source directory and a relative path """
+    def __init__(self, source, relative, *, mtime=None):
+        """
+        Initializes an object with one source directory and a relative path, and
+        optionally the modification time to report instead of the file system's.
+        """
         self.srcpath = source
         self.relpath = relative
+        self.mtime = mtime
     
     def __eq__(self, other):
         """ Returns whether two QuantumEntry objects are equal """
@@ -35,7 +49,7 @@ class QuantumEntry:
         """ Returns a new QuantumEntry object where new_path is appended to the relative path """
         assert isinstance(new_path, str), "Can only append str"
         
-        return QuantumEntry(self.srcpath, os.path.join(self.relpath, new_path))
+        return QuantumEntry(self.srcpath, os.path.join(self.relpath, new_path), mtime=self.mtime)
     
     def __itruediv__(self, new_path):
         """ Appends new_path to this QuantumEntry object's relative path """
@@ -145,6 +159,32 @@ class QuantumEntry:
         """ Returns whether this entry is a file """
         return os.path.isfile(self.abspath)
     
+    def listdir(self):
+        """ Returns the names of the entries in this directory, like `os.listdir` """
+        return os.listdir(self.abspath)
+    
+    def getmtime(self):
+        """
+        Returns the modification time of this entry, like `os.path.getmtime`, unless
+        the entry carries the modification time of the archive it was unzipped from.
+        """
+        if self.mtime is not None:
+            return self.mtime
+        return os.path.getmtime(self.abspath)
+    
+    def getsize(self):
+        """ Returns the size of this entry in bytes, like `os.path.getsize` """
+        return os.path.getsize(self.abspath)
+    
+    def open(self, mode="rb"):
+        """
+        Opens the file referenced by this entry for reading, like `pathlib.Path.open`.
+        Reads from the input directory are throttled, see `ratelimit`.
+        """
+        assert mode in ["r", "rb"], "Entries can only be opened for reading"
+        
+        return ratelimit.open_input(self.abspath, mode)
+    
     def delete(self):
         """
         Attempts to delete the file refernced by this QuantumEntry.
@@ -160,3 +200,199 @@ class QuantumEntry:
         if self.is_dir():
             return unzip.delete_directory(self.abspath)
 
+
+
+class GzipEntry(QuantumEntry):
+    """
+    Represents the decompressed contents of a single file gzip archive without
+    placing them on the file system. The relative path is the archive's relative
+    path minus the `.gz` extension, the same path `unzip.recursive_unzip` would have
+    decompressed the archive to. Opening the entry decompresses the archive on the fly,
+    read from a local copy of it when one is given.
+    """
+    
+    def __init__(self, archive, local=None):
+        """
+        Initializes an object viewing the contents of the given gzip archive entry, read
+        from `local` if not None, an up to date copy of the archive such as a prefetched one
+        """
+        assert isinstance(archive, QuantumEntry), "Archive must be a QuantumEntry"
+        assert archive.extension == ".gz", "Archive must have .gz ext: "+archive.relpath
+        
+        super().__init__(archive.srcpath, unzip.strip_zip_ext(archive.relpath))
+        self.archive = archive
+        self.local = local
+    
+    def exists(self):
+        """ Returns whether the underlying gzip archive exists """
+        return self.archive.exists()
+    
+    def is_link(self):
+        """ Returns whether the underlying gzip archive is a symbolic link """
+        return self.archive.is_link()
+    
+    def is_dir(self):
+        """ Returns False, a single file gzip archive always holds a file """
+        return False
+    
+    def is_file(self):
+        """ Returns whether the underlying gzip archive is a file """
+        return self.archive.is_file()
+    
+    def getmtime(self):
+        """ Returns the modification time of the underlying gzip archive """
+        return self.archive.getmtime()
+    
+    def getsize(self):
+        """ Returns the size of the underlying gzip archive, the contents' size is unknown """
+        return self.archive.getsize()
+    
+    def open(self, mode="rb"):
+        """ Opens a decompressing stream over the underlying gzip archive """
+        assert mode in ["r", "rb"], "Entries can only be opened for reading"
+        
+        compressed = self.open_archive()
+        stream = gzip.GzipFile(fileobj=compressed, mode="rb")
+        # GzipFile closes `myfileobj` with itself, the archive may not be a plain file
+        stream.myfileobj = compressed
+        return io.TextIOWrapper(stream) if mode == "r" else stream
+    
+    def open_archive(self):
+        """ Opens the underlying gzip archive for binary reading, its local copy if any """
+        return (self.archive if self.local is None else self.local).open("rb")
+    
+    def delete(self):
+        """
+        Attempts to delete the underlying gzip archive, there is nothing else on
+        the file system to delete. Returns whether it has been deleted or not.
+        """
+        return self.archive.delete()
+
+
+class ArchiveEntry(QuantumEntry):
+    """
+    Represents an entry inside a tar or zip archive without extracting the archive,
+    written as `archive.tar!/var/local/log/bycast.log`. The relative path is the path
+    the member would have if `unzip.recursive_unzip` extracted the archive in place, so
+    Elasticsearch document ids & scan history are the same as for an extracted archive.
+    Members are listed and read lazily through a shared `archive.ArchiveIndex`.
+    """
+    
+    @classmethod
+    def from_archive(cls, archive_entry, local=None):
+        """
+        Returns the entry representing the contents of the given archive entry. This
+        is normally the archive root (a directory), except for zip files holding a single
+        file named after the zip, which `unzip.extract_zip` unzips into just that file.
+        The archive is read from `local` if not None, an up to date copy of it such as a
+        prefetched one.
+        """
+        assert archive_entry.extension in archive.BROWSABLE_FILE_TYPES, \
+            "Cannot browse archive: " + archive_entry.relpath
+        
+        root = cls(archive_entry, "", local=local)
+        if archive_entry.extension == ".zip":
+            single_name = unzip.strip_zip_ext(archive_entry.basename)
+            if root.listdir() == [single_name] and (root/single_name).is_file():
+                return cls(archive_entry, single_name, index=root._index,
+                           root=archive_entry.reldirpath)
+        return root
+    
+    def __init__(self, archive_entry, member, *, index=None, root=None, local=None):
+        """
+        Initializes an object for the member of the archive entry. Member "" is the
+        archive root. Entries of one archive should share the same `index`, which reads
+        the archive from `local` when given one.
+        """
+        assert isinstance(archive_entry, QuantumEntry), "Archive must be a QuantumEntry"
+        
+        if root is None:
+            root = unzip.strip_all_zip_exts(archive_entry.relpath)
+        if index is None:
+            opener = archive_entry.open if local is None else local.open
+            index = archive.ArchiveIndex(archive_entry.extension, opener)
+        
+        self.archive = archive_entry
+        self.member = archive.normalize_member_name(member) if member else ""
+        self._root = root
+        self._index = index
+        super().__init__(archive_entry.srcpath, os.path.join(root, self.member))
+    
+    def __truediv__(self, new_path):
+        """ Returns a new ArchiveEntry object where new_path is appended to the member """
+        assert isinstance(new_path, str), "Can only append str"
+        
+        return ArchiveEntry(self.archive, os.path.join(self.member, new_path),
+                            index=self._index, root=self._root)
+    
+    def __itruediv__(self, new_path):
+        """ Appends new_path to this ArchiveEntry object's member """
+        assert isinstance(new_path, str), "Can only append str"
+        
+        self.member = archive.normalize_member_name(os.path.join(self.member, new_path))
+        self.relpath = os.path.join(self._root, self.member)
+        return self
+    
+    @property
+    def vfspath(self):
+        """ Returns the location of the entry written as `archive!/member` """
+        return self.archive.abspath + "!/" + self.member
+    
+    def exists(self):
+        """ Returns whether this member exists in the archive """
+        return self.archive.is_file() and self._index.exists(self.member)
+    
+    def is_link(self):
+        """ Returns whether this member is a link inside the archive """
+        return self.archive.is_file() and self._index.is_link(self.member)
+    
+    def is_dir(self):
+        """ Returns whether this member is a directory inside the archive """
+        return self.archive.is_file() and self._index.is_dir(self.member)
+    
+    def is_file(self):
+        """ Returns whether this member is a regular file inside the archive """
+        return self.archive.is_file() and self._index.is_file(self.member)
+    
+    def listdir(self):
+        """ Returns the names of the members in this directory member """
+        return self._index.listdir(self.member)
+    
+    def getmtime(self):
+        """ Returns the modification time of the archive, which unzipped members carry """
+        return self.archive.getmtime()
+    
+    def getsize(self):
+        """ Returns the uncompressed size of this file member in bytes """
+        return self._index.size(self.member)
+    
+    def open(self, mode="rb"):
+        """ Opens this file member for reading without extracting it """
+        assert mode in ["r", "rb"], "Entries can only be opened for reading"
+        
+        stream = self._index.open(self.member)
+        return io.TextIOWrapper(stream) if mode == "r" else stream
+    
+    def copy_to(self, new_src):
+        """
+        Writes this file member under the same relative path in the new source
+        directory and returns the QuantumEntry of the new plain file. Used when a
+        member has to exist on the file system, such as a nested archive to extract.
+        The new entry carries the archive's modification time.
+        """
+        new_entry = QuantumEntry(new_src, self.relpath, mtime=self.getmtime())
+        os.makedirs(new_entry.absdirpath, exist_ok=True)
+        with self.open("rb") as in_fd, open(new_entry.abspath, "wb") as out_fd:
+            shutil.copyfileobj(in_fd, out_fd)
+        return new_entry
+    
+    def delete(self):
+        """
+        Members only exist inside the archive, there is nothing on the file
+        system to delete. Always returns True.
+        """
+        return True
+    
+    def close(self):
+        """ Closes the archive shared by the entries of this archive """
+        self._index.close()
@@ -0,0 +1,367 @@
+"""
+Staged ingest pipeline run inside a scan worker. Searching a case one entry at a time
+leaves the CPU idle during Elasticsearch round trips and Elasticsearch idle while
+archives are unzipped. The pipeline splits the work into stages connected by bounded
+queues, each run by its own threads:
+
+    walk -> extract -> classify -> serialize -> bulk send
+
+The walk is the worker's own thread searching the case (see `scan.search_entries`). It
+hands archives ahead of it to the extract threads and every file it finds to the
+classify queue. Full queues block the stage feeding them, so a slow stage holds back
+those before it instead of buffering without bound.
+
+Members of a browsed tar archive share its file handle, so they are read one at a
+time under a lock per archive (see `reading`).
+
+Files finish out of order, but scan checkpoints must not move past a file that was not
+indexed yet. Everything the walk does after an entry (marking it scanned, deleting its
+unzipped files) is recorded in a `Ledger` & only run once every file found before it
+has been sent.
+"""
+
+
+import time
+import queue
+import contextlib
+import logging
+import threading
+import collections
+import concurrent.futures
+
+import index
+import paths
+import cancel
+import fields
+import gzindex
+
+
+# Default threads of each stage after the walk
+EXTRACT_THREADS = 2
+CLASSIFY_THREADS = 2
+SERIALIZE_THREADS = 1
+SEND_THREADS = 4
+
+# Default capacity of the queues between stages, in files or batches
+QUEUE_SIZE = 64
+
+# Default number of documents sent to Elasticsearch per bulk request
+BATCH_SIZE = 500
+
+
+class PipelineConfig:
+    """ Concurrency & queue sizes of the pipeline stages """
+
+    @classmethod
+    def from_str(cls, threads):
+        """
+        Builds a config from a string of stage thread counts, as given on the command
+        line: "EXTRACT,CLASSIFY,SERIALIZE,SEND".
+        """
+        counts = [int(count) for count in threads.split(",")]
+        if len(counts) != 4 or min(counts) < 1:
+            raise ValueError("Expected 4 positive thread counts: %s" % threads)
+        return cls(extract_threads=counts[0], classify_threads=counts[1],
+                   serialize_threads=counts[2], send_threads=counts[3])
+
+    def __init__(self, *, extract_threads=EXTRACT_THREADS, classify_threads=CLASSIFY_THREADS,
+                 serialize_threads=SERIALIZE_THREADS, send_threads=SEND_THREADS,
+                 queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE):
+        """ Constructs a config, named params are forced """
+        self.extract_threads = extract_threads
+        self.classify_threads = classify_threads
+        self.serialize_threads = serialize_threads
+        self.send_threads = send_threads
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+
+    def __str__(self):
+        """ Returns a readable string representation of this object """
+        return "extract %d, classify %d, serialize %d, send %d, queues %d, batches %d" % (
+            self.extract_threads, self.classify_threads, self.serialize_threads,
+            self.send_threads, self.queue_size, self.batch_size)
+
+
+class Ledger:
+    """
+    Keeps the order the walk found files & recorded actions in. An action runs once
+    every file opened before it is done, actions running one at a time in the order
+    they were recorded. Once halted, no further action runs.
+    """
+
+    def __init__(self):
+        """ Constructs an empty ledger """
+        self._lock = threading.Lock()
+        self._entries = collections.deque()
+        self._halted = False
+
+    def open_file(self):
+        """ Records a file the walk found, returns the token to pass to `done` """
+        token = [False]
+        with self._lock:
+            self._entries.append(token)
+        return token
+
+    def done(self, token):
+        """ Records that the file of the token was handled, running the actions it held back """
+        token[0] = True
+        self._run_ready()
+
+    def after(self, action):
+        """ Records an action to run once every file opened so far is done """
+        with self._lock:
+            self._entries.append(action)
+        self._run_ready()
+
+    def halt(self):
+        """ Stops running actions, such as after a file could not be handled """
+        with self._lock:
+            self._halted = True
+
+    @property
+    def pending(self):
+        """ Returns the number of files & actions still held back """
+        return len(self._entries)
+
+    def _run_ready(self):
+        """ Runs the actions no longer held back by an unfinished file """
+        with self._lock:
+            while len(self._entries) > 0 and not self._halted:
+                head = self._entries[0]
+                if isinstance(head, list):
+                    if not head[0]:
+                        return
+                    self._entries.popleft()
+                else:
+                    self._entries.popleft()
+                    head()
+
+
+class FileProgress:
+    """ A file being serialized into batches, done once every batch has been sent """
+
+    def __init__(self, token, entry):
+        """ Constructs the progress of the file's ledger token """
+        self.token = token
+        self.entry = entry
+        self.batches = 0
+        self.serialized = False
+        self.error = False
+        self._lock = threading.Lock()
+
+    def add_batch(self):
+        """ Counts one more batch to send """
+        with self._lock:
+            self.batches += 1
+
+    def batch_sent(self, success):
+        """ Counts a sent batch, returns whether the file is done """
+        with self._lock:
+            self.batches -= 1
+            self.error = self.error or not success
+            return self.serialized and self.batches == 0
+
+    def all_batched(self):
+        """ Records that every batch was added, returns whether the file is done """
+        with self._lock:
+            self.serialized = True
+            return self.batches == 0
+
+
+class Pipeline:
+    """
+    Stage threads & queues of one walk. Used as a context manager: leaving it waits
+    for every queued file to be sent and every recorded action to run, then raises
+    the first error any stage ran into.
+    """
+
+    def __init__(self, es, history_dir, config=None):
+        """
+        Constructs the pipeline & starts its stage threads.
+        es: Elasticsearch object
+            Elasticsearch the files are sent to
+        history_dir: string
+            scan history directory, large gzip logs are checkpointed there to resume
+        config: PipelineConfig
+            stage concurrency & queue sizes, None for the defaults
+        """
+        self.es = es
+        self.history_dir = history_dir
+        self.config = config if config is not None else PipelineConfig()
+        self.ledger = Ledger()
+        self.error = None
+        self._ahead = {}
+        self._archive_locks = collections.defaultdict(threading.Lock)
+        self._archive_locks_lock = threading.Lock()
+
+        size = self.config.queue_size
+        self._classify_queue = queue.Queue(size)
+        self._serialize_queue = queue.Queue(size)
+        self._send_queue = queue.Queue(size)
+        self._extract_pool = concurrent.futures.ThreadPoolExecutor(self.config.extract_threads)
+        self._stages = [
+            self._start(self._classify, self._classify_queue, self.config.classify_threads),
+            self._start(self._serialize, self._serialize_queue, self.config.serialize_threads),
+            self._start(self._send, self._send_queue, self.config.send_threads),
+        ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _start(self, work, work_queue, count):
+        """ Starts the threads of a stage, returns (queue, threads) """
+        threads = [threading.Thread(target=self._run_stage, args=(work, work_queue), daemon=True)
+                   for _ in range(count)]
+        for t in threads:
+            t.start()
+        return (work_queue, threads)
+
+    def _run_stage(self, work, work_queue):
+        """ Handles the items of the queue until it holds None """
+        while True:
+            item = work_queue.get()
+            if item is None:
+                return
+            try:
+                work(item)
+            except cancel.Cancelled as e:
+                self._fail(e)
+            except Exception as e:
+                logging.exception("Ingest pipeline stage failed")
+                self._fail(e)
+
+    def _fail(self, error):
+        """ Records the first error, so that nothing after it is marked scanned """
+        if self.error is None:
+            self.error = error
+        self.ledger.halt()
+
+    def extract_ahead(self, entry, func, *args, **kwargs):
+        """
+        Starts unzipping an archive the walk will reach later, if fewer than
+        `extract_threads * 2` archives are being unzipped ahead of it. The walk
+        collects the result with `take_extracted`.
+        entry: QuantumEntry
+            archive that is being unzipped
+        func: function(*args, **kwargs) -> return QuantumEntry
+            unzips the archive, returning the unzipped entry
+        """
+        if self.error is not None or len(self._ahead) >= self.config.extract_threads * 2:
+            return
+        self._ahead[entry.relpath] = self._extract_pool.submit(func, *args, **kwargs)
+
+    def take_extracted(self, entry):
+        """ Returns the unzipped entry of an archive unzipped ahead, None if it was not """
+        future = self._ahead.pop(entry.relpath, None)
+        return None if future is None else future.result()
+
+    def reading(self, entry):
+        """
+        Returns the lock to hold while reading the entry if it is a member of a browsed
+        archive, whose members share the archive's file handle, otherwise a no-op lock.
+        Entries read through others, such as a gzip member of a browsed tar, follow their
+        `archive` down to the file on disk, so they lock the handle they read too.
+        """
+        browsed = None
+        while hasattr(entry, "archive"):
+            if isinstance(entry, paths.ArchiveEntry):
+                browsed = entry
+            entry = entry.archive
+        if browsed is None:
+            return contextlib.nullcontext()
+        with self._archive_locks_lock:
+            return self._archive_locks[browsed.archive.abspath]
+
+    def index_file(self, nodefields, entry):
+        """
+        Queues a file the walk found to be classified & sent, blocking while the
+        classify queue is full.
+        """
+        if self.error is not None:
+            raise self.error
+        token = self.ledger.open_file()
+        self._classify_queue.put((token, nodefields, entry))
+
+    def after(self, action):
+        """ Runs the action once every file queued so far has been sent """
+        self.ledger.after(action)
+
+    def _classify(self, item):
+        """ Classify stage: passes StorageGRID files on to be serialized """
+        (token, nodefields, entry) = item
+        with self.reading(entry):
+            relevant = self.error is None and fields.is_storagegrid(nodefields, entry)
+        if relevant:
+            self._serialize_queue.put(item)
+        else:
+            logging.debug("Skipped Non-StorageGRID file: %s", entry.abspath)
+            self.ledger.done(token)
+
+    def _serialize(self, item):
+        """ Serialize stage: turns the lines of a file into batches of documents """
+        (token, nodefields, entry) = item
+        if self.error is not None:
+            self.ledger.done(token)
+            return
+        if gzindex.GzipCheckpoint.for_entry(entry, self.history_dir) is not None:
+            # Resumable logs acknowledge lines in order, sent on their own
+            index.send_to_es(self.es, nodefields, entry, self.history_dir)
+            self.ledger.done(token)
+            return
+
+        logging.debug("Indexing: %s", entry.relpath)
+        progress = FileProgress(token, entry)
+        send_time = int(round(time.time() * 1000))
+        batch = []
+        with self.reading(entry):
+            for doc in index.set_data(entry, send_time, nodefields):
+                batch.append(doc)
+                if len(batch) == self.config.batch_size:
+                    progress.add_batch()
+                    self._send_queue.put((progress, batch))
+                    batch = []
+        if len(batch) > 0:
+            progress.add_batch()
+            self._send_queue.put((progress, batch))
+        if progress.all_batched():
+            self._file_sent(progress)
+
+    def _send(self, item):
+        """ Send stage: sends a batch of documents in one bulk request """
+        (progress, batch) = item
+        success = self.error is None and index.send_batch(self.es, batch)
+        if progress.batch_sent(success):
+            self._file_sent(progress)
+
+    def _file_sent(self, progress):
+        """ Finishes a file once all its batches were sent """
+        if progress.error:
+            logging.critical("Unable to index: %s", progress.entry.abspath)
+        else:
+            logging.debug("Indexed: %s", progress.entry.relpath)
+        self.ledger.done(progress.token)
+
+    def close(self):
+        """
+        Waits for every queued file to be sent & recorded action to run, then stops
+        the stage threads. Raises the first error a stage ran into.
+        """
+        # Unzipped ahead but never reached (aborted), scratch is deleted with the scan
+        for future in self._ahead.values():
+            future.exception()
+        self._ahead.clear()
+        self._extract_pool.shutdown()
+
+        for (work_queue, threads) in self._stages:
+            for _ in threads:
+                work_queue.put(None)
+            for t in threads:
+                t.join()
+
+        if self.error is not None:
+            raise self.error
+        assert self.ledger.pending == 0, "Every file should have been handled"
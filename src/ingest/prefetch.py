@@ -0,0 +1,299 @@
+"""
+Prefetches the archives of the cases about to be searched from the input directory,
+typically an NFS mount, into a cache directory on a local disk. The manager tells a
+background thread which cases wait next for a worker, and the thread copies their
+archives while the workers search the current cases. `unzip_into_scratch_dir` unzips
+the local copy when there is one, and browsed tars & zips and streamed gzips are read
+from it, so a worker only reads the network for archives the prefetcher did not reach
+in time.
+
+Copies mirror the archives' paths relative to the input directory and keep their
+size & modification time, a copy is only used while both match the original. The
+copies are kept under a byte budget by evicting whole cases that are neither being
+searched nor about to be, those that left the window longest ago first.
+"""
+
+
+import os
+import time
+import shutil
+import logging
+import threading
+
+import unzip
+import cancel
+import paths
+import ratelimit
+
+
+# Cases waiting for a worker whose archives are prefetched
+PREFETCH_CASES = 2
+
+# Default disk budget of the prefetched archives
+PREFETCH_GB = 20
+
+# Suffix of copies being written, removed when the cache is opened
+PARTIAL_SUFFIX = ".prefetching"
+
+# Bytes copied at once, the copy stops between chunks once its case is being searched
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def is_prefetched(relpath):
+    """
+    Returns whether the file is an archive a worker reads, whether it unzips it, browses
+    it in place or streams it.
+    """
+    return os.path.splitext(relpath)[1] in unzip.SUPPORTED_FILE_TYPES
+
+
+class PrefetchCache:
+    """
+    Local copies of the archives of the upcoming cases, see the module docstring.
+    Workers only call `local_entry`, the manager owns the copying thread.
+    """
+
+    def __init__(self, input_dir, cache_dir, budget_bytes, depth=PREFETCH_CASES):
+        """
+        Opens the cache in the directory, creating it if needed & counting the copies
+        left by earlier scans.
+        input_dir: string
+            path to the input directory the archives are copied from
+        cache_dir: string
+            directory on a local disk holding the copies
+        budget_bytes: int
+            max total size of the copies
+        depth: int
+            number of cases waiting for a worker whose archives are copied
+        """
+        self.input_dir = os.path.abspath(input_dir)
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.budget_bytes = budget_bytes
+        self.depth = depth
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._cond = threading.Condition()
+        self._running = set()
+        self._wanted = []
+        self._fetched = set()                       # cases whose archives are all copied
+        self._stalled = False                       # out of budget until a case finishes
+        self._busy = False
+        self._left_at = {}                          # case number -> time it left the window
+        self._sizes = {}                            # case number -> bytes of its copies
+        self._closed = False
+        self._thread = None
+        self._count_copies()
+
+    def _count_copies(self):
+        """ Counts the copies of each case, deleting the copies left partly written """
+        for case_num in os.listdir(self.cache_dir):
+            self._sizes[case_num] = 0
+            self._left_at[case_num] = 0
+            for (dirpath, dirnames, filenames) in os.walk(os.path.join(self.cache_dir, case_num)):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    if name.endswith(PARTIAL_SUFFIX):
+                        unzip.delete_file(path)
+                    else:
+                        self._sizes[case_num] += os.path.getsize(path)
+
+    @property
+    def size(self):
+        """ Returns the total size of the copies in bytes """
+        with self._cond:
+            return sum(self._sizes.values())
+
+    def local_entry(self, entry):
+        """
+        Returns the local copy of the archive as an entry of the cache directory, None
+        if it was not copied or the original changed since.
+        entry: QuantumEntry
+            archive in the input directory
+        """
+        if type(entry) is not paths.QuantumEntry or entry.srcpath != self.input_dir:
+            return None
+        local = paths.QuantumEntry(self.cache_dir, entry.relpath)
+        try:
+            if not is_same_file(os.stat(entry.abspath), os.stat(local.abspath)):
+                return None
+        except OSError:
+            return None
+        logging.debug("Reading prefetched copy: %s", entry.relpath)
+        return local
+
+    def update(self, running, upcoming):
+        """
+        Tells the prefetcher which cases are searched & which wait for a worker, in the
+        order they will start. The copies of both are never evicted.
+        running: iterable of string
+            case numbers of the cases being searched
+        upcoming: iterable of string
+            case numbers of the cases waiting for a worker, next first
+        """
+        with self._cond:
+            running = set(running)
+            wanted = [case_num for case_num in upcoming if case_num not in running][:self.depth]
+            now = time.time()
+            for case_num in (self._running | set(self._wanted)) - running - set(wanted):
+                self._left_at[case_num] = now
+                # Checked again if wanted by a later scan, its archives may have changed
+                self._fetched.discard(case_num)
+            if running != self._running or wanted != self._wanted:
+                # Cases finishing may leave room for more copies
+                self._stalled = False
+            (self._running, self._wanted) = (running, wanted)
+            self._cond.notify_all()
+
+    def start(self):
+        """ Starts the thread copying the archives of the wanted cases """
+        if self._thread is None:
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def wait_idle(self, timeout=None):
+        """ Waits until the wanted cases are copied or out of budget, False on timeout """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._next_case() is None and not self._busy,
+                                       timeout)
+
+    def close(self):
+        """ Stops the copying, keeping the copies for the next scan """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _next_case(self):
+        """ Returns the next wanted case still to copy, None if there is none. Needs the lock. """
+        if self._closed or self._stalled:
+            return None
+        for case_num in self._wanted:
+            if case_num not in self._fetched:
+                return case_num
+        return None
+
+    def _run(self):
+        """ Copies the archives of the wanted cases until closed """
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._next_case() is not None)
+                if self._closed:
+                    return
+                case_num = self._next_case()
+                self._busy = True
+            try:
+                fetched = self.fetch_case(case_num)
+            except OSError as e:
+                logging.warning("Unable to prefetch case %s: %s", case_num, e)
+                fetched = True                      # not retried until the next scan
+            with self._cond:
+                self._busy = False
+                if fetched:
+                    self._fetched.add(case_num)
+                self._cond.notify_all()
+
+    def _should_copy(self, case_num):
+        """ Returns whether to go on copying, not once a worker reads the case itself """
+        with self._cond:
+            return not self._closed and case_num not in self._running and not cancel.requested()
+
+    def fetch_case(self, case_num):
+        """
+        Copies the archives of the case that have no up to date copy yet.
+        case_num: string
+            case number of the case directory
+        return: bool
+            True if every archive was copied or left out for being larger than the
+            whole budget, False if stopped for lack of budget or because the case
+            is being searched
+        """
+        case_dir = os.path.join(self.input_dir, case_num)
+        for (dirpath, dirnames, filenames) in os.walk(case_dir):
+            dirnames.sort()
+            for name in sorted(filenames):
+                relpath = os.path.relpath(os.path.join(dirpath, name), self.input_dir)
+                if not is_prefetched(relpath):
+                    continue
+                if not self._should_copy(case_num):
+                    return False
+                if not self._copy(case_num, relpath):
+                    return False
+        logging.debug("Prefetched case %s, %d bytes cached", case_num, self.size)
+        return True
+
+    def _copy(self, case_num, relpath):
+        """ Copies one archive unless already copied, False if there is no room for it """
+        src_path = os.path.join(self.input_dir, relpath)
+        dest_path = os.path.join(self.cache_dir, relpath)
+        src_stat = os.stat(src_path)
+        try:
+            if is_same_file(src_stat, os.stat(dest_path)):
+                return True
+            self._remove_copy(case_num, dest_path)
+        except FileNotFoundError:
+            pass
+        if src_stat.st_size > self.budget_bytes:
+            logging.debug("Too large to prefetch: %s", relpath)
+            return True
+        if not self._make_room(src_stat.st_size):
+            logging.debug("Prefetch budget is full, waiting for cases to finish")
+            with self._cond:
+                self._stalled = True
+            return False
+
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        tmp_path = dest_path + PARTIAL_SUFFIX
+        with self._cond:
+            self._sizes[case_num] = self._sizes.get(case_num, 0) + src_stat.st_size
+        copied = False
+        try:
+            with ratelimit.open_input(src_path) as src, open(tmp_path, "wb") as dest:
+                while True:
+                    chunk = src.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    if not self._should_copy(case_num):
+                        return False
+            shutil.copystat(src_path, tmp_path)
+            os.replace(tmp_path, dest_path)
+            copied = True
+        finally:
+            if not copied:
+                if os.path.lexists(tmp_path):
+                    unzip.delete_file(tmp_path)
+                with self._cond:
+                    self._sizes[case_num] -= src_stat.st_size
+        return True
+
+    def _remove_copy(self, case_num, path):
+        """ Deletes an outdated copy """
+        size = os.path.getsize(path)
+        unzip.delete_file(path)
+        with self._cond:
+            self._sizes[case_num] = self._sizes.get(case_num, 0) - size
+
+    def _make_room(self, size):
+        """ Evicts cases outside the window until the bytes fit, False if they cannot """
+        with self._cond:
+            protected = self._running | set(self._wanted)
+            evictable = sorted((self._left_at.get(case_num, 0), case_num)
+                               for case_num in self._sizes if case_num not in protected)
+            while sum(self._sizes.values()) + size > self.budget_bytes:
+                if len(evictable) == 0:
+                    return False
+                (_, case_num) = evictable.pop(0)
+                logging.debug("Evicting prefetched case: %s", case_num)
+                del self._sizes[case_num]
+                self._left_at.pop(case_num, None)
+                self._fetched.discard(case_num)
+                if os.path.isdir(os.path.join(self.cache_dir, case_num)):
+                    unzip.delete_directory(os.path.join(self.cache_dir, case_num))
+        return True
+
+
+def is_same_file(src_stat, copy_stat):
+    """ Returns whether the copy still matches the original, by size & modification time """
+    return src_stat.st_size == copy_stat.st_size and src_stat.st_mtime_ns == copy_stat.st_mtime_ns
@@ -0,0 +1,243 @@
+"""
+Scratch space quota shared by every scan worker process. Before unzipping an archive a
+worker reserves the size the archive is estimated to unzip to (read from the archive
+headers), blocking while other workers hold the rest of the budget. The reservation is
+released once the unzipped files are deleted from scratch.
+"""
+
+
+import os
+import struct
+import tarfile
+import zipfile
+import logging
+import multiprocessing
+
+import unzip
+import cache
+import sevenzip
+import ratelimit
+
+
+# Assumed ratio of unzipped to compressed size of archives nested inside an archive
+NESTED_ARCHIVE_RATIO = 4
+
+# Seconds between log messages while waiting for scratch space
+WAIT_LOG_PERIOD = 60
+
+
+class ScratchQuota:
+    """
+    Byte budget of scratch space shared between processes. The bytes in use live in
+    shared memory, so the quota must be created before the worker processes and handed
+    to them (such as through a pool initializer). Each process remembers the paths it
+    reserved space for, so the space can be released by path once they are deleted.
+
+    Workers holding part of the budget could wait on each other forever, so one process
+    at a time may go over budget: a process already holding a reservation that does not
+    fit is granted it over budget if no other process is, and from then on never waits
+    until that reservation is released. The others wait for it, which always makes
+    progress. A reservation larger than the whole budget is granted the same way once
+    nothing else is reserved.
+    """
+
+    def __init__(self, budget_bytes):
+        """ Constructs a quota of the given number of bytes, nothing reserved """
+        self.budget_bytes = budget_bytes
+        self._used = multiprocessing.Value("q", 0, lock=False)
+        self._over_pid = multiprocessing.Value("q", 0, lock=False)  # 0 if none is over budget
+        self._cond = multiprocessing.Condition()
+        self._held_pid = os.getpid()
+        self._held_by_pid = {}
+        self._over_path = None
+
+    @property
+    def _held(self):
+        """ Returns the reservations of this process, forked processes start with none """
+        if self._held_pid != os.getpid():
+            self._held_pid = os.getpid()
+            self._held_by_pid = {}
+            self._over_path = None
+        return self._held_by_pid
+
+    @property
+    def used_bytes(self):
+        """ Returns the number of bytes reserved by all processes """
+        return self._used.value
+
+    def reserve(self, path, nbytes):
+        """
+        Reserves space for the files about to be written at the path, waiting until
+        the budget allows it.
+        path: string
+            path of the file or directory the space is for
+        nbytes: int
+            number of bytes to reserve
+        """
+        held = self._held
+        with self._cond:
+            waited = False
+            while not self._fits(nbytes):
+                if not waited:
+                    logging.info("Waiting for scratch space: need %s, %s of %s in use",
+                                 format_bytes(nbytes), format_bytes(self._used.value),
+                                 format_bytes(self.budget_bytes))
+                waited = True
+                self._cond.wait(WAIT_LOG_PERIOD)
+            if self._used.value + nbytes > self.budget_bytes and self._over_pid.value == 0:
+                self._over_pid.value = os.getpid()
+                self._over_path = path
+            self._used.value += nbytes
+            used = self._used.value
+
+        held[path] = held.get(path, 0) + nbytes
+        logging.info("Reserved %s of scratch space, %s of %s in use: %s", format_bytes(nbytes),
+                     format_bytes(used), format_bytes(self.budget_bytes), path)
+
+    def reserve_archive(self, path, archive_path, member_filter=None):
+        """
+        Reserves space for unzipping the archive to the path, estimated from its headers.
+        path: string
+            path of the file or directory the archive unzips to
+        archive_path: string
+            path to the archive
+        member_filter: function(member_relpath) -> return bool
+            only members accepted by the filter will be unzipped, None unzips all
+        """
+        self.reserve(path, estimate_unzipped_size(archive_path, member_filter))
+
+    def try_reserve(self, path, nbytes):
+        """
+        Reserves space for the files about to be written at the path only if it fits
+        in the budget right now, never waiting or going over budget.
+        path: string
+            path of the file or directory the space is for
+        nbytes: int
+            number of bytes to reserve
+        return: bool
+            True if the space was reserved
+        """
+        with self._cond:
+            if self._used.value + nbytes > self.budget_bytes:
+                return False
+            self._used.value += nbytes
+            used = self._used.value
+
+        self._held[path] = self._held.get(path, 0) + nbytes
+        logging.debug("Reserved %s of scratch space, %s of %s in use: %s", format_bytes(nbytes),
+                      format_bytes(used), format_bytes(self.budget_bytes), path)
+        return True
+
+    def try_reserve_archive(self, path, archive_path, member_filter=None):
+        """
+        Reserves space for unzipping the archive to the path only if its estimated
+        size fits in the budget right now, see `try_reserve`.
+        return: bool
+            True if the space was reserved
+        """
+        return self.try_reserve(path, estimate_unzipped_size(archive_path, member_filter))
+
+    def _fits(self, nbytes):
+        """ Returns whether the reservation may go ahead, must hold the condition """
+        used = self._used.value
+        if used + nbytes <= self.budget_bytes or self._over_pid.value == os.getpid():
+            return True
+        return self._over_pid.value == 0 and (used == 0 or len(self._held) != 0)
+
+    def settle(self, path):
+        """ Replaces the estimate reserved for the path with the size of its files now """
+        if path not in self._held:
+            return
+        nbytes = cache.tree_size(path) if os.path.exists(path) else 0
+        with self._cond:
+            self._used.value += nbytes - self._held[path]
+            self._cond.notify_all()
+        self._held[path] = nbytes
+
+    def release(self, path):
+        """ Releases the space reserved for the path, once its files have been deleted """
+        nbytes = self._held.pop(path, None)
+        if nbytes is None:
+            return
+        with self._cond:
+            self._used.value -= nbytes
+            used = self._used.value
+            if path == self._over_path:
+                # Another process may now go over budget
+                self._over_pid.value = 0
+                self._over_path = None
+            self._cond.notify_all()
+        logging.debug("Released %s of scratch space, %s of %s in use", format_bytes(nbytes),
+                      format_bytes(used), format_bytes(self.budget_bytes))
+
+    def release_all(self):
+        """ Releases every reservation held by this process """
+        for path in list(self._held):
+            self.release(path)
+
+
+def estimate_unzipped_size(path, member_filter=None):
+    """
+    Estimates the bytes an archive unzips to from its headers, without unzipping it.
+    Zip & 7z archives list their member sizes, tar headers are read in a single pass
+    and gzip streams store their size (modulo 4 GiB) in the trailer. Nested archives
+    are assumed to unzip to NESTED_ARCHIVE_RATIO times their size.
+    path: string
+        path to the archive
+    member_filter: function(member_relpath) -> return bool
+        only members accepted by the filter are counted, None counts all
+    return: int
+        estimated number of bytes, the archive's own size if it cannot be read
+    """
+    extension = os.path.splitext(path)[1]
+    accepted = lambda name: member_filter is None or member_filter(name)
+    try:
+        if extension == ".zip":
+            with ratelimit.open_input(path) as fd, zipfile.ZipFile(fd, "r") as z:
+                members = [(m.filename, m.file_size) for m in z.infolist() if not m.is_dir()]
+        elif extension == ".tar":
+            with ratelimit.open_input(path) as fd, tarfile.open(fileobj=fd, mode="r:") as tar:
+                members = [(m.name, m.size) for m in tar if m.isfile()]
+        elif extension == ".7z" and sevenzip.AVAILABLE:
+            members = list(sevenzip.list_members(path).items())
+        elif extension in (".gz", ".tgz"):
+            return gzip_unzipped_size(path)
+        else:
+            return os.path.getsize(path)
+    except Exception as e:
+        # Corrupt or unsupported, unzipping will fail fast anyway
+        logging.debug("Unable to read archive headers of %s: %s", path, e)
+        return os.path.getsize(path)
+
+    total = 0
+    for (name, size) in members:
+        if os.path.splitext(name)[1] in unzip.SUPPORTED_FILE_TYPES:
+            total += size * NESTED_ARCHIVE_RATIO
+        elif accepted(name):
+            total += size
+    return total
+
+
+def gzip_unzipped_size(path):
+    """
+    Returns the decompressed size of a gzip stream from its trailer, which only keeps
+    the size modulo 4 GiB. Streams large enough to have wrapped can't shrink much, so
+    their size is raised in 4 GiB steps until it is at least the compressed size.
+    """
+    compressed = os.path.getsize(path)
+    with ratelimit.open_input(path) as fd:
+        fd.seek(-4, os.SEEK_END)
+        size = struct.unpack("<I", fd.read(4))[0]
+    # Deflate inflates at most ~1032x, smaller streams can't hold 4 GiB
+    while compressed >= 2**32 // 1032 and size < compressed:
+        size += 2**32
+    return size
+
+
+def format_bytes(nbytes):
+    """ Returns the number of bytes written in human readable units """
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(nbytes) < 1024:
+            return "%.1f %s" % (nbytes, unit)
+        nbytes /= 1024
+    return "%.1f TB" % nbytes
@@ -0,0 +1,205 @@
+"""
+Rate limit of the reads from the input directory, shared by the manager & every worker
+process, so that a scan running at full speed leaves the filer holding the input
+directory (typically over NFS) usable by the people browsing it. The limit is a token
+bucket in shared memory with a rate for the day and one for the night: a read takes
+its bytes from the bucket, waiting for the bucket to refill when it runs short.
+
+Files of the input directory are opened through `open_input`, which counts their
+reads against the limiter installed in the process, see `install`. Files elsewhere,
+such as scratch space or prefetched copies on a local disk, are read unthrottled.
+"""
+
+
+import io
+import os
+import time
+import multiprocessing
+
+import cancel
+
+
+# Hours of the day (local time) the day rate applies, the night rate applies otherwise
+DAY_HOURS = (7, 19)
+
+# Seconds of reads at the current rate the bucket holds, reads up to this burst never wait
+BURST_SECONDS = 1
+
+# Bytes read before they are taken from the bucket, to keep the shared lock out of each line
+THROTTLE_CHUNK_BYTES = 64 * 1024
+
+# Longest sleep between checks for cancellation while throttled
+SLEEP_SLICE_SECONDS = 0.5
+
+# Limiter of this process, see `install`
+_limiter = None
+
+
+class ReadLimiter:
+    """
+    Token bucket limiting the bytes read per second from the input directory across
+    processes. The bucket lives in shared memory, so the limiter must be created before
+    the worker processes and handed to them (such as through a pool initializer). A
+    read larger than the bucket is let through, the reads after it wait off its debt.
+    """
+
+    def __init__(self, input_dir, day_rate, night_rate, day_hours=DAY_HOURS):
+        """
+        Constructs a limiter with a full bucket.
+        input_dir: string
+            directory whose files are throttled
+        day_rate: float
+            max bytes read per second during the day, None for no limit
+        night_rate: float
+            max bytes read per second during the night, None for no limit
+        day_hours: (int, int)
+            first hour of the day & first hour of the night, in local time
+        """
+        self.input_dir = os.path.abspath(input_dir)
+        self.day_rate = day_rate
+        self.night_rate = night_rate
+        self.day_hours = day_hours
+        self._lock = multiprocessing.Lock()
+        self._tokens = multiprocessing.Value("d", 0.0, lock=False)
+        self._stamp = multiprocessing.Value("d", 0.0, lock=False)
+        self._read_bytes = multiprocessing.Value("q", 0, lock=False)
+        self._throttled_seconds = multiprocessing.Value("d", 0.0, lock=False)
+
+    def rate(self, now=None):
+        """ Returns the bytes per second allowed at the time (seconds since the epoch), None if unlimited """
+        hour = time.localtime(now).tm_hour
+        (day_start, night_start) = self.day_hours
+        if day_start <= night_start:
+            is_day = day_start <= hour < night_start
+        else:
+            is_day = hour >= day_start or hour < night_start
+        return self.day_rate if is_day else self.night_rate
+
+    def is_limited(self, path):
+        """ Returns whether the reads of the file are throttled """
+        path = os.path.abspath(path)
+        return path == self.input_dir or path.startswith(self.input_dir + os.sep)
+
+    def acquire(self, nbytes):
+        """
+        Takes the bytes read from the bucket, sleeping until the bucket has refilled
+        enough to pay for them. Stops sleeping once the scan is cancelled.
+        nbytes: int
+            number of bytes read
+        """
+        rate = self.rate()
+        with self._lock:
+            self._read_bytes.value += nbytes
+            if rate is None:
+                return
+            now = time.monotonic()
+            burst = rate * BURST_SECONDS
+            tokens = min(burst, self._tokens.value + (now - self._stamp.value) * rate) - nbytes
+            self._tokens.value = tokens
+            self._stamp.value = now
+            wait = -tokens / rate if tokens < 0 else 0
+            self._throttled_seconds.value += wait
+
+        deadline = time.monotonic() + wait
+        while not cancel.requested():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            time.sleep(min(left, SLEEP_SLICE_SECONDS))
+
+    def take_metrics(self):
+        """
+        Returns the bytes read & the seconds spent throttled by all processes since the
+        last call, and starts counting anew.
+        return: (int, float)
+        """
+        with self._lock:
+            metrics = (self._read_bytes.value, self._throttled_seconds.value)
+            self._read_bytes.value = 0
+            self._throttled_seconds.value = 0.0
+        return metrics
+
+
+class ThrottledReader(io.BufferedIOBase):
+    """
+    File of the input directory whose reads are counted against a limiter, by chunks of
+    THROTTLE_CHUNK_BYTES. Reads like the file it wraps, including seeking, so it can be
+    handed to tarfile, zipfile, gzip, py7zr & indexed_gzip. It has no `fileno`, so that
+    libraries read it through its methods instead of reading the descriptor unthrottled.
+    """
+
+    def __init__(self, fileobj, limiter):
+        """ Wraps the open file, throttled by the limiter """
+        super().__init__()
+        self._file = fileobj
+        self._limiter = limiter
+        self._unpaid = 0
+
+    def _pay(self, nbytes, chunk=THROTTLE_CHUNK_BYTES):
+        """ Counts bytes read, waiting once a chunk of them was read """
+        self._unpaid += nbytes
+        if self._unpaid >= chunk and self._unpaid > 0:
+            (nbytes, self._unpaid) = (self._unpaid, 0)
+            self._limiter.acquire(nbytes)
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self._pay(len(data))
+        return data
+
+    def read1(self, size=-1):
+        data = self._file.read1(size)
+        self._pay(len(data))
+        return data
+
+    def readinto(self, buffer):
+        nbytes = self._file.readinto(buffer)
+        self._pay(nbytes or 0)
+        return nbytes
+
+    def readline(self, size=-1):
+        line = self._file.readline(size)
+        self._pay(len(line))
+        return line
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self._file.seekable()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        if not self.closed:
+            self._pay(0, chunk=0)
+            self._file.close()
+
+    def __getattr__(self, name):
+        # Everything else that reads nothing, such as name & mode
+        return getattr(self._file, name)
+
+
+def install(limiter):
+    """ Uses the limiter for the reads of this process, None not to throttle them """
+    global _limiter
+    _limiter = limiter
+
+
+def open_input(path, mode="rb"):
+    """
+    Opens the file for reading like `open`, throttled by the installed limiter if the
+    file is in its input directory.
+    """
+    fileobj = open(path, mode)
+    if _limiter is None or not _limiter.is_limited(path):
+        return fileobj
+    return ThrottledReader(fileobj, _limiter)
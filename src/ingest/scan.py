@@ -24,7 +24,11 @@ import logging
 import os
 import sys
 import time
+import shutil
 import signal
+import functools
+import contextlib
+import collections
 import concurrent.futures
 from tqdm import tqdm
 import multiprocessing
@@ -32,8 +36,23 @@ import multiprocessing
 from elasticsearch import Elasticsearch
 
 import incremental
+import cancel
 import unzip
+import cache
+import prefetch
+import ratelimit
+import quota
+import manifest
+import subtasks
+import casestats
+import governor
+import changes
+import coordinate
+import pipeline
+import daemon
+import archive
 import index
+import gzindex
 import fields
 import paths
 
@@ -43,9 +62,60 @@ code_src_dir = os.path.dirname(os.path.realpath(__file__))
 # Data directory
 intermediate_dir = os.path.join(code_src_dir, "..", "..", "data")
 
-# Max number of workers (None = number of processors)
+# Max number of workers (None = processors & memory available to the cgroup, see `governor`)
 MAX_WORKERS = None
 
+# Resident bytes a worker may hold after a case before the workers are recycled (None = unlimited)
+worker_rss_bytes = None
+
+# Max archives unzipped at once across all workers (None = unlimited)
+max_extractions = None
+
+# Max bulk sends to Elasticsearch at once across all workers (None = unlimited)
+max_senders = None
+
+# Directory of the persistent extraction cache
+extraction_cache_dir = os.path.join(intermediate_dir, "extraction-cache")
+
+# Default byte budget of the extraction cache, in gigabytes
+EXTRACTION_CACHE_GB = 10
+
+# Cache of unzipped archives shared by all workers (None = disabled)
+extraction_cache = None
+
+# Local copies of the archives of the upcoming cases (None = disabled)
+prefetch_cache = None
+
+# Rate limit of the reads from the input directory shared by all workers (None = unlimited)
+read_limiter = None
+
+# Default share of the scratch volume's free space the workers may unzip into at once
+SCRATCH_QUOTA_FRACTION = 0.8
+
+# Scratch space quota shared by all workers (None = unlimited)
+scratch_quota = None
+
+# Default parent directory of the RAM backed scratch directory
+RAM_SCRATCH_ROOT = "/dev/shm"
+
+# RAM backed scratch space quota shared by all workers (None = RAM scratch disabled)
+ram_scratch_quota = None
+
+# Archives stopped by each decompression limit in the case being searched by this worker
+exceeded_limits = collections.Counter()
+
+# Cached archive manifests, used to skip archives without relevant members (None = disabled)
+manifest_store = None
+
+# Default size of cases split into sub-tasks searched by several workers, in gigabytes
+SPLIT_CASE_GB = 8
+
+# Cases larger than this many bytes are split into sub-tasks (None = never split)
+split_case_bytes = SPLIT_CASE_GB * 1024**3
+
+# Stage concurrency of the ingest pipeline in each worker (None = search entries one at a time)
+pipeline_config = None
+
 # Path to the Elasticsearch mappings
 mappings_path = os.path.join(code_src_dir, "..", "elasticsearch/mappings.json")
 
@@ -55,6 +125,12 @@ graceful_abort = False
 # Elasticsearch host
 es_host = "http://%s:9200" % os.environ.get("ELASTICSEARCH_HOST", "localhost")
 
+# Elasticsearch connection of this process & its pid, reused by every case it searches
+es_connection = None
+
+# Directory of the daemon's job queue
+jobs_dir = os.path.join(intermediate_dir, "daemon-jobs")
+
 LOG_LEVEL_STRS = {
     "WARNING": logging.WARNING,
     "INFO": logging.INFO,
@@ -80,6 +156,76 @@ def main():
     parser.add_argument('-s', '-scratch-space-dir', dest='scratch_space', action='store',
                         help='Scratch space directory to unzip files into')
     parser.add_argument('-p','--processor',dest='processor_num',type=int,help='Processor number')
+    parser.add_argument('--worker-rss-mb', dest='worker_rss_mb', type=float,
+                        help='Recycle the workers between cases once one holds more resident '
+                             'memory than this, 0 never does (default: its share of the '
+                             'memory limit)')
+    parser.add_argument('--max-extractions', dest='max_extractions', type=int,
+                        help='Max archives unzipped at once across all workers, 0 is '
+                             'unlimited (default: one per worker)')
+    parser.add_argument('--max-senders', dest='max_senders', type=int,
+                        help='Max bulk sends to Elasticsearch at once across all workers, '
+                             '0 is unlimited (default: two per worker)')
+    parser.add_argument('--unzip-threads', dest='unzip_threads', type=int,
+                        default=unzip.UNZIP_THREADS,
+                        help='Max threads unzipping sibling nested archives within a case')
+    parser.add_argument('--cache-size-gb', dest='cache_size_gb', type=float,
+                        default=EXTRACTION_CACHE_GB,
+                        help='Disk budget of the persistent extraction cache, 0 disables it. '
+                             'Only used on the file system of the scratch directory')
+    parser.add_argument('--prefetch-dir', dest='prefetch_dir',
+                        help='Directory on a local disk to copy the archives of the next '
+                             'cases into while the current ones are searched, unset disables it')
+    parser.add_argument('--prefetch-cases', dest='prefetch_cases', type=int,
+                        default=prefetch.PREFETCH_CASES,
+                        help='Cases waiting for a worker whose archives are prefetched')
+    parser.add_argument('--prefetch-gb', dest='prefetch_gb', type=float,
+                        default=prefetch.PREFETCH_GB,
+                        help='Disk budget of the prefetched archives')
+    parser.add_argument('--read-mbps-day', dest='read_mbps_day', type=float, default=0,
+                        help='Max megabytes read per second from the input directory by all '
+                             'workers during the day, 0 is unlimited')
+    parser.add_argument('--read-mbps-night', dest='read_mbps_night', type=float, default=0,
+                        help='Max megabytes read per second from the input directory by all '
+                             'workers during the night, 0 is unlimited')
+    parser.add_argument('--day-hours', dest='day_hours',
+                        default='%d-%d' % ratelimit.DAY_HOURS,
+                        help='Hours the day read rate applies, in local time, as START-END')
+    parser.add_argument('--scratch-quota-gb', dest='scratch_quota_gb', type=float,
+                        help='Max scratch space in use by all workers at once, 0 is unlimited '
+                             '(default: 80%% of the free space)')
+    parser.add_argument('--ram-scratch-mb', dest='ram_scratch_mb', type=float, default=0,
+                        help='Unzip archives into a RAM backed scratch directory while they '
+                             'fit in this many megabytes, spilling to disk beyond it, 0 disables it')
+    parser.add_argument('--ram-scratch-dir', dest='ram_scratch_root', default=RAM_SCRATCH_ROOT,
+                        help='tmpfs directory holding the RAM backed scratch directory')
+    parser.add_argument('--split-case-gb', dest='split_case_gb', type=float, default=SPLIT_CASE_GB,
+                        help='Split cases larger than this into sub-tasks searched by several '
+                             'workers, 0 never splits')
+    parser.add_argument('--pipeline', dest='pipeline', action='store_true',
+                        help='Unzip, classify, serialize and send files in pipelined stages')
+    parser.add_argument('--pipeline-threads', dest='pipeline_threads', default='%d,%d,%d,%d' % (
+                            pipeline.EXTRACT_THREADS, pipeline.CLASSIFY_THREADS,
+                            pipeline.SERIALIZE_THREADS, pipeline.SEND_THREADS),
+                        help='Threads of the extract, classify, serialize and send stages '
+                             'of each worker\'s pipeline')
+    parser.add_argument('--pipeline-queue', dest='pipeline_queue', type=int,
+                        default=pipeline.QUEUE_SIZE,
+                        help='Files or batches each pipeline queue holds before blocking')
+    parser.add_argument('--changed-only', dest='changed_only', action='store_true',
+                        help='Only search the cases with directories changed since the last '
+                             'completed scan, watched with inotify by --daemon if available')
+    parser.add_argument('--coordinate-dir', dest='coordinate_dir',
+                        help='Directory shared by several hosts ingesting the same input '
+                             'directory, each host claims the cases it searches there')
+    parser.add_argument('--daemon', dest='daemon', action='store_true',
+                        help='Keep running with a warm worker pool, running the jobs '
+                             'submitted with --submit one at a time')
+    parser.add_argument('--submit', dest='submit', metavar='JOB',
+                        help='Submit a job to the daemon & follow its progress: scan, '
+                             'case:CASE_NUM or path:PATH relative to input_dir')
+    parser.add_argument('--jobs-dir', dest='jobs_dir', default=jobs_dir,
+                        help='Directory of the daemon\'s job queue')
     args = parser.parse_args()
 
     log_level = LOG_LEVEL_STRS.get(args.log_level, "DEBUG")
@@ -92,13 +238,31 @@ def main():
         print('input_dir is not a directory')
         sys.exit(1)
 
+    if args.submit is not None:
+        try:
+            job = daemon.parse_job(args.submit, args.input_dir)
+        except ValueError as e:
+            parser.print_usage()
+            print(e)
+            sys.exit(1)
+        sys.exit(submit_job(job, args.jobs_dir))
+
+    if args.coordinate_dir is not None and args.changed_only:
+        parser.print_usage()
+        print('--changed-only cannot be combined with --coordinate-dir')
+        sys.exit(1)
+
     get_es_connection()
     
     tmp_scratch_folder = '-'.join(["scratch-space",str(int(time.time()))])+'/'
     if args.scratch_space is not None:
-        scratch_dir = os.path.join(os.path.abspath(args.scratch_space), tmp_scratch_folder)
+        scratch_root = os.path.abspath(args.scratch_space)
     else:
-        scratch_dir = os.path.join(intermediate_dir, tmp_scratch_folder)
+        scratch_root = intermediate_dir
+    scratch_dir = os.path.join(scratch_root, tmp_scratch_folder)
+    
+    # Scratch directories of killed scans are never cleaned up by their owner
+    cache.reclaim_scratch_dirs(scratch_root)
 
     if not os.path.exists(scratch_dir):
         os.makedirs(scratch_dir)
@@ -106,6 +270,68 @@ def main():
         parser.print_usage()
         print('output_directory is not a directory')
         sys.exit(1)
+    cache.claim_scratch_dir(scratch_dir)
+    
+    global extraction_cache
+    if args.cache_size_gb > 0:
+        extraction_cache = cache.ExtractionCache(extraction_cache_dir,
+                                                 int(args.cache_size_gb * 1024**3))
+        if not cache.is_same_filesystem(extraction_cache.cache_dir, scratch_dir):
+            # Hard links would fail, every hit & store would copy the unzipped trees
+            logging.warning("Extraction cache disabled, %s is not on the file system of "
+                            "the scratch directory %s", extraction_cache.cache_dir, scratch_dir)
+            extraction_cache = None
+    
+    global read_limiter
+    if args.read_mbps_day > 0 or args.read_mbps_night > 0:
+        try:
+            day_hours = tuple(int(hour) % 24 for hour in args.day_hours.split("-"))
+            assert len(day_hours) == 2
+        except (ValueError, AssertionError):
+            parser.print_usage()
+            print('--day-hours must be START-END, such as 7-19')
+            sys.exit(1)
+        read_limiter = ratelimit.ReadLimiter(
+            args.input_dir, args.read_mbps_day * 1024**2 if args.read_mbps_day > 0 else None,
+            args.read_mbps_night * 1024**2 if args.read_mbps_night > 0 else None, day_hours)
+        ratelimit.install(read_limiter)
+        logging.info("Input reads limited to %s MB/s from %d:00 & %s MB/s from %d:00",
+                     args.read_mbps_day or "unlimited", day_hours[0],
+                     args.read_mbps_night or "unlimited", day_hours[1])
+    
+    global prefetch_cache
+    if args.prefetch_dir is not None and args.prefetch_cases > 0 and args.prefetch_gb > 0:
+        prefetch_cache = prefetch.PrefetchCache(args.input_dir, args.prefetch_dir,
+                                                int(args.prefetch_gb * 1024**3),
+                                                args.prefetch_cases)
+        prefetch_cache.start()
+        logging.info("Prefetching %d cases ahead into %s, %s cached", prefetch_cache.depth,
+                     prefetch_cache.cache_dir, quota.format_bytes(prefetch_cache.size))
+    
+    global scratch_quota
+    if args.scratch_quota_gb is None:
+        quota_bytes = int(shutil.disk_usage(scratch_dir).free * SCRATCH_QUOTA_FRACTION)
+    else:
+        quota_bytes = int(args.scratch_quota_gb * 1024**3)
+    if quota_bytes > 0:
+        scratch_quota = quota.ScratchQuota(quota_bytes)
+        logging.info("Scratch space quota: %s", quota.format_bytes(quota_bytes))
+
+    global ram_scratch_quota
+    ram_scratch_dir = None
+    if args.ram_scratch_mb > 0:
+        if os.path.isdir(args.ram_scratch_root):
+            ram_scratch_root = os.path.abspath(args.ram_scratch_root)
+            ram_scratch_dir = os.path.join(ram_scratch_root, tmp_scratch_folder)
+            cache.reclaim_scratch_dirs(ram_scratch_root)
+            os.makedirs(ram_scratch_dir, exist_ok=True)
+            cache.claim_scratch_dir(ram_scratch_dir)
+            ram_scratch_quota = quota.ScratchQuota(int(args.ram_scratch_mb * 1024**2))
+            logging.info("RAM scratch space: %s in %s",
+                         quota.format_bytes(ram_scratch_quota.budget_bytes), ram_scratch_dir)
+        else:
+            logging.warning("RAM scratch directory does not exist, unzipping to disk only: %s",
+                            args.ram_scratch_root)
 
     # Should not allow configuration of intermediate directory
     history_dir = os.path.join(intermediate_dir, "scan-history")
@@ -115,21 +341,68 @@ def main():
     logging.getLogger("requests").setLevel(logging.WARNING)
     logging.getLogger("urllib3").setLevel(logging.CRITICAL)
 
-    global MAX_WORKERS
-    MAX_WORKERS = args.processor_num
+    global MAX_WORKERS, split_case_bytes
+    MAX_WORKERS = args.processor_num if args.processor_num else governor.pool_size()
+    
+    global worker_rss_bytes, max_extractions, max_senders
+    if args.worker_rss_mb is None:
+        worker_rss_bytes = governor.default_rss_ceiling(MAX_WORKERS)
+    elif args.worker_rss_mb > 0:
+        worker_rss_bytes = int(args.worker_rss_mb * 1024**2)
+    if args.max_extractions is None:
+        max_extractions = MAX_WORKERS
+    elif args.max_extractions > 0:
+        max_extractions = args.max_extractions
+    if args.max_senders is None:
+        max_senders = 2 * MAX_WORKERS
+    elif args.max_senders > 0:
+        max_senders = args.max_senders
+    logging.info("Workers: %d, recycled past %s resident, %s extractions & %s bulk sends at once",
+                 MAX_WORKERS, "no limit" if worker_rss_bytes is None else
+                 quota.format_bytes(worker_rss_bytes), max_extractions or "unlimited",
+                 max_senders or "unlimited")
+    unzip.UNZIP_THREADS = max(1, args.unzip_threads)
+    split_case_bytes = int(args.split_case_gb * 1024**3) if args.split_case_gb > 0 else None
+    
+    global pipeline_config
+    if args.pipeline:
+        try:
+            pipeline_config = pipeline.PipelineConfig.from_str(args.pipeline_threads)
+        except ValueError as e:
+            parser.print_usage()
+            print(e)
+            sys.exit(1)
+        pipeline_config.queue_size = max(1, args.pipeline_queue)
+        logging.info("Ingest pipeline: %s", pipeline_config)
 
     def signal_handler(signum, frame):
-        if signum == signal.SIGINT:
+        if signum in [signal.SIGINT, signal.SIGTERM]:
             logging.info("Gracefully aborting")
             global graceful_abort
             graceful_abort = True
+            # Workers stop at their next check instead of finishing their cases
+            cancel.request()
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    coordinator = None
+    if args.coordinate_dir is not None:
+        coordinator = coordinate.Coordinator(os.path.abspath(args.coordinate_dir))
+        logging.info("Coordinating with other hosts in %s as %s", coordinator.coordinate_dir,
+                     coordinator.host_id)
 
     try:
+        if args.daemon:
+            run_daemon(args.input_dir, scratch_dir, history_dir, ram_scratch_dir, args.jobs_dir,
+                       changed_only=args.changed_only, coordinator=coordinator)
+            logging.info("Daemon stopped")
+            return
+        
         # ingest_log_files from the input directory
         logging.debug("Ingesting: %s", args.input_dir)
-        ingest_log_files(args.input_dir, scratch_dir, history_dir)
-        if graceful_abort:
+        ingest_log_files(args.input_dir, scratch_dir, history_dir, ram_scratch_dir,
+                         changed_only=args.changed_only, coordinator=coordinator)
+        if abort_requested():
             logging.info("Graceful abort successful")
         else:
             logging.info("Finished ingesting")
@@ -138,12 +411,27 @@ def main():
         raise e
     
     finally:
+        if coordinator is not None:
+            coordinator.close()
+        if prefetch_cache is not None:
+            prefetch_cache.close()
         logging.info("Cleaning up scratch space")
         # Always delete scratch_dir
         unzip.delete_directory(scratch_dir)     
+        if ram_scratch_dir is not None:
+            unzip.delete_directory(ram_scratch_dir)
 
 
 def get_es_connection():
+    """
+    Returns this process's connection to Elasticsearch, creating the index if it does
+    not exist. The connection is reused by later calls in the same process, a forked
+    worker opens its own instead of sharing the sockets of its parent.
+    """
+    global es_connection
+    if es_connection is not None and es_connection[0] == os.getpid():
+        return es_connection[1]
+    
     es = Elasticsearch([es_host], verify_certs = True)
     if not es.ping():
         raise Exception("Unable to connect to Elasticsearch")
@@ -152,10 +440,94 @@ def get_es_connection():
             mappings = mappings_file.read()
         logging.info("Index %s did not exist. Creating.", index.INDEX_NAME)
         es.indices.create(index.INDEX_NAME, body=mappings)
+    es_connection = (os.getpid(), es)
     return es
 
 
-def ingest_log_files(input_dir, scratch_dir, history_dir):
+def run_daemon(input_dir, scratch_dir, history_dir, ram_scratch_dir, jobs_dir, *,
+               changed_only=False, coordinator=None):
+    """
+    Runs the jobs submitted to the queue in the jobs directory until aborted, keeping
+    one warm worker pool for all of them. See `daemon` for the queue.
+    input_dir: string
+        path to the input directory, jobs for another input directory fail
+    scratch_dir: string
+        path to the scratch directory
+    history_dir: string
+        path to the history directory
+    ram_scratch_dir: string
+        path to the RAM backed scratch directory, None to only unzip to disk
+    jobs_dir: string
+        path to the directory of the job queue
+    changed_only: bool
+        scan jobs only search the cases that changed since the last completed scan,
+        watching the input directory with inotify if it is available
+    coordinator: Coordinator
+        scan jobs only search the cases this host claims from the other hosts, None
+        if this host is the only one
+    """
+    queue = daemon.JobQueue(jobs_dir)
+    store = manifest.ManifestStore(history_dir)
+    pool = [open_worker_pool(store)]
+    watcher = None
+    if changed_only and changes.AVAILABLE:
+        if changes.is_local_filesystem(input_dir):
+            watcher = changes.ChangeWatcher(input_dir)
+        else:
+            logging.info("Input directory is not on a local filesystem, not watched with inotify")
+    
+    def run_job(job, report):
+        if job.input_dir != os.path.abspath(input_dir):
+            raise ValueError("Job is for another input directory: %s" % job.input_dir)
+        try:
+            if job.kind == "scan":
+                ingest_log_files(input_dir, scratch_dir, history_dir, ram_scratch_dir,
+                                 executor=pool[0], report=report,
+                                 changed_only=changed_only, watcher=watcher,
+                                 coordinator=coordinator)
+            elif job.kind == "case":
+                ingest_case(input_dir, scratch_dir, history_dir, ram_scratch_dir, job.target,
+                            executor=pool[0], report=report)
+            else:
+                rescan_path(input_dir, scratch_dir, history_dir, ram_scratch_dir, job.target,
+                            executor=pool[0], report=report)
+        except concurrent.futures.process.BrokenProcessPool:
+            # A worker died, later jobs get a new pool
+            pool[0].shutdown(wait=False)
+            pool[0] = open_worker_pool(store)
+            raise
+        return "aborted" if abort_requested() else "done"
+    
+    try:
+        daemon.serve(queue, run_job, abort_requested)
+    finally:
+        pool[0].shutdown()
+        if watcher is not None:
+            watcher.stop()
+
+
+def submit_job(job, jobs_dir):
+    """
+    Submits the job to the daemon's queue & logs its progress until it finishes.
+    job: Job
+        job that is submitted
+    jobs_dir: string
+        path to the directory of the job queue
+    return: int
+        exit status, 0 if the job was done
+    """
+    queue = daemon.JobQueue(jobs_dir)
+    queue.submit(job)
+    logging.info("Submitted job: %s", job)
+    for progress in queue.follow(job):
+        logging.info("Job %s: %s", job.job_id, ", ".join(
+            "%s %s" % (key, progress[key]) for key in sorted(progress) if key != "time"))
+    return 0 if progress["state"] == "done" else 1
+
+
+def ingest_log_files(input_dir, scratch_dir, history_dir, ram_scratch_dir=None, *,
+                     executor=None, report=None, changed_only=False, watcher=None,
+                     coordinator=None):
     """
     Begins ingesting files from the specified directories. Assumes that
     Logjam DOES NOT own `input_dir` but also assumes that
@@ -166,43 +538,429 @@ def ingest_log_files(input_dir, scratch_dir, history_dir):
         path to the scratch directory
     history_dir: string
         path to the histry directory
+    ram_scratch_dir: string
+        path to the RAM backed scratch directory, None to only unzip to disk
+    executor: WorkerPool
+        warm worker pool from `open_worker_pool`, None to start one for this scan
+    report: function(**progress)
+        called with the cases & sub-tasks done so far and in total, None not to report
+    changed_only: bool
+        only search the cases that changed since the last completed scan
+    watcher: ChangeWatcher
+        inotify watcher of the input directory telling which cases changed, None to
+        walk the directories of every case
+    coordinator: Coordinator
+        only search the cases claimed from the other hosts ingesting the input
+        directory, see `ingest_claimed_cases`, None if this host is the only one
     """
     assert os.path.isdir(input_dir), "Input must exist & be a directory"
+    if coordinator is not None:
+        assert not changed_only, "Changed cases are tracked per host"
+        return ingest_claimed_cases(input_dir, scratch_dir, history_dir, ram_scratch_dir,
+                                    coordinator, executor=executor, report=report)
     
-    scan = incremental.ManagerScan(input_dir, history_dir, scratch_dir)
+    scan = incremental.ManagerScan(input_dir, history_dir, scratch_dir,
+                                   ram_scratch_dir=ram_scratch_dir)
     assert os.path.exists(scan.history_log_file)
     
-    with concurrent.futures.ProcessPoolExecutor(max_workers = MAX_WORKERS) as executor:
+    store = manifest.ManifestStore(history_dir)
+    store.prune()
+    gzindex.prune(scan.history_dir)
+    stats_store = casestats.CaseStatsStore(history_dir)
+    
+    with open_worker_pool(store, executor) as executor:
         
-        futures = []
-        search_dir = paths.QuantumEntry(input_dir, "")
-        for e in incremental.list_unscanned_entries(search_dir,os.path.basename(scan.last_path)):
-            
-            if e.is_dir():
-                case_num = fields.get_case_number(e.relpath)
-                if case_num != fields.MISSING_CASE_NUM:
-                    logging.debug("Search case directory: %s", e.abspath)
-                    futures.append(executor.submit(search_case_directory, scan, input_dir, case_num))
-                    
-                    assert os.path.exists(scan.history_log_file), "History Log File does not exist for case: "+case_num
-                    
-                else:
-                    logging.debug("Ignored non-StorageGRID directory: %s", e.abspath)
-            else:
-                logging.debug("Ignored non-StorageGRID file: %s", e.abspath)
-
-        for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
-            # Raise any exception from child process
-            future.result()
+        case_dirs = list_case_dirs(input_dir, os.path.basename(scan.last_path))
+        listed = None
+        if scan.last_path == "":
+            listed = set(case_num for (_, case_num) in case_dirs)
+            stats_store.prune(listed)
+        
+        feed = None
+        if changed_only:
+            feed = changes.ChangeFeed(history_dir, watcher)
+            case_dirs = feed.changed(case_dirs)
+        
+        try:
+            stopped_archives = search_cases(executor, scan, stats_store.longest_first(case_dirs),
+                                            stats_store, report)
+        except BaseException:
+            if feed is not None:
+                feed.abandon()
+            raise
     
-    if graceful_abort:
+    stats_store.save()
+    log_limits_summary(stopped_archives)
+    if abort_requested():
+        if feed is not None:
+            feed.abandon()
         scan.premature_exit()
     else:
+        if feed is not None:
+            feed.commit(scan.safe_time, listed)
         scan.complete_scan()
     return
 
 
-def search_case_directory(scan_obj, input_dir, case_num):
+def ingest_claimed_cases(input_dir, scratch_dir, history_dir, ram_scratch_dir, coordinator, *,
+                         executor=None, report=None):
+    """
+    Searches the cases of the current round that no other host completed, claiming
+    each case from the other hosts before searching it. The history files of the
+    cases are shared in the round directory (see `coordinate`), the history directory
+    only holds the archive manifests & case stats of this host.
+    input_dir: string
+        path to the input directory, mounted at the same path on every host
+    scratch_dir: string
+        path to the scratch directory
+    history_dir: string
+        path to the history directory of this host
+    ram_scratch_dir: string
+        path to the RAM backed scratch directory, None to only unzip to disk
+    coordinator: Coordinator
+        leases of this host in the directory shared by the hosts
+    executor: WorkerPool
+        warm worker pool from `open_worker_pool`, None to start one for this scan
+    report: function(**progress)
+        called with the cases & sub-tasks done so far and in total, None not to report
+    """
+    round_dir = coordinator.join_round()
+    
+    # Never saved, the case history files in the round directory hold the progress
+    scan = incremental.ManagerScan(input_dir, round_dir, scratch_dir,
+                                   ram_scratch_dir=ram_scratch_dir)
+    
+    store = manifest.ManifestStore(history_dir)
+    store.prune()
+    gzindex.prune(scan.history_dir)
+    stats_store = casestats.CaseStatsStore(history_dir)
+    
+    with open_worker_pool(store, executor) as executor:
+        
+        case_dirs = list_case_dirs(input_dir, "")
+        listed = set(case_num for (_, case_num) in case_dirs)
+        stats_store.prune(listed)
+        case_dirs = [(e, case_num) for (e, case_num) in case_dirs
+                     if not coordinator.is_done(case_num)]
+        
+        try:
+            stopped_archives = search_cases(executor, scan, stats_store.longest_first(case_dirs),
+                                            stats_store, report, coordinator)
+        finally:
+            coordinator.release_all()
+    
+    stats_store.save()
+    log_limits_summary(stopped_archives)
+    if not abort_requested():
+        coordinator.finish_round(listed)
+
+
+def list_case_dirs(input_dir, last_name):
+    """
+    Returns the case directories in the input directory after the last one searched.
+    input_dir: string
+        path to the input directory
+    last_name: string
+        name of the last entry searched in the input directory, empty for every case
+    return: list of (QuantumEntry, string)
+        case directories & their case numbers
+    """
+    case_dirs = []
+    search_dir = paths.QuantumEntry(input_dir, "")
+    for e in incremental.list_unscanned_entries(search_dir, last_name):
+        
+        if e.is_dir():
+            case_num = fields.get_case_number(e.relpath)
+            if case_num != fields.MISSING_CASE_NUM:
+                case_dirs.append((e, case_num))
+            else:
+                logging.debug("Ignored non-StorageGRID directory: %s", e.abspath)
+        else:
+            logging.debug("Ignored non-StorageGRID file: %s", e.abspath)
+    return case_dirs
+
+
+def open_worker_pool(store, executor=None):
+    """
+    Returns a context holding the worker pool to search cases with: the warm pool if
+    one is given, otherwise a new pool shut down when leaving the context.
+    store: ManifestStore
+        cached archive manifests, handed to the workers of a new pool
+    executor: WorkerPool
+        warm worker pool, None to start one
+    """
+    if executor is not None:
+        return contextlib.nullcontext(executor)
+    return governor.WorkerPool(worker_count(), init_worker,
+                               (scratch_quota, ram_scratch_quota, store, cancel.shared_event(),
+                                read_limiter),
+                               rss_ceiling=worker_rss_bytes, max_extractions=max_extractions,
+                               max_senders=max_senders)
+
+
+def worker_count():
+    """ Returns the number of workers searching cases at once """
+    return MAX_WORKERS if MAX_WORKERS is not None else governor.pool_size()
+
+
+def search_cases(executor, scan, case_dirs, stats_store, report=None, coordinator=None):
+    """
+    Searches the cases in the worker pool, in the order given, searching the sub-tasks
+    of split cases as they are planned. Records the stats of every case searched.
+    Cases & sub-tasks are submitted as workers free up, so that they start on new
+    workers once the pool is recycled. With a coordinator, a case is claimed only
+    then, so that the hosts share the cases, and released once searched. Workers stop
+    searching a case whose lease another host reclaimed. The archives of the next
+    cases are prefetched meanwhile if `prefetch_cache` is set.
+    executor: WorkerPool
+        worker pool the cases are searched in
+    scan: ManagerScan
+        scan the cases are searched for
+    case_dirs: list of (QuantumEntry, string)
+        case directories in the input directory & their case numbers
+    stats_store: CaseStatsStore
+        case stats, the stats of the cases searched are recorded there
+    report: function(**progress)
+        called with the cases & sub-tasks done so far and in total, None not to report
+    coordinator: Coordinator
+        leases of this host, None to search every case given
+    return: Counter
+        number of archives stopped by each decompression limit, by limit name
+    """
+    input_dir = scan.input_dir
+    workers = worker_count()
+    progress = tqdm(total=len(case_dirs))
+    
+    # Future -> (case number, sub-task or None for the whole case)
+    futures = {}
+    # Waiting for a free worker: (case number, sub-task or None, case directory or None)
+    pending = collections.deque((case_num, None, e) for (e, case_num) in case_dirs)
+    def lease(case_num):
+        return None if coordinator is None else coordinator.lease(case_num)
+    
+    def submit_cases():
+        while len(pending) > 0 and len(futures) < workers and not abort_requested():
+            (case_num, task, e) = pending.popleft()
+            if task is not None:
+                future = executor.submit(search_case_task, scan, input_dir, task, lease(case_num))
+                futures[future] = (case_num, task)
+                continue
+            if coordinator is not None and not coordinator.claim(case_num):
+                logging.debug("Case claimed by another host: %s", case_num)
+                progress.total -= 1
+                continue
+            logging.debug("Search case directory: %s", e.abspath)
+            future = executor.submit(search_case_directory, scan, input_dir, case_num,
+                                     lease(case_num))
+            futures[future] = (case_num, None)
+            
+            assert os.path.exists(scan.history_log_file), "History Log File does not exist for case: "+case_num
+        
+        if prefetch_cache is not None:
+            prefetch_cache.update(set(case_num for (case_num, _) in futures.values()),
+                                  [case_num for (case_num, task, _) in pending if task is None])
+    
+    def case_searched(case_num):
+        if coordinator is not None:
+            coordinator.release(case_num)
+    
+    submit_cases()
+    stopped_archives = collections.Counter()
+    tasks_left = collections.Counter()
+    split_stats = {}
+    while len(futures) > 0:
+        done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+        if abort_requested():
+            # Queued cases & sub-tasks never start, those running save their checkpoints
+            for future in futures:
+                future.cancel()
+        for future in done:
+            (case_num, task) = futures.pop(future)
+            if future.cancelled():
+                progress.total -= 1
+                continue
+            # Raise any exception from child process
+            (stopped, case_tasks, stats) = future.result()
+            stopped_archives.update(stopped)
+            
+            if task is None and len(case_tasks) > 0:
+                # Largest sub-tasks first, so the last ones to finish are small
+                tasks_left[case_num] = len(case_tasks)
+                split_stats[case_num] = stats
+                progress.total += len(case_tasks)
+                for t in sorted(case_tasks, key=lambda t: t.size):
+                    pending.appendleft((case_num, t, None))
+            elif task is not None:
+                tasks_left[case_num] -= 1
+                if stats is None or split_stats[case_num] is None:
+                    split_stats[case_num] = None
+                else:
+                    split_stats[case_num].seconds += stats.seconds
+                if tasks_left[case_num] == 0 and not abort_requested() and \
+                        (coordinator is None or coordinator.holds(case_num)):
+                    complete_case_scan(scan, input_dir, case_num)
+                    if split_stats[case_num] is not None:
+                        stats_store.record(case_num, split_stats[case_num])
+                if tasks_left[case_num] == 0:
+                    case_searched(case_num)
+            else:
+                if stats is not None:
+                    stats_store.record(case_num, stats)
+                case_searched(case_num)
+            progress.update(1)
+            if report is not None:
+                report(done=progress.n, total=progress.total)
+        submit_cases()
+    progress.close()
+    if prefetch_cache is not None:
+        prefetch_cache.update([], [])
+    log_read_metrics()
+    return stopped_archives
+
+
+def ingest_case(input_dir, scratch_dir, history_dir, ram_scratch_dir, case_num, *,
+                executor, report=None):
+    """
+    Searches one case from the start, whether or not the current scan already did.
+    If a scan of the input directory was interrupted, the case stays marked as
+    scanned for it, otherwise the next scan searches the case like any other.
+    input_dir: string
+        path to the input directory
+    scratch_dir: string
+        path to the scratch directory
+    history_dir: string
+        path to the history directory
+    ram_scratch_dir: string
+        path to the RAM backed scratch directory, None to only unzip to disk
+    case_num: string
+        case number of the case directory
+    executor: WorkerPool
+        warm worker pool the case is searched in
+    report: function(**progress)
+        called with the case & its sub-tasks done so far and in total, None not to report
+    """
+    case_dir = paths.QuantumEntry(input_dir, case_num)
+    if not case_dir.is_dir():
+        raise FileNotFoundError("No such case directory: %s" % case_dir.abspath)
+    
+    # Never saved, only carries the directories & safe time of the workers
+    scan = incremental.ManagerScan(input_dir, history_dir, scratch_dir,
+                                   ram_scratch_dir=ram_scratch_dir)
+    scan_in_progress = scan.last_path != ""
+    incremental.delete_case_history(history_dir, case_num)
+    
+    stats_store = casestats.CaseStatsStore(history_dir)
+    stopped_archives = search_cases(executor, scan, [(case_dir, case_num)], stats_store, report)
+    stats_store.save()
+    log_limits_summary(stopped_archives)
+    if not scan_in_progress and not abort_requested():
+        incremental.delete_case_history(history_dir, case_num)
+
+
+def rescan_path(input_dir, scratch_dir, history_dir, ram_scratch_dir, relpath, *,
+                executor, report=None):
+    """
+    Searches one file or directory of a case, whether or not it was scanned before,
+    as a sub-task of its case whose history is deleted afterwards.
+    input_dir: string
+        path to the input directory
+    scratch_dir: string
+        path to the scratch directory
+    history_dir: string
+        path to the history directory
+    ram_scratch_dir: string
+        path to the RAM backed scratch directory, None to only unzip to disk
+    relpath: string
+        path relative to the input directory, below a case directory
+    executor: WorkerPool
+        warm worker pool the path is searched in
+    report: function(**progress)
+        called once the path was searched, None not to report
+    """
+    if not os.path.lexists(os.path.join(input_dir, relpath)):
+        raise FileNotFoundError("No such path in the input directory: %s" % relpath)
+    
+    scan = incremental.ManagerScan(input_dir, history_dir, scratch_dir,
+                                   ram_scratch_dir=ram_scratch_dir)
+    task = subtasks.plan_path_task(input_dir, relpath)
+    incremental.delete_task_history(history_dir, task.case_num, task.key)
+    try:
+        (stopped_archives, _, _) = executor.submit(search_case_task, scan, input_dir, task).result()
+    finally:
+        incremental.delete_task_history(history_dir, task.case_num, task.key)
+    log_limits_summary(stopped_archives)
+    if report is not None:
+        report(done=1, total=1)
+
+
+def log_limits_summary(stopped_archives):
+    """
+    Logs the decompression limits & how many archives each one stopped during the scan.
+    stopped_archives: Counter
+        number of archives stopped by each limit, by limit name
+    """
+    limits = unzip.ExtractionLimits()
+    logging.info("Decompression limits: total %s, member %s, ratio %dx, nesting depth %d",
+                 quota.format_bytes(limits.max_total_bytes),
+                 quota.format_bytes(limits.max_member_bytes), limits.max_ratio, limits.max_depth)
+    if sum(stopped_archives.values()) == 0:
+        logging.info("No archives exceeded the decompression limits")
+        return
+    logging.warning("Archives stopped by decompression limits: %s",
+                    ", ".join("%s %d" % (name, stopped_archives[name])
+                              for name in unzip.ExtractionLimits.LIMIT_NAMES))
+
+
+def log_read_metrics():
+    """ Logs the bytes read from the input directory & the time spent throttled since last logged """
+    if read_limiter is None:
+        return
+    (read_bytes, throttled_seconds) = read_limiter.take_metrics()
+    logging.info("Read %s from the input directory, throttled for %.1f seconds across workers",
+                 quota.format_bytes(read_bytes), throttled_seconds)
+
+
+def init_worker(quota_obj, ram_quota_obj=None, store=None, cancel_event=None, limiter=None):
+    """
+    Initializes a worker process with the state shared by all workers.
+    quota_obj: ScratchQuota
+        scratch space quota, None for unlimited
+    ram_quota_obj: ScratchQuota
+        RAM backed scratch space quota, None when RAM scratch is disabled
+    store: ManifestStore
+        cached archive manifests, None to unzip archives without checking their members
+    cancel_event: multiprocessing.Event
+        event set by the manager when the scan is aborted, see `cancel`
+    limiter: ratelimit.ReadLimiter
+        rate limit of the reads from the input directory, None for unlimited
+    """
+    global scratch_quota, ram_scratch_quota, manifest_store
+    scratch_quota = quota_obj
+    ram_scratch_quota = ram_quota_obj
+    manifest_store = store
+    cancel.install(cancel_event)
+    ratelimit.install(limiter)
+    
+    # Signals sent to the whole process group abort the scan, as they do in the manager
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signum, lambda signum, frame: cancel.request())
+
+
+def abort_requested():
+    """
+    Returns whether the scan is being aborted, by a signal to this process or to the
+    manager of this worker.
+    """
+    return graceful_abort or cancel.requested()
+
+
+def check_abort():
+    """ Raises Cancelled if the scan is being aborted, leaving the current entry unscanned """
+    if abort_requested():
+        raise cancel.Cancelled("Scan was aborted")
+
+
+def search_case_directory(scan_obj, input_dir, case_num, lease=None):
     """
     Searches the specified case directory for StorageGRID log files which have not
     been indexed by the Logjam system. Uses the Scan object's time period window to
@@ -214,42 +972,185 @@ def search_case_directory(scan_obj, input_dir, case_num):
         path to input directory 
     case_num: string
         case directory number
+    lease: coordinate.Lease
+        lease of the case held by this host, the search stops & leaves the case's history
+        to the host that reclaimed it once lost, None if the case is not leased
+    return: tuple of (Counter, list of CaseTask, CaseStats)
+        number of archives stopped by each decompression limit, by limit name, the
+        sub-tasks the case was split into (empty if the case was searched here) and
+        the stats of the case, None unless it was searched from start to end
     """
     
-    global graceful_abort
-    if graceful_abort:
-        return
+    if abort_requested():
+        return (collections.Counter(), [], None)
+    
+    exceeded_limits.clear()
         
     assert case_num != fields.MISSING_CASE_NUM, "Case number should have already been verified"
     
     child_scan = incremental.WorkerScan(input_dir, scan_obj.history_dir, 
                                         scan_obj.scratch_dir, str(case_num) + ".txt", 
-                                        str(case_num) + "-log.txt", scan_obj.safe_time)
+                                        str(case_num) + "-log.txt", scan_obj.safe_time,
+                                        ram_scratch_dir=scan_obj.ram_scratch_dir)
 
     assert child_scan.input_dir == scan_obj.input_dir
     
+    stats = None
     if not child_scan.already_scanned:
+        start = time.time()
+        resumed = child_scan.last_path != ""
         es_obj = get_es_connection()
         fields_obj = fields.NodeFields(case_num=case_num)
     
         case_dir = paths.QuantumEntry(scan_obj.input_dir, case_num)
         assert case_dir.exists(), "Case directory does not exist!"
+        
+        case_tasks = plan_case_split(child_scan, case_dir, fields_obj)
+        if len(case_tasks) > 0:
+            # Completed by the manager once every sub-task is done
+            logging.info("Splitting case %s into %d sub-tasks", case_num, len(case_tasks))
+            stats = casestats.measure_case(case_dir)
+            stats.seconds = time.time() - start
+            return (collections.Counter(), case_tasks, stats)
+        
         logging.debug("Recursing into case directory: %s", case_dir.abspath)
-        recursive_search(child_scan, es_obj, fields_obj, case_dir)
+        try:
+            with cancel.watching(None if lease is None else lease.lost), \
+                    open_pipeline(child_scan, es_obj) as pipe:
+                recursive_search(child_scan, es_obj, fields_obj, case_dir, pipe)
+        except cancel.Cancelled:
+            logging.info("Aborted searching case %s at %s", case_num, child_scan.last_path)
     
-        if graceful_abort:
+        if lease is not None and not lease.is_held():
+            logging.critical("Stopped searching case %s, another host reclaimed it", case_num)
+        elif abort_requested():
             child_scan.premature_exit()
         else:
             child_scan.complete_scan()
             unzip.delete_file(child_scan.history_log_file)
+            if not resumed:
+                stats = casestats.measure_case(case_dir)
+                stats.seconds = time.time() - start
+        
+        # Anything still reserved stays in scratch until the scan ends, stop counting it
+        for q in [scratch_quota, ram_scratch_quota]:
+            if q is not None:
+                q.release_all()
     
-    return
+    return (collections.Counter(exceeded_limits), [], stats)
+
+
+def plan_case_split(case_scan, case_dir, nodefields):
+    """
+    Splits the case into sub-tasks if it is larger than `split_case_bytes`. A case
+    that was split by an earlier scan is split again, so its sub-tasks resume from
+    their own history files. A case partially searched as a whole is not split.
+    case_scan: WorkerScan
+        scan of the whole case
+    case_dir: QuantumEntry
+        case directory in the input directory
+    nodefields: NodeFields
+        fields of the case
+    return: list of CaseTask
+        sub-tasks to search, empty to search the case as a whole
+    """
+    if split_case_bytes is None or case_scan.last_path != "":
+        return []
+    if not incremental.has_task_history(case_scan.history_dir, nodefields.case_num) and \
+            not subtasks.case_exceeds(case_dir, split_case_bytes):
+        return []
+    
+    case_tasks = subtasks.plan_case_tasks(case_dir, nodefields)
+    return case_tasks if len(case_tasks) > 1 else []
+
+
+def search_case_task(scan_obj, input_dir, task, lease=None):
+    """
+    Searches one sub-task of a split case, checkpointing it in its own history files
+    so that an aborted sub-task resumes where it stopped.
+    scan_obj: ManagerScan
+        Used to determine the scan period
+    input_dir: string
+        path to input directory
+    task: CaseTask
+        sub-task that is being searched
+    lease: coordinate.Lease
+        lease of the sub-task's case held by this host, see `search_case_directory`
+    return: tuple of (Counter, list of CaseTask, CaseStats)
+        number of archives stopped by each decompression limit, by limit name, no
+        further sub-tasks and the seconds spent on the sub-task, None unless it was
+        searched from start to end
+    """
+    if abort_requested():
+        return (collections.Counter(), [], None)
+    
+    exceeded_limits.clear()
+    
+    (active_file, log_file) = incremental.task_history_files(scan_obj.history_dir,
+                                                             task.case_num, task.key)
+    task_scan = incremental.WorkerScan(input_dir, scan_obj.history_dir, scan_obj.scratch_dir,
+                                       active_file, log_file, scan_obj.safe_time,
+                                       ram_scratch_dir=scan_obj.ram_scratch_dir)
+    
+    stats = None
+    if not task_scan.already_scanned:
+        start = time.time()
+        resumed = task_scan.last_path != ""
+        es_obj = get_es_connection()
+        task_dir = paths.QuantumEntry(input_dir, task.dir_relpath)
+        logging.debug("Searching case sub-task: %s", task)
+        entries = (e for e in task_scan.list_unscanned_entries(task_dir) if e.basename in task.names)
+        try:
+            with cancel.watching(None if lease is None else lease.lost), \
+                    open_pipeline(task_scan, es_obj) as pipe:
+                search_entries(task_scan, es_obj, task.nodefields, entries, pipe)
+        except cancel.Cancelled:
+            logging.info("Aborted searching case sub-task %s at %s", task, task_scan.last_path)
+        
+        if lease is not None and not lease.is_held():
+            logging.critical("Stopped searching case sub-task %s, another host reclaimed it", task)
+        elif abort_requested():
+            task_scan.premature_exit()
+        else:
+            task_scan.complete_scan()
+            unzip.delete_file(task_scan.history_log_file)
+            if not resumed:
+                stats = casestats.CaseStats(seconds=time.time() - start)
+        
+        for q in [scratch_quota, ram_scratch_quota]:
+            if q is not None:
+                q.release_all()
+    
+    return (collections.Counter(exceeded_limits), [], stats)
+
+
+def complete_case_scan(scan_obj, input_dir, case_num):
+    """ Marks the split case as scanned once all its sub-tasks are, like a case searched whole """
+    case_scan = incremental.WorkerScan(input_dir, scan_obj.history_dir, scan_obj.scratch_dir,
+                                       str(case_num) + ".txt", str(case_num) + "-log.txt",
+                                       scan_obj.safe_time, ram_scratch_dir=scan_obj.ram_scratch_dir)
+    if not case_scan.already_scanned:
+        case_scan.complete_scan()
+        unzip.delete_file(case_scan.history_log_file)
+    incremental.delete_task_history(scan_obj.history_dir, case_num)
+
+
+def open_pipeline(scan, es):
+    """
+    Returns the ingest pipeline to search with if `pipeline_config` enables it, otherwise
+    a context holding None so that entries are searched one at a time.
+    """
+    if pipeline_config is None:
+        return contextlib.nullcontext()
+    return pipeline.Pipeline(es, scan.history_dir, pipeline_config)
 
 
-def recursive_search(scan, es, nodefields, cur_dir):
+def recursive_search(scan, es, nodefields, cur_dir, pipe=None):
     """
-    Recursively searches directories for StorageGRID Nodes and Log Files. Unzips
-    compressed files as needed. Sends the log data to Elasticsearch via the 'es'.
+    Recursively searches directories for StorageGRID Nodes and Log Files. Browses
+    tar/zip archives in place, streams single file gzip logs and unzips other compressed
+    files as needed, skipping archives whose manifest lists nothing worth extracting.
+    Sends the log data to Elasticsearch via the 'es'.
     scan: ManagerScan
         Keeps track of what has been scanned
     es: Elasticsearch object
@@ -258,34 +1159,97 @@ def recursive_search(scan, es, nodefields, cur_dir):
         contains the NodeFields to be added
     cur_dir: QuantumEntry
         path of the current directory
+    pipe: pipeline.Pipeline
+        pipeline files are handed to, None to send them one at a time
     """
     assert isinstance(nodefields, fields.NodeFields), "Wrong argument type"
     assert isinstance(cur_dir, paths.QuantumEntry), "Wrong argument type"
     assert cur_dir.is_dir(), "Entry is not a directory: " + cur_dir.abspath
     
-    # Exit if abort requested
-    if graceful_abort:       
-        return
+    # Exit if abort requested, the directory is not marked scanned
+    check_abort()
 
     # Extract fields first
     if (cur_dir/"lumberjack.log").is_file():            
         logging.debug("Extracting fields from lumberjack directory: %s", cur_dir.relpath)
-        nodefields = fields.extract_fields(cur_dir.abspath, inherit_from=nodefields)
+        nodefields = fields.extract_fields(cur_dir, inherit_from=nodefields)
+    
+    search_entries(scan, es, nodefields, scan.list_unscanned_entries(cur_dir), pipe)
+
+
+def search_entries(scan, es, nodefields, entries, pipe=None):
+    """
+    Searches the entries of a directory, see `recursive_search`. The entries must
+    come in recursive order, as listed by `Scan.list_unscanned_entries`.
+    scan: ManagerScan
+        Keeps track of what has been scanned
+    es: Elasticsearch object
+        Elasticsearch
+    nodefields: NodeFields
+        contains the NodeFields to be added
+    entries: iterable of QuantumEntry
+        unscanned entries of the directory
+    pipe: pipeline.Pipeline
+        pipeline files are handed to, None to send them one at a time. Everything done
+        after an entry is deferred until the files found before it have been sent.
+    """
+    if pipe is not None:
+        entries = list(entries)
+        extract_ahead(scan, pipe, entries)
     
     # Loop over each unscanned entry and ingest it
-    for entry in scan.list_unscanned_entries(cur_dir): 
+    for entry in entries: 
+        check_abort()
         if not scan.should_consider_entry(entry):       
             logging.debug("Skipping file, outside timespan: %s", entry.abspath)
             # Log the scan
-            scan.just_scanned_this_entry(entry)         
+            finish_entry(pipe, functools.partial(scan.just_scanned_this_entry, entry))
             continue                                    
         
-        if entry.extension in unzip.SUPPORTED_FILE_TYPES and entry.is_file():
-            scratch_entry = unzip_into_scratch_dir(scan.input_dir, scan.scratch_dir, entry)
+        browsed_archive = None
+        if unzip.is_single_file_gzip(entry.relpath) and entry.is_file():
+            gzip_entry = paths.GzipEntry(entry, prefetched_copy(entry))
+            if gzip_entry.exists_in(scan.input_dir) or scan.exists_in_scratch(gzip_entry):
+                logging.debug("Skipping archive, already unpacked: %s", entry.abspath)
+                # Log the scan
+                finish_entry(pipe, functools.partial(scan.just_scanned_this_entry, entry))
+                continue
+            else:
+                logging.debug("Streaming gzip archive, no scratch copy: %s", entry.abspath)
+                # Override old entry
+                entry = gzip_entry
+        
+        elif entry.extension in archive.BROWSABLE_FILE_TYPES and entry.is_file() and \
+                not is_unzipped_in_parallel(entry):
+            archive_entry = paths.ArchiveEntry.from_archive(entry, prefetched_copy(entry))
+            if archive_entry.exists_in(scan.input_dir) or scan.exists_in_scratch(archive_entry):
+                logging.debug("Skipping archive, already unpacked: %s", entry.abspath)
+                # Log the scan
+                finish_entry(pipe, functools.partial(scan.just_scanned_this_entry, entry))
+                continue
+            else:
+                logging.debug("Browsing archive in place: %s", entry.abspath)
+                # Override old entry
+                entry = browsed_archive = archive_entry
+        
+        elif entry.extension in unzip.SUPPORTED_FILE_TYPES and entry.is_file():
+            if manifest_store is not None and \
+                    not manifest_store.is_relevant(entry, fields.is_extraction_candidate):
+                logging.debug("Skipping archive, no relevant members: %s", entry.abspath)
+                if scan.is_scratch_entry(entry):
+                    entry.delete()
+                # Log the scan
+                finish_entry(pipe, functools.partial(scan.just_scanned_this_entry, entry))
+                continue
+            
+            scratch_entry = None if pipe is None else pipe.take_extracted(entry)
+            if scratch_entry is None:
+                reading = None if pipe is None else pipe.reading(entry)
+                scratch_entry = unzip_into_scratch(scan, entry, reading)
             if scratch_entry == entry:
                 logging.debug("Skipping archive, already unpacked: %s", entry.abspath)
                 # Log the scan
-                scan.just_scanned_this_entry(entry)     
+                finish_entry(pipe, functools.partial(scan.just_scanned_this_entry, entry))
                 continue                                
             else:
                 logging.debug("Unpacked archive, path open: %s", scratch_entry.abspath)
@@ -293,35 +1257,108 @@ def recursive_search(scan, es, nodefields, cur_dir):
                 entry = scratch_entry
         
         if entry.is_file():
-            if fields.is_storagegrid(nodefields, entry):
-                index.send_to_es(es, nodefields, entry)
+            if pipe is not None:
+                pipe.index_file(nodefields, entry)
+            elif fields.is_storagegrid(nodefields, entry):
+                index.send_to_es(es, nodefields, entry, scan.history_dir)
             else:
                 logging.debug("Skipped Non-StorageGRID file: %s", entry.abspath)
         
         elif entry.is_dir():
             try:
                 logging.debug("Recursing into directory: %s", entry.abspath)
-                recursive_search(scan, es, nodefields, entry)
+                recursive_search(scan, es, nodefields, entry, pipe)
             except OSError as e:
                 logging.critical("Could not access directory: %s\nError: %s\nSkipping directory", 
-                                 cur_dir.abspath, e)
+                                 entry.abspath, e)
 
         # Wasn't a directory or a file
         else:                                           
             logging.debug("Skipped unknown entry: %s", entry.abspath)
         
-        if entry.srcpath == scan.scratch_dir:           
-            logging.debug("Delete unpacked archive: %s", entry.abspath)
-            # rm on FS (does not clear entry)
-            entry.delete()                   
-        # Log the scan
-        scan.just_scanned_this_entry(entry)             
+        # Possibly cut short by the abort, searched again by the next scan
+        check_abort()
+        finish_entry(pipe, functools.partial(release_entry, scan, entry, browsed_archive))
         continue                                        
     
     return                                              
 
 
-def unzip_into_scratch_dir(input_dir, scratch_dir, compressed_entry):
+def release_entry(scan, entry, browsed_archive=None):
+    """
+    Deletes the entry if it was unzipped into scratch space, closes the archive it was
+    browsed in & logs the entry as scanned.
+    """
+    if scan.is_scratch_entry(entry):
+        logging.debug("Delete unpacked archive: %s", entry.abspath)
+        # rm on FS (does not clear entry)
+        entry.delete()                   
+        for q in [scratch_quota, ram_scratch_quota]:
+            if q is not None:
+                q.release(entry.abspath)
+    if browsed_archive is not None:
+        # Done browsing the archive, release its file handle
+        browsed_archive.close()
+    # Log the scan
+    scan.just_scanned_this_entry(entry)             
+
+
+def finish_entry(pipe, action):
+    """ Runs the action now, or once the pipeline has sent every file found before it """
+    if pipe is None:
+        action()
+    else:
+        pipe.after(action)
+
+
+def extract_ahead(scan, pipe, entries):
+    """
+    Starts unzipping the archives among the entries before the walk reaches them, see
+    `Pipeline.extract_ahead`. Members of a browsed archive, such as the node archives
+    of a bundle tar, are copied out of it one at a time under its reading lock and
+    unzipped concurrently. Archives unzipping to the same path as a sibling are left
+    for the walk to unzip in turn.
+    """
+    stripped_names = collections.Counter(unzip.strip_all_zip_exts(e.basename) for e in entries)
+    for entry in entries:
+        if type(entry) not in [paths.QuantumEntry, paths.ArchiveEntry] or \
+                stripped_names[unzip.strip_all_zip_exts(entry.basename)] > 1:
+            continue
+        if not entry.is_file() or entry.extension not in unzip.SUPPORTED_FILE_TYPES or \
+                (entry.extension in archive.BROWSABLE_FILE_TYPES and not is_unzipped_in_parallel(entry)) or \
+                unzip.is_single_file_gzip(entry.relpath) or not scan.should_consider_entry(entry):
+            continue
+        if manifest_store is not None and \
+                not manifest_store.is_relevant(entry, fields.is_extraction_candidate):
+            continue
+        pipe.extract_ahead(entry, unzip_into_scratch, scan, entry, pipe.reading(entry))
+
+
+def is_unzipped_in_parallel(entry):
+    """
+    Returns whether the zip file is unzipped to scratch space instead of browsed in place,
+    for being large enough to unzip its members with several threads. Only files on disk
+    qualify, members of browsed archives are browsed in turn.
+    """
+    return type(entry) is paths.QuantumEntry and unzip.is_parallel_zip(entry.abspath)
+
+
+def prefetched_copy(entry):
+    """ Returns the up to date prefetched copy of the archive, None if there is none """
+    return None if prefetch_cache is None else prefetch_cache.local_entry(entry)
+
+
+def unzip_into_scratch(scan, entry, reading=None):
+    """ Unzips the archive into the scan's scratch space, see `unzip_into_scratch_dir` """
+    return unzip_into_scratch_dir(scan.input_dir, scan.scratch_dir, entry,
+                                  cache=extraction_cache, prefetched=prefetch_cache,
+                                  quota=scratch_quota, ram_scratch_dir=scan.ram_scratch_dir,
+                                  ram_quota=ram_scratch_quota, reading=reading)
+
+
+def unzip_into_scratch_dir(input_dir, scratch_dir, compressed_entry, *, cache=None,
+                           prefetched=None, quota=None, ram_scratch_dir=None, ram_quota=None,
+                           reading=None):
     """
     Unzips the compressed file into the provided scratch directory. If the file
     has already been decompressed, return the compressed file unchanged. Uses the
@@ -331,36 +1368,149 @@ def unzip_into_scratch_dir(input_dir, scratch_dir, compressed_entry):
     compressed_entry = /mnt/srv/nfs - 2001589801/var/os/dir.zip  ---.
        scratch_entry = /tmp/scratch - 2001589801/var/os/dir  <------'
 
+    When a RAM backed scratch directory is given, archives whose estimated unzipped
+    size fits in what is left of its quota are unzipped there instead, spilling to
+    the scratch directory when the budget is exceeded or the unzip fails, including
+    when the RAM backed file system runs out of space before its quota does.
+
     input_dir: string
         path to the input directory
     scratch_dir: string
         path to the scratch directory
     compressed_entry: QuantumEntry
         directory of the compressed entry
+    cache: cache.ExtractionCache
+        reuses archives unzipped by earlier scans of the input directory, None disables
+    prefetched: prefetch.PrefetchCache
+        unzips the local copy of an archive of the input directory if there is an up to
+        date one, None always reads the input directory
+    quota: quota.ScratchQuota
+        reserves the scratch space the archive unzips to until it is released, None disables
+    ram_scratch_dir: string
+        path to the RAM backed scratch directory, None only unzips to the scratch directory
+    ram_quota: quota.ScratchQuota
+        budget of the RAM backed scratch directory, required with ram_scratch_dir
+    reading: context manager
+        held while a member of a browsed archive is copied out of it, such as the lock
+        of `Pipeline.reading`, None for none
     """
     assert isinstance(input_dir, str)
     assert isinstance(scratch_dir, str)
     assert isinstance(compressed_entry, paths.QuantumEntry)
     assert compressed_entry.is_file(), "Compressed entry should be a file"
-    assert compressed_entry.srcpath in [input_dir, scratch_dir], \
+    assert compressed_entry.srcpath in [input_dir, scratch_dir, ram_scratch_dir], \
         "Source should be input/scratch\nsrcpath: %s\ninput_dir: %s\nscratch_dir: %s" % \
         (compressed_entry.srcpath, input_dir, scratch_dir)
+    assert ram_scratch_dir is None or ram_quota is not None, "RAM scratch needs a quota"
     
     stripped_rel_path = unzip.strip_all_zip_exts(compressed_entry.relpath)
-    scratch_entry = paths.QuantumEntry(scratch_dir, stripped_rel_path)
+    # Unzipped entries carry the archive's mod time, the files keep their own
+    archive_mtime = compressed_entry.getmtime()
+    scratch_entry = paths.QuantumEntry(scratch_dir, stripped_rel_path, mtime=archive_mtime)
     
     if scratch_entry.exists_in(input_dir) or scratch_entry.exists_in(scratch_dir):
         # Already exists, return unchanged
         return compressed_entry           
+    if ram_scratch_dir is not None and scratch_entry.exists_in(ram_scratch_dir):
+        return compressed_entry
 
     assert not scratch_entry.exists(), "Scratch entry should not exist"
+    
+    if cache is not None and compressed_entry.srcpath != input_dir:
+        # Scratch paths change every scan, there is nothing to reuse
+        cache = None
+    if cache is not None and cache.fetch(compressed_entry, scratch_entry.abspath):
+        # Hard linked from the cache on disk, RAM would need a copy
+        return scratch_entry
+    
+    copied_entry = None
+    if isinstance(compressed_entry, paths.ArchiveEntry):
+        # Member of a browsed archive, place it in scratch to unzip it
+        with reading if reading is not None else contextlib.nullcontext():
+            copied_entry = compressed_entry.copy_to(scratch_dir)
+    local_entry = None
+    if prefetched is not None:
+        local_entry = prefetched.local_entry(compressed_entry)
+    
     try:
-        unzip.recursive_unzip(compressed_entry.abspath, scratch_entry.absdirpath)
-        assert scratch_entry.exists(),"Scratch entry should exist" + scratch_entry.relpath
-    except unzip.AcceptableException:
-        pass
+        src_entry = compressed_entry
+        if copied_entry is not None:
+            src_entry = copied_entry
+        elif local_entry is not None:
+            src_entry = local_entry
+        limits = unzip.ExtractionLimits()
+        unzipped_entry = None
+        if ram_scratch_dir is not None:
+            ram_entry = paths.QuantumEntry(ram_scratch_dir, stripped_rel_path, mtime=archive_mtime)
+            if ram_quota.try_reserve_archive(ram_entry.abspath, src_entry.abspath,
+                                             fields.is_extraction_candidate):
+                try:
+                    ram_unzipped = unzip_reserved(src_entry, ram_entry, ram_quota, limits)
+                except OSError as e:
+                    # Such as ENOSPC, a real problem with the archive fails on disk too
+                    logging.info("Unable to unzip to RAM scratch: %s", e)
+                    ram_unzipped = False
+                if ram_unzipped:
+                    unzipped_entry = ram_entry
+                else:
+                    ram_entry.delete()
+                    ram_quota.release(ram_entry.abspath)
+                    if limits.exceeded is None:
+                        # Estimate was short of the tmpfs, or the archive is bad
+                        logging.info("Spilling unzip to disk scratch: %s", compressed_entry.relpath)
+                        # Counted anew, the bytes written to RAM are gone
+                        limits = unzip.ExtractionLimits()
+        
+        if unzipped_entry is None and limits.exceeded is None:
+            if quota is not None:
+                quota.reserve_archive(scratch_entry.abspath, src_entry.abspath,
+                                      fields.is_extraction_candidate)
+            if unzip_reserved(src_entry, scratch_entry, quota, limits):
+                unzipped_entry = scratch_entry
+            elif quota is not None:
+                quota.release(scratch_entry.abspath)
+        
+        if limits.exceeded is not None:
+            exceeded_limits[limits.exceeded] += 1
+        if unzipped_entry is scratch_entry and cache is not None:
+            # Not from RAM, the cache on disk could only copy it
+            cache.store(compressed_entry, unzipped_entry.abspath)
+    finally:
+        if copied_entry is not None:
+            copied_entry.delete()
     # Return unzipped entry
-    return scratch_entry   
+    return unzipped_entry if unzipped_entry is not None else scratch_entry
+
+
+def unzip_reserved(src_entry, dest_entry, quota, limits):
+    """
+    Unzips the archive to the destination, whose space has already been reserved, then
+    replaces the reserved estimate with the space the unzipped files actually take.
+    src_entry: QuantumEntry
+        archive being unzipped
+    dest_entry: QuantumEntry
+        path the archive unzips to, in a scratch directory
+    quota: quota.ScratchQuota
+        quota holding the reservation, None if unlimited
+    limits: unzip.ExtractionLimits
+        decompression limits, records which one stopped the unzip
+    return: bool
+        True if unzipped, False if the archive could not be unzipped
+    """
+    try:
+        with governor.extraction():
+            unzip.recursive_unzip(src_entry.abspath, dest_entry.absdirpath, keep_gz_logs=True,
+                                  member_filter=fields.is_extraction_candidate, limits=limits)
+    except unzip.AcceptableException:
+        return False
+    except cancel.Cancelled:
+        # Never left partly unzipped for a later search to take as unzipped
+        dest_entry.delete()
+        raise
+    assert dest_entry.exists(),"Scratch entry should exist" + dest_entry.relpath
+    if quota is not None:
+        quota.settle(dest_entry.abspath)
+    return True
 
 
 if __name__ == "__main__":
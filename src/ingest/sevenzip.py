@@ -0,0 +1,171 @@
+"""
+In-process access to 7z archives through py7zr, used by `unzip` in place of forking
+the 7z command line through patool. py7zr is an optional dependency: when it is not
+installed `AVAILABLE` is False and only the command line can unzip 7z archives. So
+is it with py7zr releases before 1.0, which lack the writer factories `stream` hands
+the decompressed data to (py7zr 1.0 needs Python 3.9).
+"""
+
+
+import os
+import logging
+import contextlib
+
+import archive
+import ratelimit
+
+try:
+    import py7zr
+    import py7zr.exceptions
+except ImportError:
+    py7zr = None
+
+
+# Whether the in-process backend can be used
+AVAILABLE = py7zr is not None and hasattr(py7zr, "WriterFactory") and hasattr(py7zr, "Py7zIO")
+
+
+class PasswordProtected(Exception):
+    """ The archive is encrypted, no backend can unzip it without the password """
+
+
+class Unsupported(Exception):
+    """ The archive uses a feature py7zr cannot decode, the command line may still unzip it """
+
+
+def list_members(path):
+    """
+    Lists the regular file members of the 7z archive without unzipping it.
+    path: string
+        path to the 7z archive, or a seekable binary file object of it
+    return: dict of string -> int
+        normalized member name to uncompressed size in bytes, unsafe names are left out
+    """
+    with open_archive(path) as z:
+        return {archive.normalize_member_name(info.filename): info.uncompressed or 0
+                for info in z.list()
+                if info.is_file and archive.normalize_member_name(info.filename) != ""}
+
+
+def extract(path, dest_dir, *, member_filter=None, check=None):
+    """
+    Unzips the regular file members of the 7z archive into the destination directory,
+    writing each chunk as it is decompressed. Symbolic links and members that would
+    land outside of `dest_dir` are skipped.
+    path: string
+        path to the 7z archive
+    dest_dir: string
+        existing directory to unzip the members into
+    member_filter: function(member_relpath) -> return bool
+        only members accepted by the filter are unzipped, None unzips all
+    check: function(member_relpath, member_bytes, nbytes) -> return None
+        called before each chunk is written with the member's bytes so far (the chunk
+        included) and the chunk's size, raising stops the unzip
+    """
+    open_files = {}
+
+    def write(name, data):
+        """ Appends the chunk to the member's file, closing it on the empty chunk """
+        if name not in open_files:
+            target = os.path.join(dest_dir, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            open_files[name] = [open(target, "wb"), 0]
+        out = open_files[name]
+        if len(data) == 0:
+            out[0].close()
+            del open_files[name]
+            return
+        out[1] += len(data)
+        if check is not None:
+            check(name, out[1], len(data))
+        out[0].write(data)
+
+    try:
+        stream(path, write, member_filter=member_filter)
+    finally:
+        for (out_fd, _) in open_files.values():
+            out_fd.close()
+
+
+def stream(path, consume, *, member_filter=None):
+    """
+    Decompresses the regular file members of the 7z archive without writing them to
+    the file system, handing each chunk of data to `consume` in archive order.
+    path: string
+        path to the 7z archive
+    consume: function(member_relpath, data) -> return None
+        called with each chunk of decompressed bytes, an empty chunk ends a member
+    member_filter: function(member_relpath) -> return bool
+        only members accepted by the filter are decompressed, None decompresses all
+    """
+    targets = select_members(path, member_filter)
+    if len(targets) == 0:
+        return
+
+    class Writer(py7zr.Py7zIO):
+        """ Forwards the data py7zr writes for one member to `consume` """
+        def __init__(self, filename):
+            self.name = archive.normalize_member_name(filename)
+            self.written = 0
+        def write(self, data):
+            consume(self.name, bytes(data))
+            self.written += len(data)
+            return len(data)
+        def read(self, size=None):
+            return b""
+        def seek(self, offset, whence=0):
+            return self.written
+        def flush(self):
+            return None
+        def size(self):
+            return self.written
+        def close(self):
+            consume(self.name, b"")
+
+    class Factory(py7zr.WriterFactory):
+        def create(self, filename):
+            return Writer(filename)
+
+    with open_archive(path) as z:
+        translate_errors(lambda: z.extract(targets=targets, factory=Factory()))
+
+
+def select_members(path, member_filter):
+    """ Returns the raw names of the safe file members accepted by the filter """
+    with open_archive(path) as z:
+        if z.needs_password():
+            raise PasswordProtected("7z archive is password protected: " + path)
+        names = []
+        for info in z.list():
+            name = archive.normalize_member_name(info.filename)
+            if not info.is_file or info.is_symlink or name == "":
+                continue
+            if member_filter is None or member_filter(name):
+                names.append(info.filename)
+        return names
+
+
+@contextlib.contextmanager
+def open_archive(path):
+    """
+    Opens the 7z archive for reading, raising PasswordProtected for encrypted headers.
+    Archives given by path are read through the rate limit of the input directory.
+    """
+    assert AVAILABLE, "py7zr is not installed"
+    if isinstance(path, str):
+        fileobj = ratelimit.open_input(path)
+    else:
+        fileobj = contextlib.nullcontext(path)
+    with fileobj as fd, translate_errors(lambda: py7zr.SevenZipFile(fd, mode="r")) as z:
+        yield z
+
+
+def translate_errors(func):
+    """ Calls the function, raising py7zr errors as PasswordProtected or Unsupported """
+    try:
+        return func()
+    except py7zr.exceptions.PasswordRequired as e:
+        raise PasswordProtected("7z archive is password protected: %s" % e)
+    except (py7zr.exceptions.UnsupportedCompressionMethodError, NotImplementedError) as e:
+        logging.debug("py7zr cannot decode archive: %s", e)
+        raise Unsupported("7z archive is not supported by py7zr: %s" % e)
@@ -0,0 +1,154 @@
+"""
+Sub-tasks of large cases. A case is otherwise searched by a single worker, so one large
+case keeps a single core busy while the rest of the pool idles. Large cases are split
+into sub-tasks (lumberjack node directories, top level archives & files) that workers
+search in parallel, each carrying the node fields it inherits from the directories above.
+"""
+
+
+import os
+import hashlib
+import logging
+
+import unzip
+import cache
+import paths
+import fields
+
+
+# Max directories below the case directory descended into looking for sub-tasks
+SPLIT_MAX_DEPTH = 3
+
+
+class CaseTask:
+    """
+    Part of a case searched by one worker: sibling entries of a directory in the case,
+    with the node fields they inherit. Siblings that unzip to the same path (such as
+    `node.zip` & `node.tgz`) are kept in the same sub-task, so no two workers ever
+    unzip into the same scratch path.
+    """
+
+    def __init__(self, case_num, dir_relpath, names, nodefields, size=0):
+        """
+        Constructs a sub-task of the case.
+        case_num: string
+            case number the sub-task belongs to
+        dir_relpath: string
+            relative path of the directory holding the entries
+        names: list of string
+            names of the entries in the directory
+        nodefields: NodeFields
+            fields inherited from the lumberjack directories above the entries
+        size: int
+            bytes of the entries, used to hand out the largest sub-tasks first
+        """
+        assert len(names) > 0, "Sub-task must hold at least one entry"
+        self.case_num = case_num
+        self.dir_relpath = dir_relpath
+        self.names = sorted(names)
+        self.nodefields = nodefields
+        self.size = size
+
+    @property
+    def key(self):
+        """ Returns a short key identifying the sub-task within its case, stable across scans """
+        identity = "\n".join([self.dir_relpath] + self.names)
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16]
+
+    def __str__(self):
+        """ Returns a readable string representation of this object """
+        return ", ".join(os.path.join(self.dir_relpath, name) for name in self.names)
+
+
+def case_exceeds(case_dir, max_bytes):
+    """
+    Returns whether the files under the case directory add up to more than max_bytes,
+    stopping the walk as soon as they do.
+    case_dir: QuantumEntry
+        case directory in the input directory
+    max_bytes: int
+        size the case is checked against
+    """
+    total = 0
+    for (dirpath, dirnames, filenames) in os.walk(case_dir.abspath):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                continue                        # deleted while walking
+            if total > max_bytes:
+                return True
+    return False
+
+
+def plan_case_tasks(case_dir, nodefields, max_depth=SPLIT_MAX_DEPTH):
+    """
+    Splits the case into sub-tasks. Directories that are not lumberjack directories
+    are descended into (up to max_depth below the case directory), picking up the
+    fields of lumberjack directories along the way. Every other entry, including
+    lumberjack directories & archives, becomes a sub-task with its unzip siblings.
+    case_dir: QuantumEntry
+        case directory in the input directory
+    nodefields: NodeFields
+        fields of the case, holding its case number
+    max_depth: int
+        directories deeper than this are not descended into
+    return: list of CaseTask
+        sub-tasks covering every entry of the case
+    """
+    tasks = []
+    plan_dir_tasks(case_dir, nodefields, nodefields.case_num, max_depth, tasks)
+    return tasks
+
+
+def plan_path_task(input_dir, relpath):
+    """
+    Returns the sub-task searching a single entry of a case, such as a path being
+    rescanned, with the fields of the lumberjack directories above it.
+    input_dir: string
+        path to the input directory
+    relpath: string
+        path of the entry relative to the input directory, below a case directory
+    """
+    parts = relpath.split(os.sep)
+    case_num = fields.get_case_number(parts[0])
+    assert case_num != fields.MISSING_CASE_NUM and len(parts) > 1, "Path must be inside a case"
+
+    cur_dir = paths.QuantumEntry(input_dir, parts[0])
+    nodefields = fields.NodeFields(case_num=case_num)
+    for name in parts[1:]:
+        if (cur_dir/"lumberjack.log").is_file():
+            nodefields = fields.extract_fields(cur_dir, inherit_from=nodefields)
+        parent_dir = cur_dir
+        cur_dir = cur_dir/name
+    return CaseTask(case_num, parent_dir.relpath, [parts[-1]], nodefields, entry_size(cur_dir))
+
+
+def plan_dir_tasks(cur_dir, nodefields, case_num, depth_left, tasks):
+    """ Adds the sub-tasks of the directory to the list, see `plan_case_tasks` """
+    if (cur_dir/"lumberjack.log").is_file():
+        nodefields = fields.extract_fields(cur_dir, inherit_from=nodefields)
+
+    siblings = {}
+    for name in cur_dir.listdir():
+        siblings.setdefault(unzip.strip_all_zip_exts(name), []).append(name)
+
+    for names in siblings.values():
+        entry = cur_dir/names[0]
+        if len(names) == 1 and depth_left > 0 and entry.is_dir() and not entry.is_link() \
+                and not (entry/"lumberjack.log").is_file():
+            plan_dir_tasks(entry, nodefields, case_num, depth_left - 1, tasks)
+            continue
+        tasks.append(CaseTask(case_num, cur_dir.relpath, names, nodefields,
+                              sum(entry_size(cur_dir/name) for name in names)))
+
+
+def entry_size(entry):
+    """ Returns the bytes of the file or of the files under the directory, 0 if unreadable """
+    if entry.is_link():
+        return 0
+    try:
+        return cache.tree_size(entry.abspath)
+    except OSError as e:
+        logging.debug("Unable to size sub-task entry %s: %s", entry.abspath, e)
+        return 0
@@ -0,0 +1,86 @@
+"""
+Tests the features found in the archive.py file.
+"""
+
+
+import unittest
+import os
+import time
+import shutil
+import tarfile
+import zipfile
+
+import archive
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class ArchiveIndexTestCase(unittest.TestCase):
+    """ Tests listing & reading archive members without extracting them """
+    
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(os.path.join(self.tmp_dir, "src", "var", "log"))
+        with open(os.path.join(self.tmp_dir, "src", "var", "log", "bycast.log"), "w") as fd:
+            fd.write("bycast line\n")
+        with open(os.path.join(self.tmp_dir, "src", "lumberjack.log"), "w") as fd:
+            fd.write("lumberjack\n")
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+    
+    def check_index(self, index):
+        self.assertTrue(index.is_dir(""))
+        self.assertEqual(["lumberjack.log", "var"], sorted(index.listdir("")))
+        self.assertTrue(index.is_dir("var/log"))
+        self.assertFalse(index.is_file("var/log"))
+        self.assertTrue(index.is_file("var/log/bycast.log"))
+        self.assertTrue(index.exists("var/log/bycast.log"))
+        self.assertFalse(index.exists("var/log/missing.log"))
+        self.assertEqual(12, index.size("var/log/bycast.log"))
+        with index.open("var/log/bycast.log") as fd:
+            self.assertEqual(b"bycast line\n", fd.read())
+        
+        index.close()
+        self.assertTrue(index.is_file("lumberjack.log"))              # reopens when needed
+        index.close()
+    
+    def test_tar(self):
+        tar_path = os.path.join(self.tmp_dir, "bundle.tar")
+        with tarfile.open(tar_path, "w") as tar:
+            tar.add(os.path.join(self.tmp_dir, "src", "var", "log", "bycast.log"), 
+                    arcname="./var/log/bycast.log")                     # parents implied
+            tar.add(os.path.join(self.tmp_dir, "src", "lumberjack.log"), arcname="lumberjack.log")
+        
+        self.check_index(archive.ArchiveIndex(".tar", lambda: open(tar_path, "rb")))
+    
+    def test_zip(self):
+        zip_path = os.path.join(self.tmp_dir, "bundle.zip")
+        with zipfile.ZipFile(zip_path, "w") as z:
+            z.write(os.path.join(self.tmp_dir, "src", "var", "log", "bycast.log"), 
+                    arcname="var/log/bycast.log")
+            z.write(os.path.join(self.tmp_dir, "src", "lumberjack.log"), arcname="lumberjack.log")
+        
+        self.check_index(archive.ArchiveIndex(".zip", lambda: open(zip_path, "rb")))
+    
+    def test_corrupt(self):
+        bad_path = os.path.join(self.tmp_dir, "bad.zip")
+        with open(bad_path, "wb") as fd:
+            fd.write(b"\xFF\xFF\xFF\xFF")
+        
+        index = archive.ArchiveIndex(".zip", lambda: open(bad_path, "rb"))
+        self.assertFalse(index.is_dir(""))
+        self.assertFalse(index.exists(""))
+    
+    def test_normalize_member_name(self):
+        self.assertEqual("var/log/a.log", archive.normalize_member_name("./var/log/a.log"))
+        self.assertEqual("var/log", archive.normalize_member_name("/var/log/"))
+        self.assertEqual("", archive.normalize_member_name("./"))
+        self.assertEqual("", archive.normalize_member_name("../etc/passwd"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+Tests the features found in the cache.py file.
+"""
+
+
+import unittest
+import os
+import time
+import shutil
+import socket
+
+import cache
+import paths
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class ExtractionCacheTestCase(unittest.TestCase):
+    """ Tests storing, fetching & evicting unzipped archives """
+    
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(os.path.join(self.tmp_dir, "input"))
+        self.cache = cache.ExtractionCache(os.path.join(self.tmp_dir, "cache"), 100)
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+    
+    def make_archive(self, name, unzipped_bytes):
+        """ Returns a fake archive & the directory it unzipped into """
+        archive = paths.QuantumEntry(os.path.join(self.tmp_dir, "input"), name + ".tgz")
+        with open(archive.abspath, "wb") as fd:
+            fd.write(name.encode())
+        unzipped_dir = os.path.join(self.tmp_dir, "scratch", name)
+        os.makedirs(os.path.join(unzipped_dir, "log"))
+        with open(os.path.join(unzipped_dir, "log", "bycast.log"), "wb") as fd:
+            fd.write(b"x" * unzipped_bytes)
+        return archive, unzipped_dir
+    
+    def test_store_fetch(self):
+        archive, unzipped_dir = self.make_archive("node1", 40)
+        dest = os.path.join(self.tmp_dir, "rescan", "node1")
+        self.assertFalse(self.cache.fetch(archive, dest))
+        
+        self.cache.store(archive, unzipped_dir)
+        self.assertTrue(self.cache.fetch(archive, dest))
+        self.assertTrue(os.path.samefile(os.path.join(unzipped_dir, "log", "bycast.log"),
+                                         os.path.join(dest, "log", "bycast.log")))
+        
+        # Deleting the scratch copy leaves the cached copy
+        shutil.rmtree(dest)
+        shutil.rmtree(unzipped_dir)
+        self.assertTrue(self.cache.fetch(archive, dest))
+        self.assertEqual(40, cache.tree_size(dest))
+        
+        # A changed archive is a different archive
+        os.utime(archive.abspath, (0, 0))
+        self.assertFalse(self.cache.fetch(archive, os.path.join(self.tmp_dir, "changed")))
+    
+    def test_evict_lru(self):
+        archives = [self.make_archive("node%d" % i, 40) for i in range(3)]
+        self.cache.store(*archives[0])
+        self.cache.store(*archives[1])
+        os.utime(os.path.join(self.cache.cache_dir, self.cache.key_for(archives[1][0]),
+                              "meta.json"), (0, 0))             # least recently used
+        self.cache.store(*archives[2])
+        
+        present = [self.cache.fetch(a, os.path.join(self.tmp_dir, "out", a.basename))
+                   for (a, _) in archives]
+        self.assertEqual([True, False, True], present)
+        
+        too_large, too_large_dir = self.make_archive("huge", 101)
+        self.cache.store(too_large, too_large_dir)
+        self.assertFalse(self.cache.fetch(too_large, os.path.join(self.tmp_dir, "huge")))
+        self.assertEqual([], [n for n in os.listdir(self.cache.cache_dir) if n.startswith("tmp-")])
+    
+    def test_is_same_filesystem(self):
+        self.assertTrue(cache.is_same_filesystem(self.cache.cache_dir, self.tmp_dir))
+        self.assertFalse(cache.is_same_filesystem(self.cache.cache_dir, "/proc"))
+
+
+class ScratchJanitorTestCase(unittest.TestCase):
+    """ Tests reclaiming the scratch directories of killed scans """
+    
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(self.tmp_dir)
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+    
+    def make_scratch_dir(self, name, owner):
+        path = os.path.join(self.tmp_dir, name)
+        os.makedirs(os.path.join(path, "4007"))
+        if owner is not None:
+            with open(os.path.join(path, cache.SCRATCH_OWNER_FILE), "w") as fd:
+                fd.write(owner)
+        return path
+    
+    def test_reclaim_scratch_dirs(self):
+        host = socket.gethostname()
+        mine = self.make_scratch_dir("scratch-space-1", None)
+        cache.claim_scratch_dir(mine)
+        dead = self.make_scratch_dir("scratch-space-2", "%s %d\n" % (host, 2**22 + 1))
+        remote = self.make_scratch_dir("scratch-space-3", "other-host 1\n")
+        fresh = self.make_scratch_dir("scratch-space-4", None)
+        stale = self.make_scratch_dir("scratch-space-5", None)
+        os.utime(stale, (0, 0))
+        other = self.make_scratch_dir("scan-history", None)
+        os.utime(other, (0, 0))
+        restarted = self.make_scratch_dir("scratch-space-6", "other-host 1\n")
+        os.utime(restarted, (0, 0))
+        
+        self.assertEqual(3, cache.reclaim_scratch_dirs(self.tmp_dir))
+        self.assertEqual([True, False, True, True, False, True, False],
+                         [os.path.exists(p) for p in [mine, dead, remote, fresh, stale, other,
+                                                      restarted]])
+
+
+if __name__ == '__main__':
+    unittest.main()
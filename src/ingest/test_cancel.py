@@ -0,0 +1,90 @@
+"""
+Tests the features found in the cancel.py file.
+"""
+
+
+import unittest
+import os
+import time
+import shutil
+import concurrent.futures
+
+import cancel
+import index
+import fields
+import paths
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def wait_for_cancel(timeout):
+    """ Returns whether the worker saw the scan cancelled before the timeout """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cancel.requested():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class CancelTestCase(unittest.TestCase):
+    """ Tests cancelling a scan in every process sharing its event """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(self.tmp_dir)
+
+    def tearDown(self):
+        cancel.clear()
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def test_check(self):
+        self.assertFalse(cancel.requested())
+        cancel.check()
+        cancel.request()
+        self.assertTrue(cancel.requested())
+        with self.assertRaises(cancel.Cancelled):
+            cancel.check()
+        cancel.clear()
+        cancel.check()
+
+    def test_watching(self):
+        lost = [False]
+        with cancel.watching(lambda: lost[0]):
+            cancel.check()
+            lost[0] = True
+            with self.assertRaises(cancel.Cancelled):
+                cancel.check()
+        # Only the work in the context is cancelled
+        self.assertFalse(cancel.requested())
+
+    def test_shared_with_workers(self):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=cancel.install,
+                                                    initargs=(cancel.shared_event(),)) as executor:
+            self.assertFalse(executor.submit(wait_for_cancel, 0).result())
+            future = executor.submit(wait_for_cancel, 30)
+            time.sleep(0.1)
+            cancel.request()
+            self.assertTrue(future.result())
+
+    def test_set_data(self):
+        path = os.path.join(self.tmp_dir, "bycast.log")
+        with open(path, "w") as fd:
+            fd.write("line\n" * (index.CANCEL_CHECK_LINES * 3))
+        entry = paths.QuantumEntry(self.tmp_dir, "bycast.log")
+
+        docs = 0
+        with self.assertRaises(cancel.Cancelled):
+            for _ in index.set_data(entry, 0, fields.NodeFields()):
+                docs += 1
+                if docs == index.CANCEL_CHECK_LINES + 1:
+                    cancel.request()
+        # Stopped at the next check, the file is not read to its end
+        self.assertEqual(index.CANCEL_CHECK_LINES * 2, docs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Tests the features found in the casestats.py file.
+"""
+
+
+import unittest
+import os
+import time
+import shutil
+
+import casestats
+import paths
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def write_file(path, nbytes):
+    """ Writes a file of the given size, creating its directory """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fd:
+        fd.write(b"x" * nbytes)
+
+
+class CaseStatsStoreTestCase(unittest.TestCase):
+    """ Tests recording case stats & ordering cases longest first """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        self.input_dir = os.path.join(self.tmp_dir, "input")
+        self.history_dir = os.path.join(self.tmp_dir, "history")
+        os.makedirs(self.history_dir)
+        write_file(os.path.join(self.input_dir, "2001000001", "a.log"), 10)
+        write_file(os.path.join(self.input_dir, "2001000002", "node", "a.log"), 300)
+        write_file(os.path.join(self.input_dir, "2001000002", "node", "b.log"), 200)
+        write_file(os.path.join(self.input_dir, "2001000003", "a.log"), 100)
+        self.case_dirs = [(paths.QuantumEntry(self.input_dir, case_num), case_num)
+                          for case_num in ["2001000003", "2001000002", "2001000001"]]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def ordered_cases(self, store):
+        return [case_num for (_, case_num) in store.longest_first(self.case_dirs)]
+
+    def test_measure_case(self):
+        stats = casestats.measure_case(self.case_dirs[1][0])
+        self.assertEqual(500, stats.nbytes)
+        self.assertEqual(2, stats.files)
+        self.assertEqual(0, stats.seconds)
+
+        # Only the top levels are listed
+        write_file(os.path.join(self.input_dir, "2001000002", "node", "var", "c.log"), 1000)
+        self.assertEqual(500, casestats.measure_case(self.case_dirs[1][0]).nbytes)
+        self.assertEqual(1500, casestats.measure_case(self.case_dirs[1][0], depth=3).nbytes)
+
+    def test_longest_first(self):
+        # Nothing recorded yet, largest first
+        store = casestats.CaseStatsStore(self.history_dir)
+        self.assertIsNone(store.seconds_per_byte())
+        self.assertEqual(["2001000002", "2001000003", "2001000001"], self.ordered_cases(store))
+
+        # Recorded durations win over sizes, saved for the next scan
+        store.record("2001000001", casestats.CaseStats(10, 1, 50.0))
+        store.record("2001000002", casestats.CaseStats(500, 2, 10.0))
+        store.save()
+        store = casestats.CaseStatsStore(self.history_dir)
+        self.assertEqual(60.0 / 510, store.seconds_per_byte())
+        self.assertEqual(50.0, store.get("2001000001").seconds)
+        self.assertEqual(["2001000001", "2001000003", "2001000002"], self.ordered_cases(store))
+
+        # Later scans of a recorded case do not change the rate of new cases
+        store.record("2001000001", casestats.CaseStats(10, 1, 1.0))
+        self.assertEqual(60.0 / 510, store.seconds_per_byte())
+        self.assertEqual(["2001000003", "2001000002", "2001000001"], self.ordered_cases(store))
+
+        store.prune({"2001000002"})
+        self.assertIsNone(store.get("2001000001"))
+        self.assertEqual(10.0, store.get("2001000002").seconds)
+
+    def test_unreadable(self):
+        with open(os.path.join(self.history_dir, casestats.CASE_STATS_FILE_NAME), "w") as fd:
+            fd.write("{not json")
+        store = casestats.CaseStatsStore(self.history_dir)
+        self.assertIsNone(store.get("2001000001"))
+        self.assertEqual(["2001000002", "2001000003", "2001000001"], self.ordered_cases(store))
+
+
+if __name__ == '__main__':
+    unittest.main()
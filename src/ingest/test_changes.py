@@ -0,0 +1,217 @@
+"""
+Tests the features found in the changes.py file.
+"""
+
+
+import unittest
+import os
+import time
+import shutil
+
+import changes
+import paths
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class FakeWatcher:
+    """ Watcher reporting the changes it is given instead of inotify events """
+
+    def __init__(self, changed):
+        self.changed = changed
+        self.epoch = 0
+        self.synced_epochs = []
+        self.restored = []
+
+    def take(self):
+        (changed, self.changed) = (self.changed, set())
+        return (self.epoch, changed)
+
+    def synced(self, epoch):
+        self.synced_epochs.append(epoch)
+
+    def restore(self, changed):
+        self.restored.append(changed)
+
+
+class ChangeFeedTestCase(unittest.TestCase):
+    """ Tests finding the cases changed since the last completed scan """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        self.input_dir = os.path.join(self.tmp_dir, "input")
+        self.history_dir = os.path.join(self.tmp_dir, "history")
+        os.makedirs(self.history_dir)
+        self.case_dirs = []
+        for case_num in ["2001000002", "2001000001"]:
+            os.makedirs(os.path.join(self.input_dir, case_num, "node", "logs"))
+            self.case_dirs.append((paths.QuantumEntry(self.input_dir, case_num), case_num))
+        self.set_mtimes(1000)
+        self.safe_time = int(time.time())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def set_mtimes(self, mtime):
+        """ Sets the modification time of every directory in the input directory """
+        for (dirpath, dirnames, filenames) in os.walk(self.input_dir):
+            os.utime(dirpath, (mtime, mtime))
+
+    def changed_cases(self, feed):
+        return [case_num for (_, case_num) in feed.changed(self.case_dirs)]
+
+    def test_case_signature(self):
+        case_dir = self.case_dirs[0][0]
+        self.assertEqual((1000 * 10**9, 1000 * 10**9), changes.case_signature(case_dir))
+        os.utime(os.path.join(case_dir.abspath, "node", "logs"), (2000, 2000))
+        self.assertEqual((2000 * 10**9, 2000 * 10**9), changes.case_signature(case_dir))
+
+        # Files only count in the directories modified since the recorded signature
+        log_path = os.path.join(case_dir.abspath, "node", "bycast.log")
+        with open(log_path, "w") as fd:
+            fd.write("line\n")
+        os.utime(log_path, (3000, 3000))
+        os.utime(os.path.dirname(log_path), (1500, 1500))
+        self.assertEqual((2000 * 10**9, 3000 * 10**9), changes.case_signature(case_dir))
+        self.assertEqual((2000 * 10**9, 3000 * 10**9), changes.case_signature(case_dir, 1000 * 10**9))
+        self.assertEqual((2000 * 10**9, 2000 * 10**9), changes.case_signature(case_dir, 2000 * 10**9))
+
+    def test_changed(self):
+        feed = changes.ChangeFeed(self.history_dir)
+        self.assertEqual(["2001000002", "2001000001"], self.changed_cases(feed))
+        feed.commit(self.safe_time)
+
+        feed = changes.ChangeFeed(self.history_dir)
+        self.assertEqual([], self.changed_cases(feed))
+        feed.commit(self.safe_time)
+
+        # A file added deep in a case updates the directory holding it
+        new_path = os.path.join(self.input_dir, "2001000001", "node", "logs", "new.log")
+        with open(new_path, "w") as fd:
+            fd.write("new\n")
+        os.utime(new_path, (2000, 2000))
+        os.utime(os.path.join(self.input_dir, "2001000001", "node", "logs"), (2000, 2000))
+        feed = changes.ChangeFeed(self.history_dir)
+        self.assertEqual(["2001000001"], self.changed_cases(feed))
+
+        # Not completed, still changed next time
+        feed.abandon()
+        feed = changes.ChangeFeed(self.history_dir)
+        self.assertEqual(["2001000001"], self.changed_cases(feed))
+
+        # Changed after the safe time, files may have been left for the next scan
+        feed.commit(1500)
+        feed = changes.ChangeFeed(self.history_dir)
+        self.assertEqual(["2001000001"], self.changed_cases(feed))
+
+        # Deleted cases are forgotten
+        feed.commit(self.safe_time, listed={"2001000001"})
+        self.assertEqual(["2001000001"], sorted(feed.signatures))
+
+        # A file created before the safe time but still written after it, in a directory
+        # older than the safe time, was left for the next scan
+        newer_path = os.path.join(os.path.dirname(new_path), "newer.log")
+        with open(newer_path, "w") as fd:
+            fd.write("more\n")
+        os.utime(newer_path, (self.safe_time + 10, self.safe_time + 10))
+        os.utime(os.path.dirname(new_path), (3000, 3000))
+        feed = changes.ChangeFeed(self.history_dir)
+        self.assertIn("2001000001", self.changed_cases(feed))
+        feed.commit(self.safe_time)
+        self.assertNotIn("2001000001", feed.signatures)
+        feed = changes.ChangeFeed(self.history_dir)
+        self.assertIn("2001000001", self.changed_cases(feed))
+        feed.commit(self.safe_time + 20)
+        self.assertIn("2001000001", feed.signatures)
+
+        # Files rewritten in place are not noticed without the watcher
+        with open(newer_path, "a") as fd:
+            fd.write("more\n")
+        feed = changes.ChangeFeed(self.history_dir)
+        self.assertNotIn("2001000001", self.changed_cases(feed))
+
+    def test_watched(self):
+        feed = changes.ChangeFeed(self.history_dir)
+        feed.changed(self.case_dirs)
+        feed.commit(self.safe_time)
+        self.set_mtimes(2000)
+
+        # Cases with a recorded signature that were not watched changing are not walked
+        watcher = FakeWatcher({"2001000001"})
+        feed = changes.ChangeFeed(self.history_dir, watcher)
+        self.assertEqual(["2001000001"], self.changed_cases(feed))
+        feed.abandon()
+        self.assertEqual([{"2001000001"}], watcher.restored)
+
+        # Events were lost, every case is walked
+        watcher = FakeWatcher(None)
+        feed = changes.ChangeFeed(self.history_dir, watcher)
+        self.assertEqual(["2001000002", "2001000001"], self.changed_cases(feed))
+        feed.commit(self.safe_time)
+        self.assertEqual([0], watcher.synced_epochs)
+
+        # Cases watched changing are searched even with the same signature
+        watcher = FakeWatcher({"2001000002"})
+        feed = changes.ChangeFeed(self.history_dir, watcher)
+        self.assertEqual(["2001000002"], self.changed_cases(feed))
+
+    def test_is_local_filesystem(self):
+        mounts_path = os.path.join(self.tmp_dir, "mounts")
+        with open(mounts_path, "w") as fd:
+            fd.write("/dev/sda1 / ext4 rw 0 0\n")
+            fd.write("server:/export %s nfs4 rw 0 0\n" % self.input_dir)
+            fd.write("tmpfs %s tmpfs rw 0 0\n" % os.path.join(self.input_dir, "2001000001"))
+        self.assertTrue(changes.is_local_filesystem(self.history_dir, mounts_path))
+        self.assertFalse(changes.is_local_filesystem(self.input_dir, mounts_path))
+        self.assertFalse(changes.is_local_filesystem(self.case_dirs[0][0].abspath, mounts_path))
+        self.assertTrue(changes.is_local_filesystem(self.case_dirs[1][0].abspath, mounts_path))
+        self.assertFalse(changes.is_local_filesystem(self.input_dir, mounts_path + "-missing"))
+
+    def test_unreadable(self):
+        with open(os.path.join(self.history_dir, changes.SNAPSHOT_FILE_NAME), "w") as fd:
+            fd.write("[1, 2")
+        feed = changes.ChangeFeed(self.history_dir)
+        self.assertEqual(["2001000002", "2001000001"], self.changed_cases(feed))
+
+
+@unittest.skipUnless(changes.AVAILABLE, "inotify_simple is not installed")
+class ChangeWatcherTestCase(unittest.TestCase):
+    """ Tests collecting the cases changed under a watched input directory """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(os.path.join(self.tmp_dir, "2001000001", "node"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def wait_for_changes(self, watcher, expected):
+        changed = set()
+        for _ in range(50):
+            changed |= watcher.take()[1] or set()
+            if changed >= expected:
+                break
+            time.sleep(0.1)
+        return changed
+
+    def test_watch(self):
+        watcher = changes.ChangeWatcher(self.tmp_dir)
+        try:
+            self.assertIsNone(watcher.take()[1])
+            watcher.synced(0)
+            with open(os.path.join(self.tmp_dir, "2001000001", "node", "x.log"), "w") as fd:
+                fd.write("x\n")
+            os.makedirs(os.path.join(self.tmp_dir, "2001000002", "node"))
+            self.assertEqual({"2001000001", "2001000002"},
+                             self.wait_for_changes(watcher, {"2001000001", "2001000002"}))
+        finally:
+            watcher.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Tests the features found in the coordinate.py file.
+"""
+
+
+import unittest
+import os
+import time
+import shutil
+
+import coordinate
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class CoordinatorTestCase(unittest.TestCase):
+    """ Tests claiming cases from other hosts through lease files """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        self.host_a = coordinate.Coordinator(self.tmp_dir, "host-a", heartbeat_seconds=60)
+        self.host_b = coordinate.Coordinator(self.tmp_dir, "host-b", heartbeat_seconds=60)
+
+    def tearDown(self):
+        self.host_a.close()
+        self.host_b.close()
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def expire(self, case_num):
+        """ Ages the lease of the case past its expiry """
+        path = os.path.join(self.tmp_dir, "leases", case_num + ".lease")
+        old = time.time() - coordinate.LEASE_SECONDS - 60
+        os.utime(path, (old, old))
+
+    def complete(self, coordinator, case_num, partial=False):
+        """ Writes the history files of a case searched in the joined round """
+        open(os.path.join(coordinator.round_dir, case_num + ".txt"), "w").close()
+        if partial:
+            open(os.path.join(coordinator.round_dir, case_num + "-log.txt"), "w").close()
+
+    def test_claim(self):
+        self.assertTrue(self.host_a.claim("2001000001"))
+        self.assertFalse(self.host_b.claim("2001000001"))
+        self.assertTrue(self.host_b.claim("2001000002"))
+        self.assertEqual({"2001000001"}, self.host_a.held)
+
+        # Released, claimed by the next host asking for it
+        self.host_a.release("2001000001")
+        self.assertEqual(set(), self.host_a.held)
+        self.assertTrue(self.host_b.claim("2001000001"))
+        self.assertEqual({"2001000001", "2001000002"}, self.host_b.held)
+        self.host_b.release_all()
+        self.assertEqual([], os.listdir(os.path.join(self.tmp_dir, "leases")))
+
+    def test_reclaim_expired(self):
+        self.assertTrue(self.host_a.claim("2001000001"))
+        self.expire("2001000001")
+        self.assertTrue(self.host_b.claim("2001000001"))
+        self.assertEqual(["2001000001.lease"], os.listdir(os.path.join(self.tmp_dir, "leases")))
+
+        # The host that lost its lease learns it on its next heartbeat & leaves it alone
+        with self.assertLogs(level="CRITICAL"):
+            self.host_a.heartbeat()
+        self.assertEqual(set(), self.host_a.held)
+        self.host_a.release("2001000001")
+        self.assertFalse(self.host_a.claim("2001000001"))
+        self.assertEqual({"2001000001"}, self.host_b.held)
+
+    def test_lease(self):
+        self.assertIsNone(self.host_a.lease("2001000001"))
+        self.assertTrue(self.host_a.claim("2001000001"))
+        lease = self.host_a.lease("2001000001")
+        self.assertTrue(lease.is_held())
+        self.assertFalse(lease.lost())
+        self.assertTrue(self.host_a.holds("2001000001"))
+
+        # The worker searching the case learns it was reclaimed at its next check
+        self.expire("2001000001")
+        self.assertTrue(self.host_b.claim("2001000001"))
+        self.assertFalse(self.host_a.holds("2001000001"))
+        self.assertFalse(lease.is_held())
+        self.assertFalse(lease.lost())
+        lease._next_check = 0
+        self.assertTrue(lease.lost())
+
+    def test_read_lease(self):
+        path = os.path.join(self.tmp_dir, "leases", "2001000001.lease")
+        self.assertIsNone(coordinate.read_lease(path))
+        with open(path, "w") as fd:
+            fd.write("{\"tok")
+        self.assertEqual("", coordinate.read_lease(path)[0])
+
+        # Errors of the shared volume are not mistaken for a missing or half written lease
+        with self.assertRaises(OSError):
+            coordinate.read_lease(os.path.join(path, "not-a-dir"))
+
+    def test_heartbeat(self):
+        self.assertTrue(self.host_a.claim("2001000001"))
+        self.expire("2001000001")
+        self.host_a.heartbeat()
+        self.assertFalse(self.host_b.claim("2001000001"))
+        self.assertEqual({"2001000001"}, self.host_a.held)
+
+    def test_rounds(self):
+        round_dir = self.host_a.join_round()
+        self.assertEqual(os.path.join(self.tmp_dir, "rounds", "1"), round_dir)
+        self.assertEqual(round_dir, self.host_b.join_round())
+
+        # Done by any host once its case history is complete in the round
+        case_nums = ["2001000001", "2001000002"]
+        self.complete(self.host_a, "2001000001")
+        self.complete(self.host_b, "2001000002", partial=True)
+        self.assertTrue(self.host_b.is_done("2001000001"))
+        self.assertFalse(self.host_a.is_done("2001000002"))
+        self.assertFalse(self.host_a.finish_round(case_nums))
+
+        self.complete(self.host_a, "2001000002")
+        os.remove(os.path.join(round_dir, "2001000002-log.txt"))
+        self.assertTrue(self.host_a.finish_round(case_nums))
+        self.assertEqual(os.path.join(self.tmp_dir, "rounds", "2"), self.host_b.join_round())
+        self.assertFalse(self.host_b.is_done("2001000001"))
+
+        # Rounds before the previous one are deleted
+        self.complete(self.host_b, "2001000001")
+        self.complete(self.host_b, "2001000002")
+        self.assertTrue(self.host_b.finish_round(case_nums))
+        self.assertEqual(["2", "3"], sorted(os.listdir(os.path.join(self.tmp_dir, "rounds"))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Tests the features found in the daemon.py file.
+"""
+
+
+import unittest
+import os
+import time
+import shutil
+
+import daemon
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class ParseJobTestCase(unittest.TestCase):
+    """ Tests reading jobs from the command line """
+
+    def test_parse_job(self):
+        job = daemon.parse_job("scan", "input")
+        self.assertEqual(("scan", ""), (job.kind, job.target))
+        self.assertEqual(os.path.abspath("input"), job.input_dir)
+
+        job = daemon.parse_job("case:2001872931", "input")
+        self.assertEqual(("case", "2001872931"), (job.kind, job.target))
+
+        job = daemon.parse_job("path:2001872931/node1//bycast.log", "input")
+        self.assertEqual(("path", "2001872931/node1/bycast.log"), (job.kind, job.target))
+
+        for spec in ["rescan", "case:123", "path:2001872931", "path:../2001872931/x",
+                     "path:/2001872931/x", "path:other/x"]:
+            self.assertRaises(ValueError, daemon.parse_job, spec, "input")
+
+
+class JobQueueTestCase(unittest.TestCase):
+    """ Tests submitting, running & following jobs """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(self.tmp_dir)
+        self.queue = daemon.JobQueue(self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def listdir(self, name):
+        return sorted(os.listdir(os.path.join(self.tmp_dir, name)))
+
+    def test_serve(self):
+        jobs = [daemon.Job("1-1", "scan", "", "/input"),
+                daemon.Job("2-1", "case", "2001872931", "/input"),
+                daemon.Job("3-1", "path", "2001872931/x", "/input")]
+        for job in jobs:
+            self.queue.submit(job)
+        self.assertEqual(["1-1.json", "2-1.json", "3-1.json"], self.listdir("incoming"))
+
+        ran = []
+        def run_job(job, report):
+            ran.append(str(job))
+            report(done=1, total=2)
+            if job.kind == "path":
+                raise OSError("unreadable")
+            return "done"
+        daemon.serve(self.queue, run_job, lambda: len(ran) == 3, poll_seconds=0)
+
+        # Oldest first, failed jobs do not stop the daemon
+        self.assertEqual(["1-1 scan", "2-1 case 2001872931", "3-1 path 2001872931/x"], ran)
+        self.assertEqual([], self.listdir("incoming"))
+        self.assertEqual([], self.listdir("running"))
+        self.assertEqual(["1-1.json", "2-1.json", "3-1.json"], self.listdir("finished"))
+
+        progress = list(self.queue.follow(jobs[0], poll_seconds=0))
+        self.assertEqual(["running", "running", "done"], [p["state"] for p in progress])
+        self.assertEqual((1, 2), (progress[1]["done"], progress[1]["total"]))
+        progress = list(self.queue.follow(jobs[2], poll_seconds=0))
+        self.assertEqual(("failed", "unreadable"), (progress[-1]["state"], progress[-1]["error"]))
+
+    def test_recover(self):
+        self.queue.submit(daemon.Job("1-1", "scan", "", "/input"))
+        self.queue.submit(daemon.Job("2-1", "scan", "", "/input"))
+        self.assertEqual("1-1", self.queue.take().job_id)
+        self.assertEqual(["1-1.json"], self.listdir("running"))
+
+        # Killed while running, requeued in front of the jobs submitted after it
+        self.queue.recover()
+        self.assertEqual("1-1", self.queue.take().job_id)
+        self.assertEqual("2-1", self.queue.take().job_id)
+        self.assertIsNone(self.queue.take())
+
+    def test_unreadable_job(self):
+        with open(os.path.join(self.tmp_dir, "incoming", "1-1.json"), "w") as fd:
+            fd.write("{not json")
+        self.assertIsNone(self.queue.take())
+        self.assertEqual(["1-1.json"], self.listdir("finished"))
+
+
+if __name__ == '__main__':
+    unittest.main()
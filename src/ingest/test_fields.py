@@ -358,6 +358,24 @@ class ExtractFieldsTestCase(unittest.TestCase):
         except Exception as exc:
             self.fail(exc)
     
+    def test_extract_fields_from_archive(self):
+        lumber_dir = os.path.join(TEST_DATA_DIR, "2234567890", "grid_id_293977",
+                                  "node_name_paris", "2018-2019")
+        tar_entry = paths.QuantumEntry(self.tmp_dir, "bundle.tar")
+        with tarfile.open(tar_entry.abspath, "w") as tar:
+            tar.add(os.path.join(TEST_DATA_DIR, "2234567890"), arcname="2234567890")
+        
+        root = paths.ArchiveEntry.from_archive(tar_entry)
+        in_archive = root/"2234567890/grid_id_293977/node_name_paris/2018-2019"
+        found = fields.extract_fields(in_archive, inherit_from=fields.NodeFields())
+        expected = fields.extract_fields(lumber_dir, inherit_from=fields.NodeFields())
+        self.assertEqual(expected.sg_ver, found.sg_ver)
+        self.assertEqual(expected.platform, found.platform)
+        self.assertEqual(expected.node_name, found.node_name)
+        self.assertEqual(expected.time_span, found.time_span)
+        self.assertEqual(expected.grid_id, found.grid_id)
+        root.close()
+    
     def test_extract_fields_only_version(self):
         lumber_dir = os.path.join(self.tmp_dir, "gridid_542839", "nodename_london", "2015-2017")
         os.makedirs(lumber_dir)
@@ -442,6 +460,33 @@ class FilterFilesTestCase(unittest.TestCase):
         
         os.chdir(cur_work_dir)
     
+    def test_entry_contains_gzip_stream(self):
+        archive = paths.QuantumEntry(self.tmp_dir, "fileX.txt.gz")
+        with gzip.open(archive.abspath, "wb") as fd:
+            fd.write(b"Some text\nSome text\n")
+        self.assertFalse(fields.entry_contains_bycast(paths.GzipEntry(archive)))
+        self.assertFalse(fields.is_storagegrid(fields.NodeFields(), paths.GzipEntry(archive)))
+        
+        with gzip.open(archive.abspath, "wb") as fd:
+            fd.write(b"Some text\nbycast!\n")
+        self.assertTrue(fields.entry_contains_bycast(paths.GzipEntry(archive)))
+        self.assertTrue(fields.is_storagegrid(fields.NodeFields(), paths.GzipEntry(archive)))
+    
+    def test_is_extraction_candidate(self):
+        self.assertTrue(fields.is_extraction_candidate("var/local/log/bycast.log"))
+        self.assertTrue(fields.is_extraction_candidate("var/log/syslog"))
+        self.assertTrue(fields.is_extraction_candidate("var/log/syslog.2.gz"))
+        self.assertTrue(fields.is_extraction_candidate("node/nested.tgz"))
+        self.assertTrue(fields.is_extraction_candidate("node/2018-2019/system_commands"))
+        self.assertTrue(fields.is_extraction_candidate("node/2018-2019/os/etc/user_data"))
+        self.assertTrue(fields.is_extraction_candidate("os/etc/user_data"))
+        
+        self.assertFalse(fields.is_extraction_candidate("var/crashes/core.12345"))
+        self.assertFalse(fields.is_extraction_candidate("usr/bin/ade-exporter"))
+        self.assertFalse(fields.is_extraction_candidate("cassandra/data/md-1-big-Data.db"))
+        self.assertFalse(fields.is_extraction_candidate("jvm/java_pid1.hprof"))
+        self.assertFalse(fields.is_extraction_candidate("etc/user_data"))
+    
     def test_is_storagegrid_related(self):
         base_dir = paths.QuantumEntry(self.tmp_dir, "")
         
@@ -0,0 +1,124 @@
+"""
+Tests the features found in the governor.py file.
+"""
+
+
+import unittest
+import os
+import time
+import shutil
+
+import governor
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def get_pid():
+    """ Returns the pid of the worker running the call """
+    return os.getpid()
+
+
+def hold_extraction(seconds):
+    """ Holds an extraction slot for a while, returns when it held it """
+    with governor.extraction():
+        start = time.time()
+        time.sleep(seconds)
+        return (start, time.time())
+
+
+class CgroupTestCase(unittest.TestCase):
+    """ Tests reading the limits of the cgroup """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(self.tmp_dir)
+        self.proc_cgroup = os.path.join(self.tmp_dir, "proc-cgroup")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def write(self, relpath, text):
+        path = os.path.join(self.tmp_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fd:
+            fd.write(text + "\n")
+
+    def test_cgroup_v2(self):
+        root = os.path.join(self.tmp_dir, "v2")
+        self.write("v2/cgroup.controllers", "cpu memory")
+        self.write("v2/cpu.max", "max 100000")
+        self.write("v2/memory.max", "max")
+        self.write("proc-cgroup", "0::/")
+        self.assertIsNone(governor.cgroup_cpu_limit(root, self.proc_cgroup))
+        self.assertIsNone(governor.cgroup_memory_limit(root, self.proc_cgroup))
+
+        # The process's own cgroup comes first
+        self.write("v2/ingest/cpu.max", "150000 100000")
+        self.write("v2/ingest/memory.max", str(2 * 1024**3))
+        self.write("proc-cgroup", "0::/ingest")
+        self.assertEqual(1.5, governor.cgroup_cpu_limit(root, self.proc_cgroup))
+        self.assertEqual(2 * 1024**3, governor.cgroup_memory_limit(root, self.proc_cgroup))
+
+    def test_cgroup_v1(self):
+        root = os.path.join(self.tmp_dir, "v1")
+        self.write("v1/cpu/cpu.cfs_quota_us", "-1")
+        self.write("v1/cpu/cpu.cfs_period_us", "100000")
+        self.write("v1/memory/memory.limit_in_bytes", "9223372036854771712")
+        self.write("proc-cgroup", "4:cpu,cpuacct:/docker/abc\n3:memory:/docker/abc")
+        self.assertIsNone(governor.cgroup_cpu_limit(root, self.proc_cgroup))
+        self.assertIsNone(governor.cgroup_memory_limit(root, self.proc_cgroup))
+
+        self.write("v1/cpu/cpu.cfs_quota_us", "200000")
+        self.write("v1/memory/memory.limit_in_bytes", str(1024**3))
+        self.assertEqual(2.0, governor.cgroup_cpu_limit(root, self.proc_cgroup))
+        self.assertEqual(1024**3, governor.cgroup_memory_limit(root, self.proc_cgroup))
+
+    def test_pool_size(self):
+        root = os.path.join(self.tmp_dir, "v2")
+        self.write("v2/cgroup.controllers", "cpu memory")
+        self.write("v2/cpu.max", "100000 100000")
+        self.write("v2/memory.max", str(4 * 1024**3))
+        self.assertEqual(1, governor.pool_size(root))
+        self.assertEqual(int(4 * 1024**3 * governor.WORKER_MEMORY_SHARE) // 3,
+                         governor.default_rss_ceiling(2, root))
+
+        # Never fewer than one worker, even if the memory limit is short of one
+        self.write("v2/cpu.max", "max 100000")
+        self.write("v2/memory.max", str(governor.MIN_WORKER_BYTES // 2))
+        self.assertEqual(1, governor.pool_size(root))
+
+        # Unknown limits leave the processors of the host
+        self.assertEqual(len(os.sched_getaffinity(0)),
+                         governor.pool_size(os.path.join(self.tmp_dir, "missing")))
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+    """ Tests recycling the workers & capping heavy operations across them """
+
+    def test_recycle(self):
+        with governor.WorkerPool(1) as pool:
+            pids = set(pool.submit(get_pid).result() for _ in range(3))
+            self.assertEqual(1, len(pids))
+            self.assertEqual(0, pool.recycled)
+
+        # Every worker outgrows a ceiling of one byte
+        with governor.WorkerPool(1, rss_ceiling=1) as pool:
+            pids = set(pool.submit(get_pid).result() for _ in range(3))
+            self.assertEqual(3, len(pids))
+            self.assertEqual(2, pool.recycled)
+
+    def test_extraction_slots(self):
+        with governor.WorkerPool(2, max_extractions=1) as pool:
+            futures = [pool.submit(hold_extraction, 0.3) for _ in range(2)]
+            (first, second) = sorted(f.result() for f in futures)
+        self.assertLessEqual(first[1], second[0])
+
+        # Outside of a pool nothing is capped
+        self.assertEqual(2, len(hold_extraction(0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
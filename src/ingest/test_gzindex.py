@@ -0,0 +1,122 @@
+"""
+Tests the features found in the gzindex.py file.
+"""
+
+
+import unittest
+import os
+import time
+import gzip
+import shutil
+
+import gzindex
+import index
+import fields
+import paths
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class GzipCheckpointTestCase(unittest.TestCase):
+    """ Tests resuming the indexing of a gzip log from a checkpoint """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        self.history_dir = os.path.join(self.tmp_dir, "history")
+        os.makedirs(self.history_dir)
+
+        self.archive = paths.QuantumEntry(self.tmp_dir, "bycast.log.gz")
+        with gzip.open(self.archive.abspath, "wb") as fd:
+            for i in range(100):
+                fd.write(b"line %d\n" % (i + 1))
+
+        self.orig_settings = (gzindex.MIN_CHECKPOINT_SIZE, gzindex.CHECKPOINT_LINES,
+                              gzindex.AVAILABLE)
+        gzindex.MIN_CHECKPOINT_SIZE = 0
+        gzindex.CHECKPOINT_LINES = 10
+
+    def tearDown(self):
+        (gzindex.MIN_CHECKPOINT_SIZE, gzindex.CHECKPOINT_LINES,
+         gzindex.AVAILABLE) = self.orig_settings
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def interrupted_send(self, acknowledged, read):
+        """ Reads `read` lines of the log while the first `acknowledged` are indexed """
+        entry = paths.GzipEntry(self.archive)
+        checkpoint = gzindex.GzipCheckpoint.for_entry(entry, self.history_dir)
+        self.assertIsNotNone(checkpoint)
+        checkpoint.acknowledge(acknowledged)
+
+        data = index.set_data(entry, 1957, fields.NodeFields(case_num="4007"), checkpoint)
+        docs = [next(data) for _ in range(read)]
+        data.close()
+        return docs
+
+    def resumed_ids(self):
+        """ Returns the doc ids sent by a new attempt at the log """
+        entry = paths.GzipEntry(self.archive)
+        checkpoint = gzindex.GzipCheckpoint.for_entry(entry, self.history_dir)
+        docs = list(index.set_data(entry, 1957, fields.NodeFields(case_num="4007"), checkpoint))
+        return checkpoint, [d["_id"] for d in docs], [d["_source"]["message"] for d in docs]
+
+    def check_resume(self):
+        self.interrupted_send(acknowledged=35, read=61)
+
+        checkpoint, ids, messages = self.resumed_ids()
+        self.assertEqual(30, checkpoint.line)
+        self.assertEqual("bycast.log/31", ids[0])
+        self.assertEqual("line 31\n", messages[0])
+        self.assertEqual("bycast.log/100", ids[-1])
+        self.assertEqual(70, len(ids))
+
+        checkpoint.clear()
+        self.assertEqual([], os.listdir(os.path.join(self.history_dir, gzindex.CHECKPOINT_DIR_NAME)))
+        self.assertEqual(100, len(self.resumed_ids()[1]))
+
+    @unittest.skipUnless(gzindex.AVAILABLE, "indexed_gzip is not installed")
+    def test_resume_indexed(self):
+        self.check_resume()
+
+    def test_resume_reinflate(self):
+        gzindex.AVAILABLE = False
+        self.check_resume()
+
+    def test_unacknowledged_not_saved(self):
+        self.interrupted_send(acknowledged=0, read=50)
+        self.assertEqual(100, len(self.resumed_ids()[1]))
+
+    def test_changed_log(self):
+        self.interrupted_send(acknowledged=100, read=50)
+        os.utime(self.archive.abspath, (0, 0))
+        self.assertEqual(100, len(self.resumed_ids()[1]))
+
+    def test_small_or_plain_logs(self):
+        gzindex.MIN_CHECKPOINT_SIZE = 1024 * 1024
+        self.assertIsNone(gzindex.GzipCheckpoint.for_entry(paths.GzipEntry(self.archive),
+                                                           self.history_dir))
+        gzindex.MIN_CHECKPOINT_SIZE = 0
+        self.assertIsNone(gzindex.GzipCheckpoint.for_entry(self.archive, self.history_dir))
+        self.assertIsNone(gzindex.GzipCheckpoint.for_entry(paths.GzipEntry(self.archive), None))
+
+    def test_prune(self):
+        self.assertEqual(0, gzindex.prune(self.history_dir))
+        self.interrupted_send(acknowledged=35, read=61)
+        checkpoint_dir = os.path.join(self.history_dir, gzindex.CHECKPOINT_DIR_NAME)
+        saved = sorted(os.listdir(checkpoint_dir))
+        self.assertNotEqual([], saved)
+        self.assertEqual(0, gzindex.prune(self.history_dir))
+        self.assertEqual(saved, sorted(os.listdir(checkpoint_dir)))
+
+        stale = os.path.join(checkpoint_dir, saved[0])
+        os.utime(stale, (0, 0))
+        self.assertEqual(1, gzindex.prune(self.history_dir))
+        self.assertFalse(os.path.exists(stale))
+        self.assertEqual(len(saved) - 1, gzindex.prune(self.history_dir, max_age=0))
+        self.assertEqual([], os.listdir(checkpoint_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
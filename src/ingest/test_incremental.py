@@ -374,6 +374,83 @@ class WorkerScanTestCase(unittest.TestCase):
         #self.assertEqual(scan.safe_time, scan.time_period.stop)
         
         self.assertEqual("", scan.last_path)
+    
+    def test_scratch_dirs(self):
+        scratch_dir = os.path.join(self.scratch_dir, "disk")
+        ram_scratch_dir = os.path.join(self.scratch_dir, "ram")
+        os.makedirs(os.path.join(ram_scratch_dir, "4007", "node1"))
+        scan = incremental.WorkerScan(
+            self.input_dir, self.history_dir, scratch_dir,
+            "4007.txt", "4007-log.txt", time.time(), ram_scratch_dir=ram_scratch_dir)
+        
+        self.assertEqual([scratch_dir, ram_scratch_dir], scan.scratch_dirs)
+        self.assertTrue(scan.is_scratch_entry(paths.QuantumEntry(scratch_dir, "4007")))
+        self.assertTrue(scan.is_scratch_entry(paths.QuantumEntry(ram_scratch_dir, "4007")))
+        self.assertFalse(scan.is_scratch_entry(paths.QuantumEntry(self.input_dir, "4007")))
+        self.assertTrue(scan.exists_in_scratch(paths.QuantumEntry(self.input_dir, "4007/node1")))
+        self.assertFalse(scan.exists_in_scratch(paths.QuantumEntry(self.input_dir, "4007/node2")))
+        
+        scan.ram_scratch_dir = None
+        self.assertEqual([scratch_dir], scan.scratch_dirs)
+        self.assertFalse(scan.is_scratch_entry(paths.QuantumEntry(ram_scratch_dir, "4007")))
+
+    def test_task_history(self):
+        self.assertFalse(incremental.has_task_history(self.history_dir, "2001789555"))
+        (active_file, log_file) = incremental.task_history_files(self.history_dir, "2001789555", "ab12")
+        scan = incremental.WorkerScan(
+            self.input_dir, self.history_dir, self.scratch_dir,
+            active_file, log_file, time.time())
+        self.assertFalse(scan.already_scanned)
+        self.assertTrue(os.path.isfile(scan.history_log_file))
+        self.assertTrue(incremental.has_task_history(self.history_dir, "2001789555"))
+        self.assertFalse(incremental.has_task_history(self.history_dir, "2001789556"))
+
+        # Completed sub-tasks are skipped, like completed cases
+        scan.complete_scan()
+        os.remove(os.path.join(self.history_dir, log_file))
+        scan = incremental.WorkerScan(
+            self.input_dir, self.history_dir, self.scratch_dir,
+            active_file, log_file, time.time())
+        self.assertTrue(scan.already_scanned)
+
+        incremental.delete_task_history(self.history_dir, "2001789555")
+        self.assertFalse(incremental.has_task_history(self.history_dir, "2001789555"))
+
+        # Only the given sub-task, or the whole case
+        for key in ["ab12", "ef56"]:
+            for name in incremental.task_history_files(self.history_dir, "2001789555", key):
+                open(os.path.join(self.history_dir, name), "w").close()
+        open(os.path.join(self.history_dir, "2001789555.txt"), "w").close()
+        incremental.delete_task_history(self.history_dir, "2001789555", "ab12")
+        self.assertEqual(["2001789555-ef56-log.txt", "2001789555-ef56.txt"], sorted(os.listdir(
+            os.path.join(self.history_dir, incremental.TASK_HISTORY_DIR_NAME))))
+        incremental.delete_case_history(self.history_dir, "2001789555")
+        self.assertFalse(incremental.has_task_history(self.history_dir, "2001789555"))
+        self.assertFalse(os.path.exists(os.path.join(self.history_dir, "2001789555.txt")))
+
+        incremental.task_history_files(self.history_dir, "2001789555", "cd34")
+        manager = incremental.ManagerScan(self.input_dir, self.history_dir, self.scratch_dir)
+        manager.complete_scan()
+        self.assertFalse(os.path.exists(os.path.join(self.history_dir,
+                                                     incremental.TASK_HISTORY_DIR_NAME)))
+
+    def test_manager_premature_exit(self):
+        for case_num in ["2001000001", "2001000002", "2001000003", "2001000004"]:
+            os.mkdir(os.path.join(self.input_dir, case_num))
+        os.mkdir(os.path.join(self.input_dir, "not-a-case"))
+        # Cases completed out of order: 4 & 2 done, 3 never started, 1 in progress
+        for name in ["2001000004.txt", "2001000002.txt", "2001000001.txt", "2001000001-log.txt"]:
+            open(os.path.join(self.history_dir, name), "w").close()
+
+        manager = incremental.ManagerScan(self.input_dir, self.history_dir, self.scratch_dir)
+        manager.premature_exit()
+
+        # Stops before the case that was never started, the later completed case is kept
+        last_record = incremental.extract_last_scan_record(manager.history_active_file)
+        self.assertEqual(os.path.join(self.input_dir, "2001000004"), last_record.last_path)
+        self.assertFalse(os.path.exists(os.path.join(self.history_dir, "2001000004.txt")))
+        self.assertTrue(os.path.exists(os.path.join(self.history_dir, "2001000002.txt")))
+        self.assertTrue(os.path.exists(os.path.join(self.history_dir, "2001000001-log.txt")))
 
 
 class ScanHelperFuncTestCase(unittest.TestCase):
@@ -137,6 +137,33 @@ class IndexDataTestCase(unittest.TestCase):
         
         return
     
+    def test_set_data_gzip(self):
+        archive = paths.QuantumEntry(self.tmp_dir, "aaa.txt.gz")
+        with gzip.open(archive.abspath, "wb") as fd:
+            fd.write(b"xyz\npqr\n")
+        
+        nodefields = fields.NodeFields(case_num="4007")
+        docs = list(index.set_data(paths.GzipEntry(archive), 1957, nodefields))
+        self.assertEqual(["aaa.txt/1", "aaa.txt/2"], [d["_id"] for d in docs])
+        self.assertEqual(["xyz\n", "pqr\n"], [d["_source"]["message"] for d in docs])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, "aaa.txt")))
+        
+        # A truncated gzip ends the file instead of the scan
+        with open(archive.abspath, "rb") as fd:
+            data = fd.read()
+        with open(archive.abspath, "wb") as fd:
+            fd.write(data[:len(data) // 2])
+        docs = list(index.set_data(paths.GzipEntry(archive), 1957, nodefields))
+        self.assertEqual([], docs)
+        
+        # As does a corrupt one
+        with open(archive.abspath, "wb") as fd:
+            fd.write(b"not a gzip")
+        docs = list(index.set_data(paths.GzipEntry(archive), 1957, nodefields))
+        self.assertEqual([], docs)
+        
+        return
+    
     def test_set_data_decode_error(self):
         xxx_file = paths.QuantumEntry(self.tmp_dir, "xxx.txt")
         with open(xxx_file.abspath, "wb") as fd:
@@ -0,0 +1,176 @@
+"""
+Tests the features found in the manifest.py file.
+"""
+
+
+import unittest
+import os
+import io
+import time
+import gzip
+import shutil
+import tarfile
+import zipfile
+
+import manifest
+import sevenzip
+import paths
+import fields
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def add_tar_member(tar, name, data):
+    """ Adds a file member holding the data to the open tar archive """
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+class ReadManifestTestCase(unittest.TestCase):
+    """ Tests reading archive manifests from their headers """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def test_zip_and_tar(self):
+        zip_entry = paths.QuantumEntry(self.tmp_dir, "bundle.zip")
+        with zipfile.ZipFile(zip_entry.abspath, "w") as z:
+            z.writestr("var/local/log/bycast.log", "x" * 10)
+            z.writestr("var/local/core/", "")
+            z.writestr("../escaped.log", "y")
+        # Unsafe names are left out
+        self.assertEqual({"var/local/log/bycast.log": 10},
+                         manifest.read_manifest(zip_entry).members)
+
+        tar_entry = paths.QuantumEntry(self.tmp_dir, "bundle.tar")
+        with tarfile.open(tar_entry.abspath, "w") as tar:
+            add_tar_member(tar, "./var/local/log/bycast.log", b"x" * 10)
+            add_tar_member(tar, "var/local/core/core.1", b"y" * 5)
+        tar_manifest = manifest.read_manifest(tar_entry)
+        self.assertTrue(tar_manifest.complete)
+        self.assertEqual({"var/local/log/bycast.log": 10, "var/local/core/core.1": 5},
+                         tar_manifest.members)
+        self.assertTrue(tar_manifest.is_relevant(fields.is_extraction_candidate))
+
+    def test_compressed_tar(self):
+        tgz_entry = paths.QuantumEntry(self.tmp_dir, "node.tar.gz")
+        with tarfile.open(tgz_entry.abspath, "w:gz") as tar:
+            add_tar_member(tar, "var/local/core/core.1", b"y" * 5)
+            add_tar_member(tar, "var/local/log/bycast.log", b"x" * 10)
+            add_tar_member(tar, "var/local/log/servermanager.log", b"z")
+
+        tgz_manifest = manifest.read_manifest(tgz_entry)
+        self.assertTrue(tgz_manifest.complete)
+        self.assertEqual(3, len(tgz_manifest.members))
+
+        # Stops inflating at the first relevant member
+        tgz_manifest = manifest.read_manifest(tgz_entry, fields.is_extraction_candidate)
+        self.assertFalse(tgz_manifest.complete)
+        self.assertEqual({"var/local/core/core.1": 5, "var/local/log/bycast.log": 10},
+                         tgz_manifest.members)
+
+    def test_gzip_and_nested(self):
+        gz_entry = paths.QuantumEntry(self.tmp_dir, "logs.zip.gz")
+        with gzip.open(gz_entry.abspath, "wb") as fd:
+            fd.write(b"z" * 7)
+        gz_manifest = manifest.read_manifest(gz_entry)
+        self.assertEqual({"logs.zip": 7}, gz_manifest.members)
+        # Nested archives may hold anything
+        self.assertTrue(gz_manifest.is_relevant(fields.is_extraction_candidate))
+
+        # Archives browsed in place are read without extracting them
+        tar_entry = paths.QuantumEntry(self.tmp_dir, "bundle.tar")
+        with tarfile.open(tar_entry.abspath, "w") as tar:
+            tar.add(gz_entry.abspath, "node/logs.zip.gz")
+        member = paths.ArchiveEntry.from_archive(tar_entry)/"node/logs.zip.gz"
+        self.assertEqual({"logs.zip": 7}, manifest.read_manifest(member).members)
+        member.close()
+
+    @unittest.skipUnless(sevenzip.AVAILABLE, "py7zr is not installed")
+    def test_7z(self):
+        import py7zr
+        log_path = os.path.join(self.tmp_dir, "bycast.log")
+        with open(log_path, "w") as fd:
+            fd.write("x" * 10)
+        seven_entry = paths.QuantumEntry(self.tmp_dir, "bundle.7z")
+        with py7zr.SevenZipFile(seven_entry.abspath, "w") as z:
+            z.write(log_path, "var/log/bycast.log")
+        self.assertEqual({"var/log/bycast.log": 10}, manifest.read_manifest(seven_entry).members)
+
+    def test_corrupt(self):
+        bad_entry = paths.QuantumEntry(self.tmp_dir, "bad.zip")
+        with open(bad_entry.abspath, "wb") as fd:
+            fd.write(b"\xFF" * 20)
+        self.assertIsNone(manifest.read_manifest(bad_entry))
+
+
+class ManifestStoreTestCase(unittest.TestCase):
+    """ Tests caching manifests in the history directory """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        self.history_dir = os.path.join(self.tmp_dir, "history")
+        os.makedirs(os.path.join(self.tmp_dir, "input", "4007"))
+        self.store = manifest.ManifestStore(self.history_dir)
+
+        self.cores_entry = paths.QuantumEntry(os.path.join(self.tmp_dir, "input"), "4007/cores.tgz")
+        with tarfile.open(self.cores_entry.abspath, "w:gz") as tar:
+            add_tar_member(tar, "var/local/core/core.1", b"y" * 5)
+            add_tar_member(tar, "var/local/db/cassandra.db", b"y" * 5)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def fail_reads(self):
+        """ Makes reading an archive's manifest fail the test, until it ends """
+        def fail_read(*args, **kwargs):
+            self.fail("Manifest should have come from the cache")
+        self.addCleanup(setattr, manifest, "read_manifest", manifest.read_manifest)
+        manifest.read_manifest = fail_read
+
+    def test_is_relevant(self):
+        self.assertFalse(self.store.is_relevant(self.cores_entry, fields.is_extraction_candidate))
+
+        # Same archive from scratch space on a rescan, still cached
+        self.fail_reads()
+        scratch_entry = paths.QuantumEntry(os.path.join(self.tmp_dir, "scratch"), "4007/cores.tgz",
+                                           mtime=self.cores_entry.getmtime())
+        os.makedirs(scratch_entry.absdirpath)
+        shutil.copy(self.cores_entry.abspath, scratch_entry.abspath)
+        self.assertFalse(self.store.is_relevant(scratch_entry, fields.is_extraction_candidate))
+
+    def test_changed_archive(self):
+        self.assertFalse(self.store.is_relevant(self.cores_entry, fields.is_extraction_candidate))
+        with tarfile.open(self.cores_entry.abspath, "w:gz") as tar:
+            add_tar_member(tar, "var/local/log/bycast.log", b"x")
+        os.utime(self.cores_entry.abspath, (0, 0))
+        self.assertTrue(self.store.is_relevant(self.cores_entry, fields.is_extraction_candidate))
+
+    def test_unreadable_is_relevant(self):
+        bad_entry = paths.QuantumEntry(self.cores_entry.srcpath, "4007/bad.zip")
+        with open(bad_entry.abspath, "wb") as fd:
+            fd.write(b"\xFF" * 20)
+        self.assertTrue(self.store.is_relevant(bad_entry, fields.is_extraction_candidate))
+        self.assertEqual([], os.listdir(self.store.manifest_dir))
+
+    def test_prune(self):
+        self.store.get(self.cores_entry)
+        self.assertEqual(0, self.store.prune())
+        for name in os.listdir(self.store.manifest_dir):
+            os.utime(os.path.join(self.store.manifest_dir, name), (0, 0))
+        self.assertEqual(1, self.store.prune())
+        self.assertEqual([], os.listdir(self.store.manifest_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,6 +13,7 @@ import tarfile
 import stat
 import gzip
 import subprocess
+import zipfile
 
 import paths
 
@@ -132,6 +133,23 @@ class QuantumEntryTestCase(unittest.TestCase):
         self.assertEqual("./dir/dir/../tmp", entry.relpath)
         self.assertEqual("/dir/tmp", entry.abspath)
     
+    def test_getmtime(self):
+        log_path = os.path.join(self.tmp_dir, "dir", "bycast.log")
+        os.makedirs(os.path.dirname(log_path))
+        open(log_path, "w").close()
+        os.utime(log_path, (time.time(), 1500))
+        
+        entry = paths.QuantumEntry(self.tmp_dir, "dir/bycast.log")
+        self.assertEqual(1500, entry.getmtime())
+        
+        # Carried mod time wins over the file system's & is passed on when appending
+        scratch_entry = paths.QuantumEntry(self.tmp_dir, "dir", mtime=3000)
+        self.assertEqual(3000, scratch_entry.getmtime())
+        self.assertEqual(3000, (scratch_entry/"bycast.log").getmtime())
+        scratch_entry /= "bycast.log"
+        self.assertEqual(3000, scratch_entry.getmtime())
+        self.assertEqual(1500, os.path.getmtime(scratch_entry.abspath))
+    
     def test_filename(self):
         entry = paths.QuantumEntry("/", "dir/dir")
         self.assertEqual("dir", entry.filename)
@@ -254,3 +272,137 @@ class QuantumEntryTestCase(unittest.TestCase):
     
 
 
+class GzipEntryTestCase(unittest.TestCase):
+    """ Test case for the GzipEntry object """
+    
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(self.tmp_dir)
+        self.assertTrue(os.path.isdir(self.tmp_dir))
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+    
+    def test_init(self):
+        archive = paths.QuantumEntry("/mnt/nfs", "2001387465/var/log/syslog.2.gz")
+        entry = paths.GzipEntry(archive)
+        self.assertEqual("/mnt/nfs", entry.srcpath)
+        self.assertEqual("2001387465/var/log/syslog.2", entry.relpath)
+        self.assertEqual("syslog", entry.filename)
+        self.assertEqual(".2", entry.extension)
+        self.assertEqual(archive, entry.archive)
+        
+        self.assertRaises(AssertionError, paths.GzipEntry, paths.QuantumEntry("/", "log.txt"))
+    
+    def test_open(self):
+        archive = paths.QuantumEntry(self.tmp_dir, "bycast.log.gz")
+        with gzip.open(archive.abspath, "wb") as fd:
+            fd.write(b"line one\nline two\n")
+        
+        entry = paths.GzipEntry(archive)
+        self.assertTrue(entry.exists())
+        self.assertTrue(entry.is_file())
+        self.assertFalse(entry.is_dir())
+        self.assertFalse(os.path.exists(entry.abspath))         # never placed on disk
+        
+        with entry.open("rb") as fd:
+            self.assertEqual([b"line one\n", b"line two\n"], list(fd))
+        with entry.open("r") as fd:
+            self.assertEqual("line one\nline two\n", fd.read())
+        
+        # Read from the local copy given, under the path of the original
+        local = paths.QuantumEntry(os.path.join(self.tmp_dir, "local"), "bycast.log.gz")
+        os.makedirs(local.absdirpath)
+        with gzip.open(local.abspath, "wb") as fd:
+            fd.write(b"local line\n")
+        local_entry = paths.GzipEntry(archive, local)
+        self.assertEqual(entry, local_entry)
+        with local_entry.open("rb") as fd:
+            self.assertEqual(b"local line\n", fd.read())
+        
+        self.assertTrue(entry.delete())
+        self.assertFalse(archive.exists())
+        self.assertFalse(entry.exists())
+
+
+class ArchiveEntryTestCase(unittest.TestCase):
+    """ Test case for the ArchiveEntry object """
+    
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(self.tmp_dir)
+        self.assertTrue(os.path.isdir(self.tmp_dir))
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+    
+    def test_browse_tar(self):
+        log_file = os.path.join(self.tmp_dir, "bycast.log")
+        with open(log_file, "w") as fd:
+            fd.write("line\n")
+        with gzip.open(log_file + ".gz", "wb") as fd:
+            fd.write(b"zipped line\n")
+        tar_entry = paths.QuantumEntry(self.tmp_dir, "case/bundle.tar")
+        os.makedirs(tar_entry.absdirpath)
+        with tarfile.open(tar_entry.abspath, "w") as tar:
+            tar.add(log_file, arcname="var/local/log/bycast.log")
+            tar.add(log_file + ".gz", arcname="var/local/log/bycast.log.gz")
+        
+        root = paths.ArchiveEntry.from_archive(tar_entry)
+        self.assertEqual("case/bundle", root.relpath)
+        self.assertTrue(root.is_dir())
+        self.assertEqual(["var"], root.listdir())
+        
+        entry = root/"var/local/log/bycast.log"
+        self.assertEqual("case/bundle/var/local/log/bycast.log", entry.relpath)
+        self.assertEqual(tar_entry.abspath + "!/var/local/log/bycast.log", entry.vfspath)
+        self.assertEqual(".log", entry.extension)
+        self.assertTrue(entry.is_file())
+        self.assertFalse(entry.is_dir())
+        self.assertFalse(os.path.exists(entry.abspath))         # never extracted
+        self.assertEqual(tar_entry.getmtime(), entry.getmtime())
+        with entry.open("r") as fd:
+            self.assertEqual("line\n", fd.read())
+        
+        gz_entry = paths.GzipEntry(root/"var/local/log/bycast.log.gz")
+        self.assertEqual(entry, gz_entry)
+        with gz_entry.open("rb") as fd:
+            self.assertEqual(b"zipped line\n", fd.read())
+        
+        copied = entry.copy_to(os.path.join(self.tmp_dir, "scratch"))
+        self.assertEqual(entry.relpath, copied.relpath)
+        self.assertTrue(copied.is_file())
+        self.assertEqual(tar_entry.getmtime(), copied.getmtime())
+        
+        self.assertTrue(entry.delete())
+        self.assertTrue(tar_entry.exists())
+        root.close()
+    
+    def test_browse_single_file_zip(self):
+        log_file = os.path.join(self.tmp_dir, "bycast.log")
+        with open(log_file, "w") as fd:
+            fd.write("line\n")
+        zip_entry = paths.QuantumEntry(self.tmp_dir, "bycast.log.zip")
+        with zipfile.ZipFile(zip_entry.abspath, "w") as z:
+            z.write(log_file, arcname="bycast.log")
+        
+        entry = paths.ArchiveEntry.from_archive(zip_entry)
+        self.assertEqual("bycast.log", entry.relpath)
+        self.assertTrue(entry.is_file())
+        entry.close()
+        
+        # Read from the local copy given, under the path of the original
+        local = paths.QuantumEntry(os.path.join(self.tmp_dir, "local"), "bycast.log.zip")
+        os.makedirs(local.absdirpath)
+        with zipfile.ZipFile(local.abspath, "w") as z:
+            z.writestr("bycast.log", "local line\n")
+        entry = paths.ArchiveEntry.from_archive(zip_entry, local)
+        self.assertEqual("bycast.log", entry.relpath)
+        with entry.open("r") as fd:
+            self.assertEqual("local line\n", fd.read())
+        entry.close()
+
@@ -0,0 +1,185 @@
+"""
+Tests the features found in the pipeline.py file.
+"""
+
+
+import unittest
+import os
+import time
+import shutil
+import tarfile
+import gzip
+import threading
+
+import pipeline
+import fields
+import index
+import paths
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class LedgerTestCase(unittest.TestCase):
+    """ Tests running actions in order once the files before them are done """
+
+    def test_order(self):
+        ledger = pipeline.Ledger()
+        ran = []
+        first = ledger.open_file()
+        ledger.after(lambda: ran.append("a"))
+        second = ledger.open_file()
+        ledger.after(lambda: ran.append("b"))
+        self.assertEqual([], ran)
+
+        # Held back by the first file, even though the second is done
+        ledger.done(second)
+        self.assertEqual([], ran)
+        ledger.done(first)
+        self.assertEqual(["a", "b"], ran)
+
+        ledger.after(lambda: ran.append("c"))
+        self.assertEqual(["a", "b", "c"], ran)
+        self.assertEqual(0, ledger.pending)
+
+    def test_halt(self):
+        ledger = pipeline.Ledger()
+        ran = []
+        token = ledger.open_file()
+        ledger.after(lambda: ran.append("a"))
+        ledger.halt()
+        ledger.done(token)
+        self.assertEqual([], ran)
+
+
+class PipelineTestCase(unittest.TestCase):
+    """ Tests sending files through the pipeline stages """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(self.tmp_dir)
+        self.nodefields = fields.NodeFields(case_num="2001872931", node_name="paris")
+        self.sent = {}
+        self.lock = threading.Lock()
+
+        self.send_batch = index.send_batch
+        index.send_batch = self.fake_send_batch
+
+    def tearDown(self):
+        index.send_batch = self.send_batch
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def fake_send_batch(self, es, actions):
+        """ Records the documents instead of sending them, slowly to fill the queues """
+        time.sleep(0.01)
+        with self.lock:
+            for doc in actions:
+                self.sent[doc["_id"]] = doc["_source"]["message"]
+        return True
+
+    def write_log(self, name, lines):
+        """ Writes a log file of numbered lines, returns its entry """
+        with open(os.path.join(self.tmp_dir, name), "w") as fd:
+            for n in range(lines):
+                fd.write("line %d\n" % n)
+        return paths.QuantumEntry(self.tmp_dir, name)
+
+    def test_send(self):
+        config = pipeline.PipelineConfig(queue_size=1, batch_size=3)
+        scanned = []
+        with pipeline.Pipeline(None, None, config) as pipe:
+            for n in range(5):
+                entry = self.write_log("bycast%d.log" % n, 10)
+                pipe.index_file(self.nodefields, entry)
+                pipe.after(lambda relpath=entry.relpath: scanned.append(relpath))
+            skipped = self.write_log("core.bin", 10)
+            pipe.index_file(self.nodefields, skipped)
+            pipe.after(lambda: scanned.append(skipped.relpath))
+
+        self.assertEqual(50, len(self.sent))
+        self.assertEqual("line 9\n", self.sent["bycast4.log/10"])
+        self.assertEqual(["bycast%d.log" % n for n in range(5)] + ["core.bin"], scanned)
+
+    def test_browsed_archive(self):
+        for n in range(3):
+            self.write_log("bycast%d.log" % n, 100)
+        tar_path = os.path.join(self.tmp_dir, "logs.tar")
+        with tarfile.open(tar_path, "w") as tar:
+            for n in range(3):
+                tar.add(os.path.join(self.tmp_dir, "bycast%d.log" % n), "bycast%d.log" % n)
+        archive_entry = paths.ArchiveEntry.from_archive(paths.QuantumEntry(self.tmp_dir, "logs.tar"))
+
+        config = pipeline.PipelineConfig(classify_threads=3, serialize_threads=3, batch_size=7)
+        with pipeline.Pipeline(None, None, config) as pipe:
+            for name in archive_entry.listdir():
+                pipe.index_file(self.nodefields, archive_entry/name)
+            pipe.after(archive_entry.close)
+
+        self.assertEqual(300, len(self.sent))
+        for n in range(3):
+            for line in range(100):
+                self.assertEqual("line %d\n" % line, self.sent["logs/bycast%d.log/%d" % (n, line + 1)])
+
+    def test_browsed_gzip_members(self):
+        tar_path = os.path.join(self.tmp_dir, "logs.tar")
+        with tarfile.open(tar_path, "w") as tar:
+            for n in range(3):
+                gz_path = os.path.join(self.tmp_dir, "bycast%d.log.gz" % n)
+                with gzip.open(gz_path, "wt") as fd:
+                    for line in range(5000):
+                        # Random lines, for the gzips to take many reads of the tar
+                        fd.write("line %d %s\n" % (line, os.urandom(32).hex()))
+                tar.add(gz_path, "bycast%d.log.gz" % n)
+        archive_entry = paths.ArchiveEntry.from_archive(paths.QuantumEntry(self.tmp_dir, "logs.tar"))
+
+        # The gzips share the tar's file handle, reading them at once must not mix their reads
+        config = pipeline.PipelineConfig(classify_threads=3, serialize_threads=3, batch_size=500)
+        with pipeline.Pipeline(None, None, config) as pipe:
+            for name in archive_entry.listdir():
+                pipe.index_file(self.nodefields, paths.GzipEntry(archive_entry/name))
+            pipe.after(archive_entry.close)
+
+        self.assertEqual(15000, len(self.sent))
+        for n in range(3):
+            self.assertTrue(self.sent["logs/bycast%d.log/5000" % n].startswith("line 4999 "))
+
+    def test_failed_stage(self):
+        scanned = []
+        def fail_read(*args, **kwargs):
+            raise OSError("unreadable")
+        entry = self.write_log("bycast.log", 10)
+        pipe = pipeline.Pipeline(None, None)
+        set_data = index.set_data
+        index.set_data = fail_read
+        try:
+            pipe.index_file(self.nodefields, entry)
+            pipe.after(lambda: scanned.append(entry.relpath))
+            self.assertRaises(OSError, pipe.close)
+        finally:
+            index.set_data = set_data
+        # Never marked scanned past a file that was not sent
+        self.assertEqual([], scanned)
+
+    def test_extract_ahead(self):
+        config = pipeline.PipelineConfig(extract_threads=1)
+        entries = [paths.QuantumEntry(self.tmp_dir, "a%d.zip" % n) for n in range(3)]
+        with pipeline.Pipeline(None, None, config) as pipe:
+            for entry in entries:
+                pipe.extract_ahead(entry, lambda e: e/"unzipped", entry)
+            # Only twice the extract threads are unzipped ahead
+            self.assertEqual("a0.zip/unzipped", pipe.take_extracted(entries[0]).relpath)
+            self.assertEqual("a1.zip/unzipped", pipe.take_extracted(entries[1]).relpath)
+            self.assertIsNone(pipe.take_extracted(entries[2]))
+
+    def test_config_from_str(self):
+        config = pipeline.PipelineConfig.from_str("3,2,1,4")
+        self.assertEqual([3, 2, 1, 4], [config.extract_threads, config.classify_threads,
+                                        config.serialize_threads, config.send_threads])
+        self.assertRaises(ValueError, pipeline.PipelineConfig.from_str, "1,2")
+        self.assertRaises(ValueError, pipeline.PipelineConfig.from_str, "1,0,1,1")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+Tests the features found in the prefetch.py file.
+"""
+
+
+import unittest
+import os
+import time
+import shutil
+
+import prefetch
+import paths
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class PrefetchCacheTestCase(unittest.TestCase):
+    """ Tests copying the archives of the upcoming cases to a local directory """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        self.input_dir = os.path.join(self.tmp_dir, "input")
+        self.cache_dir = os.path.join(self.tmp_dir, "local")
+        for case_num in ["2001000001", "2001000002", "2001000003"]:
+            self.write(os.path.join(case_num, "node", "logs.tgz"), 1000)
+            self.write(os.path.join(case_num, "node", "bycast.log"), 1000)
+            self.write(os.path.join(case_num, "node", "browsed.zip"), 1000)
+            self.write(os.path.join(case_num, "syslog.1.gz"), 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def write(self, relpath, size):
+        path = os.path.join(self.input_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fd:
+            fd.write(b"x" * size)
+
+    def cached(self):
+        """ Returns the relative paths of the copies """
+        copies = []
+        for (dirpath, dirnames, filenames) in os.walk(self.cache_dir):
+            copies.extend(os.path.relpath(os.path.join(dirpath, name), self.cache_dir)
+                          for name in filenames)
+        return sorted(copies)
+
+    def test_prefetch(self):
+        prefetch_cache = prefetch.PrefetchCache(self.input_dir, self.cache_dir, 10000, depth=1)
+        prefetch_cache.start()
+        try:
+            prefetch_cache.update(["2001000001"], ["2001000002", "2001000003"])
+            self.assertTrue(prefetch_cache.wait_idle(30))
+        finally:
+            prefetch_cache.close()
+
+        # The archives of the next case, unzipped, browsed or streamed alike
+        self.assertEqual(["2001000002/node/browsed.zip", "2001000002/node/logs.tgz",
+                          "2001000002/syslog.1.gz"], self.cached())
+        self.assertEqual(3000, prefetch_cache.size)
+        archive_tgz = paths.QuantumEntry(self.input_dir, "2001000002/node/logs.tgz")
+        local = prefetch_cache.local_entry(archive_tgz)
+        self.assertEqual(os.path.join(self.cache_dir, "2001000002/node/logs.tgz"), local.abspath)
+        self.assertIsNone(prefetch_cache.local_entry(
+            paths.QuantumEntry(self.input_dir, "2001000001/node/logs.tgz")))
+
+        # Never used once the original changed
+        self.write("2001000002/node/logs.tgz", 1001)
+        self.assertIsNone(prefetch_cache.local_entry(archive_tgz))
+
+        # Counted again by the next scan, without the partly written copies
+        os.makedirs(os.path.join(self.cache_dir, "2001000003"))
+        with open(os.path.join(self.cache_dir, "2001000003", "logs.tgz" + prefetch.PARTIAL_SUFFIX),
+                  "w") as fd:
+            fd.write("partial")
+        self.assertEqual(3000, prefetch.PrefetchCache(self.input_dir, self.cache_dir, 10000).size)
+        self.assertEqual(["2001000002/node/browsed.zip", "2001000002/node/logs.tgz",
+                          "2001000002/syslog.1.gz"], self.cached())
+
+    def test_budget(self):
+        prefetch_cache = prefetch.PrefetchCache(self.input_dir, self.cache_dir, 6500, depth=2)
+        prefetch_cache.update([], ["2001000001", "2001000002"])
+        self.assertTrue(prefetch_cache.fetch_case("2001000001"))
+        self.assertTrue(prefetch_cache.fetch_case("2001000002"))
+
+        # The cases searched or about to be are never evicted
+        prefetch_cache.update(["2001000001", "2001000002"], ["2001000003"])
+        self.assertFalse(prefetch_cache.fetch_case("2001000003"))
+        self.assertEqual(6000, prefetch_cache.size)
+
+        # Those done are, the first done first
+        prefetch_cache.update(["2001000002"], ["2001000003"])
+        self.assertTrue(prefetch_cache.fetch_case("2001000003"))
+        self.assertEqual(["2001000002/node/browsed.zip", "2001000002/node/logs.tgz",
+                          "2001000002/syslog.1.gz", "2001000003/node/browsed.zip",
+                          "2001000003/node/logs.tgz", "2001000003/syslog.1.gz"], self.cached())
+        self.assertEqual(6000, prefetch_cache.size)
+
+        # Copying stops once a worker searches the case
+        prefetch_cache.update(["2001000001"], [])
+        self.assertFalse(prefetch_cache.fetch_case("2001000001"))
+        prefetch_cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
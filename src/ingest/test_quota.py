@@ -0,0 +1,168 @@
+"""
+Tests the features found in the quota.py file.
+"""
+
+
+import unittest
+import os
+import time
+import gzip
+import shutil
+import multiprocessing
+
+import quota
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def reserve_in_child(quota_obj, path, nbytes, reserved):
+    """ Reserves scratch space from another process, then signals it got it """
+    quota_obj.reserve(path, nbytes)
+    reserved.set()
+
+
+def reserve_twice_in_child(quota_obj, nbytes, first_reserved, go, reserved):
+    """ Reserves scratch space twice from another process, the second time once told to """
+    quota_obj.reserve("/scratch/child-1", nbytes)
+    first_reserved.set()
+    go.wait()
+    quota_obj.reserve("/scratch/child-2", nbytes)
+    reserved.set()
+
+
+class ScratchQuotaTestCase(unittest.TestCase):
+    """ Tests reserving & releasing scratch space across processes """
+
+    def test_reserve_release(self):
+        scratch_quota = quota.ScratchQuota(100)
+        scratch_quota.reserve("/scratch/a", 60)
+        self.assertEqual(60, scratch_quota.used_bytes)
+
+        # Holding a reservation with no other process over budget, so goes over instead of waiting
+        scratch_quota.reserve("/scratch/b", 60)
+        self.assertEqual(120, scratch_quota.used_bytes)
+
+        scratch_quota.release("/scratch/a")
+        scratch_quota.release("/scratch/a")
+        self.assertEqual(60, scratch_quota.used_bytes)
+        scratch_quota.release_all()
+        self.assertEqual(0, scratch_quota.used_bytes)
+
+        # Larger than the budget is granted when nothing else is reserved
+        scratch_quota.reserve("/scratch/huge", 1000)
+        self.assertEqual(1000, scratch_quota.used_bytes)
+
+    def test_reserve_blocks_other_process(self):
+        scratch_quota = quota.ScratchQuota(100)
+        scratch_quota.reserve("/scratch/a", 60)
+
+        reserved = multiprocessing.Event()
+        child = multiprocessing.Process(target=reserve_in_child,
+                                        args=(scratch_quota, "/scratch/b", 60, reserved))
+        child.start()
+        try:
+            self.assertFalse(reserved.wait(0.5), "Child should wait for scratch space")
+            scratch_quota.release("/scratch/a")
+            self.assertTrue(reserved.wait(5.0), "Child should get the released space")
+            self.assertEqual(60, scratch_quota.used_bytes)
+        finally:
+            child.join(5.0)
+            if child.is_alive():
+                child.terminate()
+
+    def test_one_process_over_budget(self):
+        scratch_quota = quota.ScratchQuota(100)
+        (first_reserved, go, reserved) = (multiprocessing.Event(), multiprocessing.Event(),
+                                          multiprocessing.Event())
+        child = multiprocessing.Process(target=reserve_twice_in_child,
+                                        args=(scratch_quota, 20, first_reserved, go, reserved))
+        child.start()
+        try:
+            self.assertTrue(first_reserved.wait(5.0))
+            scratch_quota.reserve("/scratch/a", 60)
+            scratch_quota.reserve("/scratch/b", 60)
+            self.assertEqual(140, scratch_quota.used_bytes)
+
+            # The child holds space too, but waits while this process is over budget
+            go.set()
+            self.assertFalse(reserved.wait(0.5), "Child should wait for the process over budget")
+            scratch_quota.reserve("/scratch/c", 10)
+            scratch_quota.release("/scratch/b")
+            self.assertTrue(reserved.wait(5.0), "Child should go over budget in turn")
+            self.assertEqual(110, scratch_quota.used_bytes)
+        finally:
+            child.join(5.0)
+            if child.is_alive():
+                child.terminate()
+
+    def test_try_reserve(self):
+        scratch_quota = quota.ScratchQuota(100)
+        self.assertTrue(scratch_quota.try_reserve("/scratch/a", 60))
+        # Unlike reserve, never goes over budget even while holding space
+        self.assertFalse(scratch_quota.try_reserve("/scratch/b", 60))
+        self.assertTrue(scratch_quota.try_reserve("/scratch/b", 40))
+        self.assertEqual(100, scratch_quota.used_bytes)
+        scratch_quota.release_all()
+        self.assertFalse(scratch_quota.try_reserve("/scratch/huge", 1000))
+        self.assertEqual(0, scratch_quota.used_bytes)
+
+    def test_settle(self):
+        tmp_dir = os.path.join(CODE_SRC_DIR, "-".join([self._testMethodName, str(int(time.time()))]))
+        os.makedirs(tmp_dir)
+        try:
+            with open(os.path.join(tmp_dir, "a.log"), "wb") as fd:
+                fd.write(b"x" * 10)
+            scratch_quota = quota.ScratchQuota(100)
+            scratch_quota.reserve(tmp_dir, 80)
+            scratch_quota.settle(tmp_dir)
+            self.assertEqual(10, scratch_quota.used_bytes)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class EstimateUnzippedSizeTestCase(unittest.TestCase):
+    """ Tests estimating the unzipped size of archives from their headers """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(os.path.join(self.tmp_dir, "src", "logs"))
+        with open(os.path.join(self.tmp_dir, "src", "logs", "bycast.log"), "wb") as fd:
+            fd.write(b"x" * 1000)
+        with open(os.path.join(self.tmp_dir, "src", "heap.hprof"), "wb") as fd:
+            fd.write(b"y" * 500)
+        with open(os.path.join(self.tmp_dir, "src", "node.tgz"), "wb") as fd:
+            fd.write(b"z" * 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def test_archives(self):
+        logs_only = lambda name: name.endswith(".log")
+        for fmt in ["zip", "tar"]:
+            path = shutil.make_archive(os.path.join(self.tmp_dir, "bundle"), fmt,
+                                       os.path.join(self.tmp_dir, "src"))
+            self.assertEqual(1540, quota.estimate_unzipped_size(path))
+            self.assertEqual(1040, quota.estimate_unzipped_size(path, logs_only))
+
+        path = shutil.make_archive(os.path.join(self.tmp_dir, "bundle"), "gztar",
+                                   os.path.join(self.tmp_dir, "src"))
+        tar_size = os.path.getsize(os.path.join(self.tmp_dir, "bundle.tar"))
+        self.assertEqual(tar_size, quota.estimate_unzipped_size(path))
+
+        gz_path = os.path.join(self.tmp_dir, "bycast.log.gz")
+        with gzip.open(gz_path, "wb") as fd:
+            fd.write(b"x" * 7)
+        self.assertEqual(7, quota.estimate_unzipped_size(gz_path))
+
+    def test_corrupt(self):
+        bad_path = os.path.join(self.tmp_dir, "bad.zip")
+        with open(bad_path, "wb") as fd:
+            fd.write(b"\xFF" * 20)
+        self.assertEqual(20, quota.estimate_unzipped_size(bad_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Tests the features found in the ratelimit.py file.
+"""
+
+
+import unittest
+import io
+import os
+import time
+import shutil
+import zipfile
+import concurrent.futures
+
+import ratelimit
+import cancel
+import quota
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def timed_acquire(nbytes, limiter=None):
+    """ Returns the seconds the limiter, that of the worker if None, made the read wait """
+    start = time.monotonic()
+    (limiter or ratelimit._limiter).acquire(nbytes)
+    return time.monotonic() - start
+
+
+def local_time(hour):
+    """ Returns the seconds since the epoch of today at the hour, local time """
+    return time.mktime(time.localtime()[:3] + (hour, 30, 0, 0, 0, -1))
+
+
+class ReadLimiterTestCase(unittest.TestCase):
+    """ Tests throttling the reads from the input directory """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        self.input_dir = os.path.join(self.tmp_dir, "input")
+        os.makedirs(self.input_dir)
+
+    def tearDown(self):
+        ratelimit.install(None)
+        cancel.clear()
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def test_rate(self):
+        limiter = ratelimit.ReadLimiter(self.input_dir, 100, None, (7, 19))
+        self.assertEqual(100, limiter.rate(local_time(7)))
+        self.assertEqual(100, limiter.rate(local_time(18)))
+        self.assertIsNone(limiter.rate(local_time(19)))
+        self.assertIsNone(limiter.rate(local_time(3)))
+
+        # Days running past midnight
+        limiter = ratelimit.ReadLimiter(self.input_dir, 100, 10, (22, 6))
+        self.assertEqual(100, limiter.rate(local_time(23)))
+        self.assertEqual(100, limiter.rate(local_time(2)))
+        self.assertEqual(10, limiter.rate(local_time(12)))
+
+    def test_acquire(self):
+        rate = 100000
+        limiter = ratelimit.ReadLimiter(self.input_dir, rate, rate)
+        self.assertLess(timed_acquire(rate, limiter), 0.1)
+        waited = timed_acquire(rate // 2, limiter)
+        self.assertGreater(waited, 0.4)
+        self.assertLess(waited, 1)
+        (read_bytes, throttled_seconds) = limiter.take_metrics()
+        self.assertEqual(rate + rate // 2, read_bytes)
+        self.assertAlmostEqual(0.5, throttled_seconds, delta=0.1)
+        self.assertEqual((0, 0), limiter.take_metrics())
+
+        # No waiting once the scan is cancelled
+        cancel.request()
+        self.assertLess(timed_acquire(rate * 10, limiter), 0.1)
+
+    def test_shared_with_workers(self):
+        rate = 100000
+        limiter = ratelimit.ReadLimiter(self.input_dir, rate, rate)
+        limiter.acquire(rate)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2, initializer=ratelimit.install,
+                                                    initargs=(limiter,)) as executor:
+            waits = list(executor.map(timed_acquire, [rate // 4, rate // 4]))
+        # The second worker waits for the bytes of both
+        self.assertGreater(max(waits), 0.4)
+        self.assertEqual(rate + rate // 2, limiter.take_metrics()[0])
+
+    def test_open_input(self):
+        with zipfile.ZipFile(os.path.join(self.input_dir, "logs.zip"), "w") as z:
+            z.writestr("bycast.log", "line\n" * 1000)
+        with open(os.path.join(self.tmp_dir, "local.log"), "w") as fd:
+            fd.write("line\n" * 1000)
+        limiter = ratelimit.ReadLimiter(self.input_dir, None, None)
+        ratelimit.install(limiter)
+
+        # Archives read through the throttled file like plain files
+        with ratelimit.open_input(os.path.join(self.input_dir, "logs.zip")) as fd:
+            self.assertIsInstance(fd, ratelimit.ThrottledReader)
+            with zipfile.ZipFile(fd, "r") as z:
+                self.assertEqual(5000, len(z.read("bycast.log")))
+        self.assertGreater(limiter.take_metrics()[0], 0)
+
+        # A file object to libraries that require one, without a descriptor to read around it
+        with ratelimit.open_input(os.path.join(self.input_dir, "logs.zip")) as fd:
+            self.assertIsInstance(fd, io.IOBase)
+            self.assertRaises(io.UnsupportedOperation, fd.fileno)
+        self.assertTrue(fd.closed)
+
+        # Reading archive headers is throttled too
+        self.assertEqual(5000, quota.estimate_unzipped_size(os.path.join(self.input_dir, "logs.zip")))
+        self.assertGreater(limiter.take_metrics()[0], 0)
+
+        # Only the input directory is throttled
+        with ratelimit.open_input(os.path.join(self.tmp_dir, "local.log"), "r") as fd:
+            self.assertNotIsInstance(fd, ratelimit.ThrottledReader)
+            self.assertEqual(1000, len(list(fd)))
+        self.assertEqual(0, limiter.take_metrics()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,12 +9,20 @@ Unit tests for the top-level scan script
 import os
 import shutil
 import time
+import errno
 import unittest
 import sqlite3
 import gzip
 
 import scan
 import paths
+import cache
+import prefetch
+import quota
+import unzip
+import cancel
+import pipeline
+import incremental
 
 
 CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -130,5 +138,238 @@ class RecursiveHelperFuncTestCase(unittest.TestCase):
         with open(archiveB_txt.abspath, "r") as fd:
             self.assertEqual("This is a GZIP file\n", fd.read())
         
+        # Unzipped entries report the archive's mod time without touching the files
+        os.utime(file_to_compress, (time.time(), 1500))
+        archiveB_txt.delete()
+        archiveB_txt = scan.unzip_into_scratch_dir(input_dir, scratch_dir, archiveB_gz)
+        self.assertEqual(1500, archiveB_txt.getmtime())
+        self.assertNotEqual(1500, os.path.getmtime(archiveB_txt.abspath))
+        
         pass
 
+    def test_unzip_into_scratch_dir_cached(self):
+        input_dir = os.path.join(self.tmp_dir, "mnt/nfs")
+        scratch_dir = os.path.join(self.tmp_dir, "tmp/scratch_space1777")
+        node_dir = os.path.join(self.tmp_dir, "node", "var", "log")
+        os.makedirs(node_dir)
+        os.makedirs(scratch_dir)
+        with open(os.path.join(node_dir, "bycast.log"), "w") as fd:
+            fd.write("bycast line\n")
+        shutil.make_archive(os.path.join(input_dir, "4007", "node1"), "gztar",
+                            os.path.join(self.tmp_dir, "node"))
+        
+        extraction_cache = cache.ExtractionCache(os.path.join(self.tmp_dir, "cache"), 1024**2)
+        archive_tgz = paths.QuantumEntry(input_dir, os.path.join("4007", "node1.tar.gz"))
+        node1_dir = scan.unzip_into_scratch_dir(input_dir, scratch_dir, archive_tgz,
+                                                cache=extraction_cache)
+        self.assertTrue((node1_dir/"var/log/bycast.log").is_file())
+        node1_dir.delete()
+        
+        # Rescanning the case must not unzip again
+        recursive_unzip = unzip.recursive_unzip
+        def fail_unzip(*args, **kwargs):
+            self.fail("Archive should have come from the cache")
+        unzip.recursive_unzip = fail_unzip
+        try:
+            node1_dir = scan.unzip_into_scratch_dir(input_dir, scratch_dir, archive_tgz,
+                                                    cache=extraction_cache)
+        finally:
+            unzip.recursive_unzip = recursive_unzip
+        with open((node1_dir/"var/log/bycast.log").abspath, "r") as fd:
+            self.assertEqual("bycast line\n", fd.read())
+    
+    def test_unzip_into_scratch_dir_prefetched(self):
+        input_dir = os.path.join(self.tmp_dir, "mnt/nfs")
+        scratch_dir = os.path.join(self.tmp_dir, "tmp/scratch_space1777")
+        node_dir = os.path.join(self.tmp_dir, "node", "var", "log")
+        os.makedirs(node_dir)
+        os.makedirs(scratch_dir)
+        with open(os.path.join(node_dir, "bycast.log"), "w") as fd:
+            fd.write("bycast line\n")
+        shutil.make_archive(os.path.join(input_dir, "4007", "node1"), "gztar",
+                            os.path.join(self.tmp_dir, "node"))
+        
+        prefetch_cache = prefetch.PrefetchCache(input_dir, os.path.join(self.tmp_dir, "local"),
+                                                1024**2)
+        self.assertTrue(prefetch_cache.fetch_case("4007"))
+        
+        # Unzipped from the local copy, to the same scratch path
+        unzipped = []
+        recursive_unzip = unzip.recursive_unzip
+        def recording_unzip(src, *args, **kwargs):
+            unzipped.append(src)
+            return recursive_unzip(src, *args, **kwargs)
+        unzip.recursive_unzip = recording_unzip
+        try:
+            archive_tgz = paths.QuantumEntry(input_dir, os.path.join("4007", "node1.tar.gz"))
+            node1_dir = scan.unzip_into_scratch_dir(input_dir, scratch_dir, archive_tgz,
+                                                    prefetched=prefetch_cache)
+        finally:
+            unzip.recursive_unzip = recursive_unzip
+        self.assertEqual([os.path.join(prefetch_cache.cache_dir, "4007", "node1.tar.gz")], unzipped)
+        self.assertEqual(os.path.join(scratch_dir, "4007", "node1"), node1_dir.abspath)
+        with open((node1_dir/"var/log/bycast.log").abspath, "r") as fd:
+            self.assertEqual("bycast line\n", fd.read())
+    
+    def test_extract_ahead_browsed(self):
+        input_dir = os.path.join(self.tmp_dir, "mnt/nfs")
+        bundle_dir = os.path.join(self.tmp_dir, "bundle")
+        node_dir = os.path.join(self.tmp_dir, "node", "var", "log")
+        os.makedirs(node_dir)
+        with open(os.path.join(node_dir, "bycast.log"), "w") as fd:
+            fd.write("bycast line\n")
+        for name in ["node1", "node2"]:
+            shutil.make_archive(os.path.join(bundle_dir, name), "gztar", os.path.join(self.tmp_dir, "node"))
+        shutil.make_archive(os.path.join(input_dir, "4007", "bundle"), "tar", bundle_dir)
+        
+        history_dir = os.path.join(self.tmp_dir, "history")
+        worker_scan = incremental.WorkerScan(input_dir, history_dir,
+                                             os.path.join(self.tmp_dir, "scratch"), "4007.txt",
+                                             "4007-log.txt", int(time.time()) + 3600)
+        bundle = paths.ArchiveEntry.from_archive(
+            paths.QuantumEntry(input_dir, os.path.join("4007", "bundle.tar")))
+        
+        # The node archives of a browsed bundle are unzipped ahead of the walk
+        with pipeline.Pipeline(None, history_dir) as pipe:
+            members = [bundle/name for name in sorted(bundle.listdir())]
+            scan.extract_ahead(worker_scan, pipe, members)
+            for member in members:
+                unzipped = pipe.take_extracted(member)
+                self.assertEqual(os.path.join(self.tmp_dir, "scratch", member.reldirpath,
+                                              unzip.strip_all_zip_exts(member.basename)),
+                                 unzipped.abspath)
+                self.assertTrue((unzipped/"var/log/bycast.log").is_file())
+        bundle.close()
+    
+    def test_is_unzipped_in_parallel(self):
+        input_dir = os.path.join(self.tmp_dir, "mnt/nfs")
+        os.makedirs(os.path.join(input_dir, "4007"))
+        for name in ["bundle.zip", "bundle.tar"]:
+            with open(os.path.join(input_dir, "4007", name), "wb") as fd:
+                fd.write(bytes(1000))
+        bundle_zip = paths.QuantumEntry(input_dir, os.path.join("4007", "bundle.zip"))
+        bundle_tar = paths.QuantumEntry(input_dir, os.path.join("4007", "bundle.tar"))
+        self.assertFalse(scan.is_unzipped_in_parallel(bundle_zip))
+        
+        # Large zips are unzipped with several threads instead of browsed, not tars
+        min_size = unzip.PARALLEL_ZIP_MIN_SIZE
+        unzip.PARALLEL_ZIP_MIN_SIZE = 1000
+        try:
+            self.assertTrue(scan.is_unzipped_in_parallel(bundle_zip))
+            self.assertFalse(scan.is_unzipped_in_parallel(bundle_tar))
+        finally:
+            unzip.PARALLEL_ZIP_MIN_SIZE = min_size
+    
+    def test_unzip_into_ram_scratch_dir(self):
+        input_dir = os.path.join(self.tmp_dir, "mnt/nfs")
+        scratch_dir = os.path.join(self.tmp_dir, "tmp/scratch_space1777")
+        ram_scratch_dir = os.path.join(self.tmp_dir, "shm/scratch_space1777")
+        node_dir = os.path.join(self.tmp_dir, "node", "var", "log")
+        os.makedirs(node_dir)
+        os.makedirs(scratch_dir)
+        os.makedirs(ram_scratch_dir)
+        with open(os.path.join(node_dir, "bycast.log"), "w") as fd:
+            fd.write("bycast line\n" * 100)
+        for name in ["node1", "node2"]:
+            shutil.make_archive(os.path.join(input_dir, "4007", name), "zip",
+                                os.path.join(self.tmp_dir, "node"))
+        
+        # Only the first archive fits in the RAM budget, the second spills to disk
+        ram_quota = quota.ScratchQuota(1500)
+        extraction_cache = cache.ExtractionCache(os.path.join(self.tmp_dir, "cache"), 1024**2)
+        node1_zip = paths.QuantumEntry(input_dir, os.path.join("4007", "node1.zip"))
+        node1_dir = scan.unzip_into_scratch_dir(input_dir, scratch_dir, node1_zip,
+                                                cache=extraction_cache,
+                                                ram_scratch_dir=ram_scratch_dir, ram_quota=ram_quota)
+        self.assertEqual(ram_scratch_dir, node1_dir.srcpath)
+        self.assertTrue((node1_dir/"var/log/bycast.log").is_file())
+        self.assertEqual(1200, ram_quota.used_bytes)
+        
+        node2_zip = paths.QuantumEntry(input_dir, os.path.join("4007", "node2.zip"))
+        node2_dir = scan.unzip_into_scratch_dir(input_dir, scratch_dir, node2_zip,
+                                                cache=extraction_cache,
+                                                ram_scratch_dir=ram_scratch_dir, ram_quota=ram_quota)
+        self.assertEqual(scratch_dir, node2_dir.srcpath)
+        self.assertTrue((node2_dir/"var/log/bycast.log").is_file())
+        self.assertEqual(1200, ram_quota.used_bytes)
+        
+        # Only the archive unzipped to disk is cached, RAM could only be copied to it
+        cached = os.listdir(extraction_cache.cache_dir)
+        self.assertEqual([extraction_cache.key_for(node2_zip)], cached)
+        
+        # Unpacked in either tier counts as already unpacked
+        self.assertEqual(node1_zip, scan.unzip_into_scratch_dir(
+            input_dir, scratch_dir, node1_zip, ram_scratch_dir=ram_scratch_dir, ram_quota=ram_quota))
+        
+        # A failed unzip in RAM spills to disk instead, as does a full tmpfs
+        recursive_unzip = unzip.recursive_unzip
+        for error in [unzip.AcceptableException("Bad archive"),
+                      OSError(errno.ENOSPC, "No space left on device")]:
+            node1_dir.delete()
+            ram_quota.release_all()
+            def fail_in_ram(src, dest, *args, **kwargs):
+                if dest.startswith(ram_scratch_dir):
+                    os.makedirs(os.path.join(dest, "node1", "var"))
+                    raise error
+                return recursive_unzip(src, dest, *args, **kwargs)
+            unzip.recursive_unzip = fail_in_ram
+            try:
+                node1_dir = scan.unzip_into_scratch_dir(input_dir, scratch_dir, node1_zip,
+                                                        ram_scratch_dir=ram_scratch_dir,
+                                                        ram_quota=ram_quota)
+            finally:
+                unzip.recursive_unzip = recursive_unzip
+            self.assertEqual(scratch_dir, node1_dir.srcpath)
+            self.assertTrue((node1_dir/"var/log/bycast.log").is_file())
+            self.assertEqual(0, ram_quota.used_bytes)
+            self.assertFalse(paths.QuantumEntry(ram_scratch_dir, "4007/node1").exists())
+    
+    def test_unzip_into_scratch_dir_limits(self):
+        input_dir = os.path.join(self.tmp_dir, "mnt/nfs")
+        scratch_dir = os.path.join(self.tmp_dir, "tmp/scratch_space1777")
+        ram_scratch_dir = os.path.join(self.tmp_dir, "shm/scratch_space1777")
+        os.makedirs(os.path.join(input_dir, "4007"))
+        os.makedirs(scratch_dir)
+        os.makedirs(ram_scratch_dir)
+        with gzip.open(os.path.join(input_dir, "4007", "bycast.log.gz"), "wb") as fd:
+            fd.write(bytes(1024 * 1024))
+        
+        orig_limit = unzip.MAX_MEMBER_BYTES
+        unzip.MAX_MEMBER_BYTES = 1024
+        scan.exceeded_limits.clear()
+        try:
+            bomb_gz = paths.QuantumEntry(input_dir, os.path.join("4007", "bycast.log.gz"))
+            bomb_log = scan.unzip_into_scratch_dir(input_dir, scratch_dir, bomb_gz,
+                                                   ram_scratch_dir=ram_scratch_dir,
+                                                   ram_quota=quota.ScratchQuota(10 * 1024**2))
+        finally:
+            unzip.MAX_MEMBER_BYTES = orig_limit
+        
+        # Stopped in RAM and never retried on disk
+        self.assertFalse(bomb_log.exists())
+        self.assertFalse(paths.QuantumEntry(ram_scratch_dir, "4007/bycast.log").exists())
+        self.assertEqual({"member": 1}, dict(scan.exceeded_limits))
+        scan.exceeded_limits.clear()
+    
+    def test_unzip_into_scratch_dir_cancelled(self):
+        input_dir = os.path.join(self.tmp_dir, "mnt/nfs")
+        scratch_dir = os.path.join(self.tmp_dir, "tmp/scratch_space1777")
+        node1_dir = os.path.join(self.tmp_dir, "node1")
+        os.makedirs(node1_dir)
+        os.makedirs(os.path.join(input_dir, "4007"))
+        os.makedirs(scratch_dir)
+        with open(os.path.join(node1_dir, "bycast.log"), "w") as fd:
+            fd.write("This is a log file\n")
+        shutil.make_archive(os.path.join(input_dir, "4007", "node1"), "zip", node1_dir)
+        
+        cancel.request()
+        try:
+            node1_zip = paths.QuantumEntry(input_dir, os.path.join("4007", "node1.zip"))
+            with self.assertRaises(cancel.Cancelled):
+                scan.unzip_into_scratch_dir(input_dir, scratch_dir, node1_zip)
+        finally:
+            cancel.clear()
+        
+        # Nothing partly unzipped is left for the next search to take as unzipped
+        self.assertFalse(paths.QuantumEntry(scratch_dir, "4007/node1").exists())
+        self.assertFalse(scan.abort_requested())
@@ -0,0 +1,82 @@
+"""
+Tests the features found in the sevenzip.py file.
+"""
+
+
+import unittest
+import os
+import time
+import shutil
+
+import sevenzip
+
+if sevenzip.AVAILABLE:
+    import py7zr
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+@unittest.skipUnless(sevenzip.AVAILABLE, "py7zr is not installed")
+class SevenZipTestCase(unittest.TestCase):
+    """ Tests listing, unzipping & streaming 7z members in-process """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(os.path.join(self.tmp_dir, "src", "var", "log"))
+        with open(os.path.join(self.tmp_dir, "src", "var", "log", "bycast.log"), "w") as fd:
+            fd.write("bycast line\n")
+        with open(os.path.join(self.tmp_dir, "src", "heap.hprof"), "w") as fd:
+            fd.write("heap\n")
+        os.symlink("heap.hprof", os.path.join(self.tmp_dir, "src", "link"))
+
+        self.archive_path = os.path.join(self.tmp_dir, "bundle.7z")
+        with py7zr.SevenZipFile(self.archive_path, "w") as z:
+            z.writeall(os.path.join(self.tmp_dir, "src"), "bundle")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def test_list_members(self):
+        self.assertEqual({"bundle/var/log/bycast.log": 12, "bundle/heap.hprof": 5},
+                         sevenzip.list_members(self.archive_path))
+
+    def test_extract(self):
+        dest = os.path.join(self.tmp_dir, "all")
+        os.makedirs(dest)
+        sevenzip.extract(self.archive_path, dest)
+        with open(os.path.join(dest, "bundle", "var", "log", "bycast.log"), "r") as fd:
+            self.assertEqual("bycast line\n", fd.read())
+        self.assertTrue(os.path.isfile(os.path.join(dest, "bundle", "heap.hprof")))
+        self.assertFalse(os.path.lexists(os.path.join(dest, "bundle", "link")))
+
+    def test_extract_filtered(self):
+        dest = os.path.join(self.tmp_dir, "filtered")
+        os.makedirs(dest)
+        sevenzip.extract(self.archive_path, dest, member_filter=lambda m: m.endswith(".log"))
+        self.assertTrue(os.path.isfile(os.path.join(dest, "bundle", "var", "log", "bycast.log")))
+        self.assertFalse(os.path.exists(os.path.join(dest, "bundle", "heap.hprof")))
+
+        sevenzip.extract(self.archive_path, dest, member_filter=lambda m: False)
+
+    def test_stream(self):
+        chunks = {}
+        sevenzip.stream(self.archive_path, lambda name, data: chunks.setdefault(name, []).append(data),
+                        member_filter=lambda m: m.endswith(".log"))
+        self.assertEqual(["bundle/var/log/bycast.log"], list(chunks))
+        self.assertEqual(b"bycast line\n", b"".join(chunks["bundle/var/log/bycast.log"]))
+        self.assertEqual(b"", chunks["bundle/var/log/bycast.log"][-1])
+
+    def test_password_protected(self):
+        locked_path = os.path.join(self.tmp_dir, "locked.7z")
+        with py7zr.SevenZipFile(locked_path, "w", password="Password123") as z:
+            z.writeall(os.path.join(self.tmp_dir, "src", "var"), "var")
+
+        with self.assertRaises(sevenzip.PasswordProtected):
+            sevenzip.extract(locked_path, self.tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
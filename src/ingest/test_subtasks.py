@@ -0,0 +1,94 @@
+"""
+Tests the features found in the subtasks.py file.
+"""
+
+
+import unittest
+import os
+import time
+import shutil
+
+import subtasks
+import fields
+import paths
+
+
+CODE_SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def write_file(path, nbytes):
+    """ Writes a file of the given size, creating its directory """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fd:
+        fd.write(b"x" * nbytes)
+
+
+class PlanCaseTasksTestCase(unittest.TestCase):
+    """ Tests splitting cases into sub-tasks """
+
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        self.case_dir = paths.QuantumEntry(os.path.join(self.tmp_dir, "node_paris"), "2001872931")
+        write_file(os.path.join(self.case_dir.abspath, "lumberjack.log"), 1)
+        write_file(os.path.join(self.case_dir.abspath, "grid", "node1", "2018-2019", "lumberjack.log"), 10)
+        write_file(os.path.join(self.case_dir.abspath, "grid", "node1", "2018-2019", "bycast.log"), 20)
+        write_file(os.path.join(self.case_dir.abspath, "grid", "node2.tgz"), 100)
+        write_file(os.path.join(self.case_dir.abspath, "grid", "node2.zip"), 50)
+        write_file(os.path.join(self.case_dir.abspath, "a", "b", "c", "d", "x.log"), 5)
+        self.case_fields = fields.NodeFields(case_num="2001872931")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+
+    def test_plan_case_tasks(self):
+        case_tasks = subtasks.plan_case_tasks(self.case_dir, self.case_fields)
+        by_path = {str(t): t for t in case_tasks}
+        self.assertEqual(sorted(["2001872931/lumberjack.log",
+                                 "2001872931/grid/node1/2018-2019",
+                                 "2001872931/grid/node2.tgz, 2001872931/grid/node2.zip",
+                                 "2001872931/a/b/c/d"]), sorted(by_path))
+
+        # Unzip siblings share a sub-task, lumberjack directories are not descended into
+        self.assertEqual(150, by_path["2001872931/grid/node2.tgz, 2001872931/grid/node2.zip"].size)
+        self.assertEqual(30, by_path["2001872931/grid/node1/2018-2019"].size)
+        self.assertEqual("2001872931", by_path["2001872931/a/b/c/d"].case_num)
+
+        # Fields of the case's lumberjack directory are inherited
+        for t in case_tasks:
+            self.assertEqual("node_paris", t.nodefields.node_name)
+            self.assertEqual("2001872931", t.nodefields.case_num)
+
+        # Keys are stable & unique
+        again = subtasks.plan_case_tasks(self.case_dir, self.case_fields)
+        self.assertEqual(sorted(t.key for t in case_tasks), sorted(t.key for t in again))
+        self.assertEqual(len(case_tasks), len(set(t.key for t in case_tasks)))
+
+        # Shallower split
+        case_tasks = subtasks.plan_case_tasks(self.case_dir, self.case_fields, max_depth=0)
+        self.assertEqual(sorted(["2001872931/lumberjack.log", "2001872931/grid", "2001872931/a"]),
+                         sorted(str(t) for t in case_tasks))
+
+    def test_plan_path_task(self):
+        input_dir = os.path.join(self.tmp_dir, "node_paris")
+        task = subtasks.plan_path_task(input_dir, "2001872931/grid/node1/2018-2019/bycast.log")
+        self.assertEqual("2001872931/grid/node1/2018-2019/bycast.log", str(task))
+        self.assertEqual(20, task.size)
+        # Fields of the lumberjack directory holding the file, as when searching the case
+        self.assertEqual("2001872931", task.nodefields.case_num)
+        self.assertEqual("node1", task.nodefields.node_name)
+
+        # Same key as the sub-task planned for the same entries
+        task = subtasks.plan_path_task(input_dir, "2001872931/grid/node1/2018-2019")
+        planned = [t for t in subtasks.plan_case_tasks(self.case_dir, self.case_fields)
+                   if str(t) == str(task)]
+        self.assertEqual([task.key], [t.key for t in planned])
+
+    def test_case_exceeds(self):
+        self.assertTrue(subtasks.case_exceeds(self.case_dir, 185))
+        self.assertFalse(subtasks.case_exceeds(self.case_dir, 186))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -64,6 +64,14 @@ class RecursiveUnzipTestCase(unittest.TestCase):
         self.assertTrue(os.path.isdir(os.path.join(self.tmpdir, 'hello_targz', 'hello_zip')))
         self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, 'hello_targz', 'hello_zip', 'zip.txt')))
 
+    def test_targz_single_pass(self):
+        extracted = []
+        unzip.recursive_unzip(os.path.join(self.tmpdir, 'hello_targz.tar.gz'),
+                              os.path.join(self.tmpdir, 'single_pass'), extracted.append)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, 'single_pass', 'hello_targz', 'folder', 'targz.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'single_pass', 'hello_targz.tar')))
+        self.assertFalse(any(path.endswith(".tar") for path in extracted))
+
     def test_tar(self):
         unzip.recursive_unzip(os.path.join(self.tmpdir, 'hello_tar.tar'), self.tmpdir)
         self.assertTrue(os.path.isdir(os.path.join(self.tmpdir, 'hello_tar')))
@@ -98,6 +106,21 @@ class RecursiveUnzipTestCase(unittest.TestCase):
         self.assertTrue(os.path.isdir(os.path.join(self.tmpdir, 'hello_7z')))
         self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, 'hello_7z', '7z.txt')))
 
+    def test_7z_backends(self):
+        for backend in ["py7zr", "patool"]:
+            if backend == "py7zr" and not unzip.sevenzip.AVAILABLE:
+                continue
+            dest_dir = os.path.join(self.tmpdir, "seven_" + backend)
+            os.makedirs(dest_dir)
+            unzip.extract_7z(os.path.join(self.tmpdir, 'hello_7z.7z'), dest_dir, backend=backend)
+            self.assertTrue(os.path.isfile(os.path.join(dest_dir, '7z.txt')))
+            
+            filtered_dir = os.path.join(self.tmpdir, "seven_filtered_" + backend)
+            os.makedirs(filtered_dir)
+            unzip.extract_7z(os.path.join(self.tmpdir, 'hello_7z.7z'), filtered_dir,
+                             member_filter=lambda m: m.endswith(".log"), backend=backend)
+            self.assertEqual([], os.listdir(filtered_dir))
+
     def test_password_7z(self):
         timed_out = False
         def timeout_handler(signum, frame):
@@ -123,6 +146,72 @@ class RecursiveUnzipTestCase(unittest.TestCase):
         unzip.recursive_unzip(os.path.join(self.tmpdir, 'hello_gz.gz'), self.tmpdir)
         self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, 'hello_gz')))
 
+    def test_keep_gz_logs(self):
+        src_dir = os.path.join(self.tmpdir, "keep_gz")
+        os.makedirs(os.path.join(src_dir, "logs"))
+        with gzip.open(os.path.join(src_dir, "logs", "syslog.2.gz"), "wb") as f:
+            f.write(b"syslog line\n")
+        shutil.make_archive(os.path.join(self.tmpdir, "keep_gz"), "tar", src_dir)
+        
+        dest_dir = os.path.join(self.tmpdir, "keep_gz_dest")
+        unzip.recursive_unzip(os.path.join(self.tmpdir, "keep_gz.tar"), dest_dir, keep_gz_logs=True)
+        self.assertTrue(os.path.isfile(os.path.join(dest_dir, "keep_gz", "logs", "syslog.2.gz")))
+        self.assertFalse(os.path.exists(os.path.join(dest_dir, "keep_gz", "logs", "syslog.2")))
+
+    def test_member_filter(self):
+        src_dir = os.path.join(self.tmpdir, "filtered")
+        os.makedirs(os.path.join(src_dir, "logs"))
+        for name in ["bycast.log", "core.1234", "heap.hprof"]:
+            with open(os.path.join(src_dir, "logs", name), "w") as f:
+                f.write("data\n")
+        with gzip.open(os.path.join(src_dir, "logs", "core.5678.gz"), "wb") as f:
+            f.write(b"data\n")
+        shutil.make_archive(os.path.join(self.tmpdir, "filtered"), "gztar", src_dir)
+        shutil.make_archive(os.path.join(self.tmpdir, "filtered"), "zip", src_dir)
+        
+        keep = lambda member: member.endswith(".log") or member.endswith(".gz")
+        for archive_name in ["filtered.tar.gz", "filtered.zip"]:
+            dest_dir = os.path.join(self.tmpdir, "filtered_dest_" + archive_name.split(".")[-1])
+            unzip.recursive_unzip(os.path.join(self.tmpdir, archive_name), dest_dir, member_filter=keep)
+            logs_dir = os.path.join(dest_dir, "filtered", "logs")
+            self.assertEqual(["bycast.log"], os.listdir(logs_dir))
+
+    def test_parallel_nested_archives(self):
+        bundle_dir = os.path.join(self.tmpdir, "bundle")
+        for i in range(6):
+            node_dir = os.path.join(self.tmpdir, "node" + str(i))
+            os.makedirs(os.path.join(node_dir, "logs"))
+            with open(os.path.join(node_dir, "logs", "bycast.log"), "w") as f:
+                f.write("node" + str(i) + "\n")
+            os.makedirs(bundle_dir, exist_ok=True)
+            shutil.make_archive(os.path.join(bundle_dir, "node" + str(i)), "gztar", node_dir)
+        shutil.make_archive(bundle_dir, "tar", bundle_dir)
+        
+        for threads in [1, 3]:
+            dest_dir = os.path.join(self.tmpdir, "bundle_dest_" + str(threads))
+            visited = []
+            unzip.recursive_unzip(bundle_dir + ".tar", dest_dir, visited.append, threads=threads)
+            self.assertEqual(6, len(visited))
+            for i in range(6):
+                log_path = os.path.join(dest_dir, "bundle", "node" + str(i), "logs", "bycast.log")
+                self.assertIn(log_path, visited)
+                self.assertFalse(os.path.exists(os.path.join(dest_dir, "bundle", "node" + str(i) + ".tar.gz")))
+
+    def test_map_concurrently(self):
+        results = []
+        unzip.map_concurrently(results.append, [1, 2, 3], 2)
+        self.assertEqual([1, 2, 3], sorted(results))
+        
+        def fail_on_two(item):
+            if item == 2:
+                raise unzip.AcceptableException("two")
+            results.append(item)
+        
+        results = []
+        with self.assertRaises(unzip.AcceptableException):
+            unzip.map_concurrently(fail_on_two, [1, 2, 3], 3)
+        self.assertEqual([1, 3], sorted(results))
+
     def test_corrupt_tgz(self):
         # Should fail and raise AcceptableException
         try:
@@ -275,6 +364,52 @@ class ExtractZipTestCase(unittest.TestCase):
         with open(decompressed_file.abspath, "r") as fd:
             self.assertEqual("TEXT\n", fd.read())
 
+    def test_parallel_zip(self):
+        zip_file = paths.QuantumEntry(self.tmp_dir, "big.zip")
+        one_file_zip = paths.QuantumEntry(self.tmp_dir, "one.txt.zip")
+        with zipfile.ZipFile(zip_file.abspath, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("empty/", "")
+            z.writestr("../escape.txt", "ESCAPE\n")
+            for i in range(10):
+                z.writestr("logs/node%d/bycast.log" % i, "LINE %d\n" % i * (i + 1))
+                z.writestr("logs/file%d.txt" % i, "FILE %d\n" % i)
+        with zipfile.ZipFile(one_file_zip.abspath, "w") as z:
+            z.writestr("one.txt", "ONE\n")
+        
+        self.assertFalse(unzip.is_parallel_zip(zip_file.abspath))
+        min_size = unzip.PARALLEL_ZIP_MIN_SIZE
+        unzip.PARALLEL_ZIP_MIN_SIZE = 0
+        try:
+            self.assertTrue(unzip.is_parallel_zip(zip_file.abspath))
+            unzip.extract_zip(zip_file, paths.QuantumEntry(self.tmp_dir, "new"), threads=4)
+            unzip.extract_zip(one_file_zip, paths.QuantumEntry(self.tmp_dir, "new"), threads=4)
+        finally:
+            unzip.PARALLEL_ZIP_MIN_SIZE = min_size
+        
+        big_dir = paths.QuantumEntry(self.tmp_dir, "new/big")
+        self.assertTrue((big_dir/"empty").is_dir())
+        self.assertTrue((big_dir/"escape.txt").is_file())
+        for i in range(10):
+            with open((big_dir/("logs/file%d.txt" % i)).abspath, "r") as fd:
+                self.assertEqual("FILE %d\n" % i, fd.read())
+            with open((big_dir/("logs/node%d/bycast.log" % i)).abspath, "r") as fd:
+                self.assertEqual("LINE %d\n" % i * (i + 1), fd.read())
+        self.assertTrue(paths.QuantumEntry(self.tmp_dir, "new/one.txt").is_file())
+    
+    def test_split_by_size(self):
+        members = []
+        for size in [5, 1, 9, 3, 3, 7]:
+            member = zipfile.ZipInfo("file%d" % len(members))
+            member.compress_size = size
+            members.append(member)
+        
+        groups = unzip.split_by_size(members, 3)
+        self.assertEqual(3, len(groups))
+        self.assertEqual(sorted(members, key=lambda m: m.filename),
+                         sorted(sum(groups, []), key=lambda m: m.filename))
+        self.assertEqual([10, 9, 9], [sum(m.compress_size for m in g) for g in groups])
+        self.assertEqual(2, len(unzip.split_by_size(members[:2], 8)))
+
     def test_corrupt_zip(self):
         zip_file = paths.QuantumEntry(self.tmp_dir, "dir.zip")
         decompressed_dir = paths.QuantumEntry(self.tmp_dir, "dir")
@@ -294,6 +429,156 @@ class ExtractZipTestCase(unittest.TestCase):
         self.assertTrue(decompressed_dir.exists(), "dest_dir should exist even on failure!!!")
 
 
+class ExtractTarTestCase(unittest.TestCase):
+    """ Tests the function for extracting tar files only """
+    
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        os.makedirs(self.tmp_dir)
+        self.assertTrue(os.path.isdir(self.tmp_dir))
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+    
+    def test_extract_tgz(self):
+        log_file = os.path.join(self.tmp_dir, "bycast.log")
+        with open(log_file, "w") as fd:
+            fd.write("TEXT\n")
+        tgz_file = os.path.join(self.tmp_dir, "bundle.tgz")
+        with tarfile.open(tgz_file, "w:gz") as tar:
+            tar.add(log_file, arcname="./var/log/bycast.log")
+            tar.add(log_file, arcname="../escaped.log")
+            tar.add(log_file, arcname="/etc/absolute.log")
+        
+        dest_dir = os.path.join(self.tmp_dir, "bundle")
+        unzip.extract_tar(tgz_file, dest_dir)
+        with open(os.path.join(dest_dir, "var", "log", "bycast.log"), "r") as fd:
+            self.assertEqual("TEXT\n", fd.read())
+        self.assertTrue(os.path.isfile(os.path.join(dest_dir, "etc", "absolute.log")))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, "escaped.log")))
+    
+    def test_filtered_hard_links(self):
+        data_file = os.path.join(self.tmp_dir, "app.dat")
+        with open(data_file, "w") as fd:
+            fd.write("TEXT\n")
+        os.link(data_file, os.path.join(self.tmp_dir, "bycast.log"))
+        os.link(data_file, os.path.join(self.tmp_dir, "system.log"))
+        tgz_file = os.path.join(self.tmp_dir, "bundle.tgz")
+        with tarfile.open(tgz_file, "w:gz") as tar:
+            for name in ["app.dat", "bycast.log", "system.log"]:
+                tar.add(os.path.join(self.tmp_dir, name), arcname="./var/log/" + name)
+        with tarfile.open(tgz_file, "r:gz") as tar:
+            self.assertTrue(tar.getmember("./var/log/bycast.log").islnk())
+        
+        # The logs linked to a file left out are written all the same
+        dest_dir = os.path.join(self.tmp_dir, "bundle")
+        unzip.extract_tar(tgz_file, dest_dir, member_filter=lambda m: m.endswith(".log"))
+        self.assertEqual(["bycast.log", "system.log"], sorted(os.listdir(os.path.join(dest_dir, "var", "log"))))
+        for name in ["bycast.log", "system.log"]:
+            with open(os.path.join(dest_dir, "var", "log", name), "r") as fd:
+                self.assertEqual("TEXT\n", fd.read())
+        
+        # Links to the files kept are still links
+        shutil.rmtree(dest_dir)
+        unzip.extract_tar(tgz_file, dest_dir, member_filter=lambda m: not m.endswith("system.log"))
+        self.assertTrue(os.path.samefile(os.path.join(dest_dir, "var", "log", "app.dat"),
+                                         os.path.join(dest_dir, "var", "log", "bycast.log")))
+    
+    def test_is_compound_tar(self):
+        self.assertTrue(unzip.is_compound_tar("/var/bundle.tar.gz"))
+        self.assertTrue(unzip.is_compound_tar("bundle.tgz"))
+        self.assertFalse(unzip.is_compound_tar("bundle.tar"))
+        self.assertFalse(unzip.is_compound_tar("syslog.2.gz"))
+        self.assertFalse(unzip.is_compound_tar("bundle.tar.zip"))
+
+
+class ExtractionLimitsTestCase(unittest.TestCase):
+    """ Tests stopping decompression bombs while they are unzipped """
+    
+    def setUp(self):
+        tmp_name = "-".join([self._testMethodName, str(int(time.time()))])
+        self.tmp_dir = os.path.join(CODE_SRC_DIR, tmp_name)
+        self.dest_dir = os.path.join(self.tmp_dir, "dest")
+        os.makedirs(self.dest_dir)
+        self.orig_grace = unzip.RATIO_GRACE_BYTES
+        unzip.RATIO_GRACE_BYTES = 0
+    
+    def tearDown(self):
+        unzip.RATIO_GRACE_BYTES = self.orig_grace
+        shutil.rmtree(self.tmp_dir)
+        self.assertTrue(not os.path.exists(self.tmp_dir))
+    
+    def make_zeros(self, name, nbytes):
+        """ Writes a file of zeros, which compresses extremely well """
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, "wb") as fd:
+            fd.write(bytes(nbytes))
+        return path
+    
+    def check_stopped(self, archive_path, limit, limits):
+        """ Unzips the archive, which should be stopped by the limit without leftovers """
+        with self.assertRaises(unzip.AcceptableException):
+            unzip.recursive_unzip(archive_path, self.dest_dir, limits=limits)
+        self.assertEqual(limit, limits.exceeded)
+        self.assertEqual([], os.listdir(self.dest_dir))
+    
+    def test_gzip_ratio(self):
+        gz_path = self.make_zeros("bycast.log", 4 * 1024 * 1024) + ".gz"
+        with open(gz_path[:-3], "rb") as in_fd, gzip.open(gz_path, "wb") as out_fd:
+            shutil.copyfileobj(in_fd, out_fd)
+        self.check_stopped(gz_path, "ratio", unzip.ExtractionLimits(max_ratio=100))
+        
+        unzip.recursive_unzip(gz_path, self.dest_dir, limits=unzip.ExtractionLimits(max_ratio=2000))
+        self.assertEqual(4 * 1024 * 1024, os.path.getsize(os.path.join(self.dest_dir, "bycast.log")))
+    
+    def test_zip_member(self):
+        zip_path = os.path.join(self.tmp_dir, "bundle.zip")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("var/log/small.log", "x" * 100)
+            z.write(self.make_zeros("big.log", 2 * 1024 * 1024), "var/log/big.log")
+        self.check_stopped(zip_path, "member", unzip.ExtractionLimits(max_member_bytes=1024 * 1024))
+    
+    def test_tar_total(self):
+        tar_path = os.path.join(self.tmp_dir, "bundle.tar.gz")
+        with tarfile.open(tar_path, "w:gz") as tar:
+            for i in range(3):
+                tar.add(self.make_zeros("log%d.log" % i, 1024 * 1024), "var/log/log%d.log" % i)
+        limits = unzip.ExtractionLimits(max_total_bytes=2 * 1024 * 1024, max_ratio=2000)
+        self.check_stopped(tar_path, "total", limits)
+        self.assertLessEqual(limits.total_bytes, 2 * 1024 * 1024 + unzip.COPY_CHUNK_SIZE)
+    
+    def test_nesting_depth(self):
+        inner_path = os.path.join(self.tmp_dir, "inner.zip")
+        with zipfile.ZipFile(inner_path, "w") as z:
+            z.writestr("bycast.log", "bycast line\n")
+        for name in ["middle.zip", "outer.zip"]:
+            path = os.path.join(self.tmp_dir, name)
+            with zipfile.ZipFile(path, "w") as z:
+                z.write(inner_path, os.path.basename(inner_path))
+                z.writestr("other.log", "other line\n")
+            inner_path = path
+        
+        limits = unzip.ExtractionLimits(max_depth=1)
+        with self.assertRaises(unzip.AcceptableException):
+            unzip.recursive_unzip(inner_path, self.dest_dir, limits=limits)
+        self.assertEqual("depth", limits.exceeded)
+        # Archives past the limit are deleted, not left for a later unzip
+        outer_dir = os.path.join(self.dest_dir, "outer")
+        self.assertTrue(os.path.isfile(os.path.join(outer_dir, "middle", "other.log")))
+        self.assertEqual(["other.log"], os.listdir(os.path.join(outer_dir, "middle")))
+    
+    def test_7z_member(self):
+        if not unzip.sevenzip.AVAILABLE:
+            self.skipTest("py7zr is not installed")
+        import py7zr
+        seven_path = os.path.join(self.tmp_dir, "bundle.7z")
+        with py7zr.SevenZipFile(seven_path, "w") as z:
+            z.write(self.make_zeros("big.log", 2 * 1024 * 1024), "var/log/big.log")
+        self.check_stopped(seven_path, "member", unzip.ExtractionLimits(max_member_bytes=1024 * 1024))
+
+
 class DeleteFileTestCase(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -350,9 +635,77 @@ class DeleteDirectoryTestCase(unittest.TestCase):
         pass
 
 
+class LiftPermissionsTestCase(unittest.TestCase):
+    """ Tests repairing the permissions of a path & its ancestors in-process """
+    
+    def setUp(self):
+        dirname = os.path.dirname(os.path.realpath(__file__))
+        self.tmpdir = os.path.join(dirname, "-".join([self._testMethodName, str(int(time.time()))]))
+        self.deep_dir = os.path.join(self.tmpdir, "a", "b", "c")
+        os.makedirs(self.deep_dir)
+        self.log_path = os.path.join(self.deep_dir, "bycast.log")
+        with open(self.log_path, "w") as fd:
+            fd.write("bycast line\n")
+        os.chmod(self.log_path, stat.S_IRUSR)
+        for path in [self.deep_dir, os.path.dirname(self.deep_dir)]:
+            os.chmod(path, stat.S_IRUSR | stat.S_IXUSR)
+    
+    def tearDown(self):
+        unzip.forget_lifted_permissions(self.tmpdir)
+        if os.path.exists(self.tmpdir):
+            unzip.delete_directory(self.tmpdir)
+        self.assertFalse(os.path.exists(self.tmpdir))
+    
+    def test_lift_permissions(self):
+        unzip.lift_permissions(self.log_path)
+        self.assertEqual(stat.S_IRUSR | stat.S_IWUSR, stat.S_IMODE(os.stat(self.log_path).st_mode))
+        self.assertEqual(stat.S_IRWXU, stat.S_IMODE(os.stat(self.deep_dir).st_mode))
+        self.assertEqual(stat.S_IRWXU,
+                         stat.S_IMODE(os.stat(os.path.dirname(self.deep_dir)).st_mode))
+        self.assertIn(self.tmpdir, unzip.lifted_dirs)
+        
+        # Siblings of a lifted path only touch themselves, not the ancestors again
+        sibling_path = os.path.join(self.deep_dir, "servermanager.log")
+        open(sibling_path, "w").close()
+        touched = []
+        add_owner_permissions = unzip.add_owner_permissions
+        unzip.add_owner_permissions = lambda path, mode: touched.append(path)
+        try:
+            unzip.lift_permissions(sibling_path)
+        finally:
+            unzip.add_owner_permissions = add_owner_permissions
+        self.assertEqual([sibling_path], touched)
+        
+        self.assertTrue(unzip.delete_directory(self.tmpdir))
+        self.assertNotIn(self.deep_dir, unzip.lifted_dirs)
+    
+    def test_retry_with_lifted_permissions(self):
+        denied = (PermissionError, PermissionError(13, "Permission denied"), None)
+        unzip.retry_with_lifted_permissions(os.unlink, self.log_path, denied)
+        self.assertFalse(os.path.exists(self.log_path))
+        self.assertEqual(stat.S_IRWXU, stat.S_IMODE(os.stat(self.deep_dir).st_mode))
+        
+        unzip.retry_with_lifted_permissions(os.scandir, self.deep_dir, denied)
+        self.assertFalse(os.path.exists(self.deep_dir))
+        
+        missing = (FileNotFoundError, FileNotFoundError(2, "No such file"), None)
+        unzip.retry_with_lifted_permissions(os.rmdir, self.deep_dir, missing)
+        with self.assertRaises(OSError):
+            busy = (OSError, OSError(16, "Device or resource busy"), None)
+            unzip.retry_with_lifted_permissions(os.rmdir, self.tmpdir, busy)
+
+
 class ExtensionStrippingTestCase(unittest.TestCase):
     """ Tests the zip extension strippping functions """
     
+    def test_is_single_file_gzip(self):
+        self.assertTrue(unzip.is_single_file_gzip("/var/log/syslog.2.gz"))
+        self.assertTrue(unzip.is_single_file_gzip("bycast.log.gz"))
+        self.assertFalse(unzip.is_single_file_gzip("bundle.tar.gz"))
+        self.assertFalse(unzip.is_single_file_gzip("bundle.zip.gz"))
+        self.assertFalse(unzip.is_single_file_gzip("bundle.tgz"))
+        self.assertFalse(unzip.is_single_file_gzip("bycast.log"))
+    
     def test_strip_all_zip_exts(self):
         self.assertEqual("/f", unzip.strip_all_zip_exts("/f.tgz.tar.zip.zip.gz"))
         self.assertEqual("b.png", unzip.strip_all_zip_exts("b.png.zip.7z.gz"))
@@ -12,42 +12,199 @@ helper functions.
 
 import os
 import types
-import time
 import platform
 import logging
 import shutil
 import stat
-import conans
 import gzip
 import patoolib
 import subprocess
+import tarfile
 import zipfile
+import threading
+import concurrent.futures
 
 import paths
+import cancel
+import archive
+import ratelimit
+import sevenzip
 import patoolib_patch
 patoolib_patch.patch_7z(patoolib)
 
 
 SUPPORTED_FILE_TYPES = {".gz", ".tgz", ".tar", ".zip", ".7z"}
 
+# Max number of threads unzipping sibling nested archives at once (1 = serial)
+UNZIP_THREADS = 4
+
+# Zip files at least this large (bytes) have their members unzipped by several threads,
+# the scan unzips them to scratch space instead of browsing them in place
+PARALLEL_ZIP_MIN_SIZE = 64 * 1024 * 1024
+
+# How 7z archives are unzipped: "py7zr" in-process or "patool" through the 7z command
+SEVEN_ZIP_BACKEND = "py7zr" if sevenzip.AVAILABLE else "patool"
+
+# Directories whose permissions were lifted by this process, see `lift_permissions`
+lifted_dirs = set()
+
+# Guards lifted_dirs, archives are unzipped & deleted by several threads
+lifted_dirs_lock = threading.Lock()
+
+# Max bytes unzipped from an archive, its nested archives included
+MAX_UNZIPPED_BYTES = 128 * 1024**3
+
+# Max bytes unzipped from a single archive member
+MAX_MEMBER_BYTES = 32 * 1024**3
+
+# Max ratio of bytes unzipped from an archive to its compressed size
+MAX_COMPRESSION_RATIO = 500
+
+# Bytes an archive may unzip to before its compression ratio is checked
+RATIO_GRACE_BYTES = 64 * 1024 * 1024
+
+# Max levels of archives nested inside an archive
+MAX_NESTING_DEPTH = 8
+
+# Bytes copied at a time while unzipping
+COPY_CHUNK_SIZE = 64 * 1024
+
 
 class AcceptableException(Exception):
     def __init___(self, arg):
         Exception.__init__(self, arg)
 
 
-def recursive_unzip(src, dest, action=lambda file_abspath: None):
+class LimitExceeded(AcceptableException):
+    """ Unzipping was stopped by one of the `ExtractionLimits`, likely a decompression bomb """
+
+
+class ExtractionLimits:
+    """
+    Limits on how far an archive may expand while it is unzipped, guarding the scratch
+    space against decompression bombs. Counts the bytes written while unzipping an
+    archive and every archive nested inside it, so a single object should be used for
+    one call to `recursive_unzip`. Safe to share between the threads of that call.
+    """
+    
+    LIMIT_NAMES = ["total", "member", "ratio", "depth"]
+    
+    def __init__(self, *, max_total_bytes=None, max_member_bytes=None, max_ratio=None,
+                 max_depth=None):
+        """ Constructs limits, None uses the module default of each limit """
+        self.max_total_bytes = MAX_UNZIPPED_BYTES if max_total_bytes is None else max_total_bytes
+        self.max_member_bytes = MAX_MEMBER_BYTES if max_member_bytes is None else max_member_bytes
+        self.max_ratio = MAX_COMPRESSION_RATIO if max_ratio is None else max_ratio
+        self.max_depth = MAX_NESTING_DEPTH if max_depth is None else max_depth
+        self.total_bytes = 0
+        self.exceeded = None                # name of the first limit exceeded
+        self._lock = threading.Lock()
+    
+    def meter(self, archive_path):
+        """ Returns an ArchiveMeter counting the bytes unzipped from the archive """
+        return ArchiveMeter(self, archive_path)
+    
+    def check_depth(self, depth, src):
+        """ Raises LimitExceeded if an archive at the nesting depth may not be unzipped """
+        if depth > self.max_depth:
+            self.exceed("depth", "Archive nested more than %d levels deep: %s" % (self.max_depth, src))
+    
+    def exceed(self, limit, message):
+        """ Records that the limit was exceeded & raises LimitExceeded """
+        with self._lock:
+            if self.exceeded is None:
+                self.exceeded = limit
+        logging.critical("Decompression limit exceeded: %s", message)
+        raise LimitExceeded(message)
+
+
+class ArchiveMeter:
+    """ Counts the bytes unzipped from one archive against its ExtractionLimits """
+    
+    def __init__(self, limits, archive_path):
+        """ Constructs a meter for the archive, nothing unzipped yet """
+        self.limits = limits
+        self.archive_path = archive_path
+        self.compressed_bytes = max(1, os.path.getsize(archive_path))
+        self.unzipped_bytes = 0
+    
+    def add(self, name, member_bytes, nbytes):
+        """
+        Counts bytes about to be written, raising LimitExceeded when they go over a limit
+        and Cancelled once the scan is cancelled.
+        name : string
+            member the bytes belong to
+        member_bytes : int
+            bytes of the member unzipped so far, the new ones included
+        nbytes : int
+            number of new bytes
+        """
+        cancel.check()
+        limits = self.limits
+        if member_bytes > limits.max_member_bytes:
+            limits.exceed("member", "Member larger than %d bytes: %s in %s" % (
+                limits.max_member_bytes, name, self.archive_path))
+        
+        with limits._lock:
+            self.unzipped_bytes += nbytes
+            limits.total_bytes += nbytes
+            (unzipped, total) = (self.unzipped_bytes, limits.total_bytes)
+        
+        if unzipped > RATIO_GRACE_BYTES and unzipped > limits.max_ratio * self.compressed_bytes:
+            limits.exceed("ratio", "Archive expanded more than %dx: %s" % (
+                limits.max_ratio, self.archive_path))
+        if total > limits.max_total_bytes:
+            limits.exceed("total", "Archive expanded to more than %d bytes: %s" % (
+                limits.max_total_bytes, self.archive_path))
+    
+    def copy(self, in_fd, out_path, name):
+        """
+        Writes the decompressed stream to a new file, counting each chunk before it is written.
+        in_fd : file object
+            decompressed data of the member
+        out_path : string
+            path of the file to write
+        name : string
+            member the data belongs to
+        """
+        member_bytes = 0
+        with open(out_path, "wb") as out_fd:
+            while True:
+                data = in_fd.read(COPY_CHUNK_SIZE)
+                if not data:
+                    break
+                member_bytes += len(data)
+                self.add(name, member_bytes, len(data))
+                out_fd.write(data)
+
+
+def recursive_unzip(src, dest, action=lambda file_abspath: None, *, keep_gz_logs=False,
+                    member_filter=None, threads=None, limits=None, depth=0):
     """
     Recursively unzips deeply nested directories into a provided location.
     The original zip file will not be deleted. The fully unzipped directory will have
     no compressed files. If compressed files are encountered, they are unzipped in their
-    respective locations and the temporary archive/zip file is deleted.
+    respective locations and the temporary archive/zip file is deleted. Modification
+    times are left as unzipped, callers carry the archive's on their entries instead
+    (see `paths.QuantumEntry`). Expansion is bounded by the limits, exceeding one
+    raises LimitExceeded and deletes the archive's partial output. A cancelled scan
+    raises Cancelled between files and chunks, leaving the partial output to the caller.
     src : string
         path to source directory file to unzip
     dest : string
         path to destination directory to place unzipped files
     action : function(file_abspath) -> return None
         action function to take on each file extracted
+    keep_gz_logs : bool
+        leave extracted single file gzip archives compressed so they can be streamed
+    member_filter : function(member_relpath) -> return bool
+        only archive members accepted by the filter are extracted, None extracts all
+    threads : int
+        max threads unzipping sibling nested archives at once, None uses UNZIP_THREADS
+    limits : ExtractionLimits
+        limits shared with the nested archives, None uses the default limits
+    depth : int
+        nesting depth of src, 0 for the outermost archive
     return : string
         path to fully unzipped directory
     """
@@ -57,35 +214,67 @@ def recursive_unzip(src, dest, action=lambda file_abspath: None):
     src = os.path.abspath(src)
     dest = os.path.abspath(dest)
     os.makedirs(dest, exist_ok=True)
+    threads = UNZIP_THREADS if threads is None else threads
+    limits = ExtractionLimits() if limits is None else limits
+    limits.check_depth(depth, src)
 
-    # Capture the modified time of the archive to force it upon its contents
-    try:
-        archive_mtime = os.path.getmtime(src)
-    except:
-        logging.warning("Get mod time failed, skipping zipped file: %s", src)
-        # Do not change permissions, may not own file
-        raise AcceptableException("Get mod time failed")    
+    def member_relpath(path):
+        """ Path of an extracted file relative to the root of this archive """
+        return os.path.relpath(path, dest) if os.path.isdir(dest) else os.path.basename(path)
     
     def handle_extracted_file(path):
         """ Callback for each unzipped file """
+        cancel.check()
         path = os.path.abspath(path)
         
-        if not try_fs_operation(path, lambda p: os.utime(p, (time.time(), archive_mtime))):
-            logging.warning("Set mod time failed, skipping file: %s", path)
+        if keep_gz_logs and is_single_file_gzip(path):
+            # Left compressed, streamed later through a GzipEntry
+            action(path)
+        elif member_filter is not None and is_single_file_gzip(path) and \
+                not member_filter(strip_zip_ext(member_relpath(path))):
+            # Contents would be filtered out, skip decompressing
+            logging.debug("Skipping filtered gzip archive: %s", path)
             delete_file(path)
-            raise AcceptableException("Set mod time failed")
-        
-        if os.path.splitext(path)[1] in SUPPORTED_FILE_TYPES:
-            recursive_unzip(path, os.path.dirname(path), action)
+        elif os.path.splitext(path)[1] in SUPPORTED_FILE_TYPES:
+            # Nested archives are unzipped serially, siblings are already in parallel
+            try:
+                recursive_unzip(path, os.path.dirname(path), action, keep_gz_logs=keep_gz_logs,
+                                member_filter=member_filter, threads=1, limits=limits,
+                                depth=depth + 1)
+            except AcceptableException:
+                if limits.exceeded is not None:
+                    # Never left behind for a later scan to unzip again without limits
+                    delete_file(path)
+                raise
             delete_file(path)                   
         else:
             # Basic file, perform action
             action(path)                
         return
     
+    def handle_extracted_dir(path):
+        """ Handles each unzipped file, unzipping sibling nested archives concurrently """
+        nested_archives = []
+        
+        def collect_file(file_path):
+            """ Defers nested archives so that they can be unzipped together """
+            is_archive = os.path.splitext(file_path)[1] in SUPPORTED_FILE_TYPES
+            if is_archive and not (keep_gz_logs and is_single_file_gzip(file_path)):
+                nested_archives.append(file_path)
+            else:
+                handle_extracted_file(file_path)
+        
+        recursive_walk(path, collect_file)
+        map_concurrently(handle_extracted_file, nested_archives, threads)
+    
     # Destination will mirror the old name
     extension = os.path.splitext(src)[1]
-    dest = os.path.join(dest, strip_zip_ext(os.path.basename(src)))
+    if is_compound_tar(src):
+        # Extracted in one pass, so strip the .tar under the .gz too
+        extension = ".tgz"
+        dest = os.path.join(dest, strip_zip_ext(strip_zip_ext(os.path.basename(src))))
+    else:
+        dest = os.path.join(dest, strip_zip_ext(os.path.basename(src)))
     assert os.path.isabs(dest), "New destination path not absolute: "+dest
     
     if os.path.exists(dest):                
@@ -104,7 +293,7 @@ def recursive_unzip(src, dest, action=lambda file_abspath: None):
             extract_zip(
                 paths.QuantumEntry(os.path.dirname(zip_file), os.path.basename(zip_file)),
                 paths.QuantumEntry(os.path.dirname(dest_dir), os.path.basename(dest_dir)),
-                exist_ok=True)
+                exist_ok=True, member_filter=member_filter, threads=threads, limits=limits)
             assert unzip_entry.exists()
         
         except AcceptableException as e:
@@ -113,7 +302,7 @@ def recursive_unzip(src, dest, action=lambda file_abspath: None):
             raise AcceptableException("Error during ZipFile unzip: %s", e)
         
         if unzip_entry.is_dir():
-            recursive_walk(unzip_entry.abspath, handle_extracted_file)
+            handle_extracted_dir(unzip_entry.abspath)
         elif unzip_entry.is_file():
             handle_extracted_file(unzip_entry.abspath)
         else:
@@ -132,18 +321,20 @@ def recursive_unzip(src, dest, action=lambda file_abspath: None):
         # Exception handling only
         error_flag = False
         try:                            
-            conans.tools.unzip(src, dest, keep_permissions=False)
+            extract_tar(src, dest, member_filter=member_filter, limits=limits)
+        except cancel.Cancelled:
+            raise
         except Exception as e:
-            logging.critical("Error during Conan unzip: %s", e)
+            logging.critical("Error during tar extraction: %s", e)
             error_flag = True                   
         
         if not error_flag:
             # Walk and unzip if needed
-            recursive_walk(dest, handle_extracted_file)
+            handle_extracted_dir(dest)
         else:
             if os.path.exists(dest):
                 delete_directory(dest)
-            raise AcceptableException("Error during Conan unzip")
+            raise AcceptableException("Error during tar extraction")
         
     elif extension == ".gz":
         logging.debug("Decompressing: %s", src)
@@ -151,12 +342,10 @@ def recursive_unzip(src, dest, action=lambda file_abspath: None):
         # Exception handling only
         error_flag = False
         try:                                    
-            with gzip.open(src, "rb") as in_fd, open(dest, "wb") as out_fd:
-                while True:
-                    data = in_fd.read(1000000)
-                    if data == b'' or data == None or not data:
-                        break
-                    out_fd.write(data)
+            with ratelimit.open_input(src) as raw_fd, gzip.open(raw_fd, "rb") as in_fd:
+                limits.meter(src).copy(in_fd, dest, os.path.basename(dest))
+        except cancel.Cancelled:
+            raise
         except Exception as e:
             logging.critical("Error during GZip unzip: %s", e)
             error_flag = True               
@@ -181,18 +370,20 @@ def recursive_unzip(src, dest, action=lambda file_abspath: None):
         # Exception handling only
         error_flag = False
         try:                     
-            patoolib.extract_archive(src, outdir=dest)
+            extract_7z(src, dest, member_filter=member_filter, limits=limits)
+        except cancel.Cancelled:
+            raise
         except Exception as e:
-            logging.critical("Error during patool 7zip extraction: %s", e)
+            logging.critical("Error during 7zip extraction: %s", e)
             error_flag = True                   
         
         if not error_flag:
             # Walk and unzip if needed
-            recursive_walk(dest, handle_extracted_file)
+            handle_extracted_dir(dest)
         else:
             if os.path.exists(dest):
                 delete_directory(dest)
-            raise AcceptableException("Error during patool 7zip extraction")
+            raise AcceptableException("Error during 7zip extraction")
     
     else:
         logging.critical("This execution path should never be reached")
@@ -222,20 +413,106 @@ def recursive_walk(src, action):
     return
 
 
+def map_concurrently(func, items, threads):
+    """
+    Calls the function on every item using up to `threads` threads. Every call
+    is allowed to finish, then the first exception raised (if any) is propagated.
+    func : function(item) -> return None
+        function to call on each item
+    items : list
+        items to call the function on
+    threads : int
+        max number of threads to use, 1 calls the function serially
+    """
+    if threads <= 1 or len(items) <= 1:
+        for item in items:
+            func(item)
+        return
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(threads, len(items))) as executor:
+        futures = [executor.submit(func, item) for item in items]
+    
+    for future in futures:
+        future.result()
+
+
 def lift_permissions(path):
     """
-    Recursively chmods input file to 755
-    path: string
+    Gives the owner full access to the path and read/write/search access to each of
+    its ancestors, which is what deleting or changing the path needs. Directories
+    already lifted are remembered, so later failures under them stop climbing early.
+    path : string
         path to input file
     """
-    if platform.system() != "Windows":
-        parent_dir = os.path.dirname(path)
-        exit_code = os.system("chmod -R 755 {}".format(parent_dir))
-        if exit_code != 0:
-            logging.warning("Bad exit code for chmod: %d %s", exit_code, path)
-    else:
+    if platform.system() == "Windows":
         # Turn off read-only
         os.chmod(path, stat.S_IWRITE)
+        return
+    
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        add_owner_permissions(path, stat.S_IRWXU)
+    elif os.path.lexists(path):
+        add_owner_permissions(path, stat.S_IRUSR | stat.S_IWUSR)
+    
+    parent_dir = os.path.dirname(path)
+    with lifted_dirs_lock:
+        while parent_dir not in lifted_dirs:
+            add_owner_permissions(parent_dir, stat.S_IRWXU)
+            lifted_dirs.add(parent_dir)
+            if os.path.dirname(parent_dir) == parent_dir:
+                break
+            parent_dir = os.path.dirname(parent_dir)
+
+
+def add_owner_permissions(path, mode):
+    """
+    Adds the owner permission bits to the path if it lacks any of them, leaving
+    paths owned by other users alone.
+    path : string
+        path to a file or directory
+    mode : int
+        permission bits the owner needs, such as stat.S_IRWXU
+    """
+    try:
+        st = os.lstat(path)
+        if stat.S_IMODE(st.st_mode) & mode == mode or stat.S_ISLNK(st.st_mode):
+            return
+        if st.st_uid != os.geteuid() and os.geteuid() != 0:
+            return
+        os.chmod(path, stat.S_IMODE(st.st_mode) | mode)
+    except OSError as e:
+        logging.warning("Unable to lift permissions: %s %s", path, e)
+
+
+def forget_lifted_permissions(path):
+    """
+    Forgets the lifted directories at or under the path, once it has been deleted.
+    path : string
+        path of a deleted directory
+    """
+    prefix = os.path.join(path, "")
+    with lifted_dirs_lock:
+        lifted_dirs.difference_update([d for d in lifted_dirs
+                                       if d == path or d.startswith(prefix)])
+
+
+def retry_with_lifted_permissions(func, path, exc_info):
+    """
+    Error handler of `shutil.rmtree` that lifts the permissions blocking the failed
+    operation and tries it again. A directory that could not be listed is deleted by
+    another rmtree once it is readable.
+    """
+    if isinstance(exc_info[1], FileNotFoundError):
+        return                              # already deleted
+    if not isinstance(exc_info[1], PermissionError):
+        raise exc_info[1]
+    
+    lift_permissions(path)
+    if func in (os.open, os.scandir, os.listdir):
+        shutil.rmtree(path, onerror=retry_with_lifted_permissions)
+    else:
+        func(path)
 
 
 def try_fs_operation(path, func):
@@ -269,7 +546,8 @@ def try_fs_operation(path, func):
         return False                    
 
 
-def extract_zip(zip_file, dest_dir, *, exist_ok=True):
+def extract_zip(zip_file, dest_dir, *, exist_ok=True, member_filter=None, threads=None,
+                limits=None):
     """
     Unzips the provided zip file into the destination directory. Assumes
     that Logjam does not own the zip file. If the zip file unzips into a single
@@ -277,6 +555,11 @@ def extract_zip(zip_file, dest_dir, *, exist_ok=True):
     into a directory named after the filename portion of the zip file. Guarantees that
     there is always a directory or file in the dest_dir named after the zip_file (makes
     this function idempotent). Errors during unzipping are propagated through exceptions.
+    Only members accepted by `member_filter(member_relpath)` are unzipped, if it is given.
+    Zip files of at least PARALLEL_ZIP_MIN_SIZE bytes are unzipped by up to `threads`
+    threads (None uses UNZIP_THREADS), each with its own handle on the zip file.
+    Members are counted against the limits (None uses the default limits) as they are
+    written, exceeding one raises LimitExceeded.
     """
     assert zip_file.extension == ".zip", "zip_file had no .zip ext: " + zip_file.abspath
     
@@ -291,10 +574,19 @@ def extract_zip(zip_file, dest_dir, *, exist_ok=True):
             raise AcceptableException("Already unzipped!")
     
     os.makedirs(unzip_dir.abspath, exist_ok=True)
+    threads = UNZIP_THREADS if threads is None else threads
+    limits = ExtractionLimits() if limits is None else limits
+    meter = limits.meter(zip_file.abspath)
     
     try:
-        with zipfile.ZipFile(zip_file.abspath, "r") as z:
-            z.extractall(path=unzip_dir.abspath)
+        with ratelimit.open_input(zip_file.abspath) as raw_fd, zipfile.ZipFile(raw_fd, "r") as z:
+            members = [m for m in z.infolist() if member_filter is None or m.is_dir() \
+                       or member_filter(archive.normalize_member_name(m.filename))]
+            if threads > 1 and is_parallel_zip(zip_file.abspath):
+                extract_zip_members(zip_file.abspath, unzip_dir.abspath, members, threads, meter)
+            else:
+                for member in members:
+                    extract_zip_member(z, member, unzip_dir.abspath, meter)
     except zipfile.BadZipFile as e:
         raise AcceptableException("Python 3 ZipFile failed, exception: %s" % str(e))
     assert zip_file.exists(), "Zip file was tampered with: " + zip_file.abspath
@@ -318,6 +610,275 @@ def extract_zip(zip_file, dest_dir, *, exist_ok=True):
     return
 
 
+def is_parallel_zip(path):
+    """
+    Returns whether the file is a zip file large enough for `extract_zip` to unzip its
+    members with several threads.
+    path : string
+        path to the file
+    return : bool
+        True if the zip file is unzipped in parallel
+    """
+    return os.path.splitext(path)[1] == ".zip" and os.path.getsize(path) >= PARALLEL_ZIP_MIN_SIZE
+
+
+def extract_zip_members(zip_path, dest_path, members, threads, meter):
+    """
+    Unzips the zip members into the destination directory using several threads.
+    Directories are created up front, then the file members are split into groups
+    of roughly equal compressed size and each group is unzipped by its own thread
+    through its own handle on the zip file. Errors are propagated through exceptions.
+    zip_path : string
+        path to the zip file
+    dest_path : string
+        directory to unzip the members into, like `ZipFile.extractall`
+    members : list of ZipInfo
+        members of the zip file to unzip
+    threads : int
+        max number of threads to use
+    meter : ArchiveMeter
+        counts the unzipped bytes of the zip file against its limits
+    """
+    file_members = [m for m in members if not m.is_dir()]
+    
+    # Threads must not race each other creating the same parent directories
+    for member in members:
+        target = zip_member_target(dest_path, member)
+        os.makedirs(target if member.is_dir() else os.path.dirname(target), exist_ok=True)
+    
+    def extract_group(group):
+        """ Unzips a group of members through a private handle on the zip file """
+        with ratelimit.open_input(zip_path) as raw_fd, zipfile.ZipFile(raw_fd, "r") as z:
+            for member in group:
+                extract_zip_member(z, member, dest_path, meter)
+    
+    map_concurrently(extract_group, split_by_size(file_members, threads), threads)
+
+
+def extract_zip_member(z, member, dest_path, meter):
+    """
+    Unzips the zip member into the destination directory like `ZipFile.extract`,
+    counting its bytes against the limits as they are written.
+    z : ZipFile
+        open zip file holding the member
+    member : ZipInfo
+        member of the zip file
+    dest_path : string
+        directory to unzip the member into
+    meter : ArchiveMeter
+        counts the unzipped bytes of the zip file against its limits
+    """
+    target = zip_member_target(dest_path, member)
+    if member.is_dir():
+        os.makedirs(target, exist_ok=True)
+        return
+    if target == dest_path:
+        logging.debug("Skipping zip member: %s", member.filename)
+        return
+    
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with z.open(member) as in_fd:
+        meter.copy(in_fd, target, member.filename)
+
+
+def zip_member_target(dest_path, member):
+    """
+    Returns the path `ZipFile.extract` writes the zip member to in the destination
+    directory, dropping drive letters and "", "." & ".." components like it does.
+    dest_path : string
+        directory the member is unzipped into
+    member : ZipInfo
+        member of the zip file
+    return : string
+        path the member is unzipped to
+    """
+    arcname = os.path.splitdrive(member.filename.replace("/", os.path.sep))[1]
+    parts = [x for x in arcname.split(os.path.sep) if x not in ("", os.path.curdir, os.path.pardir)]
+    return os.path.join(dest_path, *parts)
+
+
+def split_by_size(members, groups):
+    """
+    Splits the zip members into at most `groups` non-empty groups of roughly equal
+    total compressed size, placing the largest member into the lightest group first.
+    members : list of ZipInfo
+        members to split
+    groups : int
+        max number of groups
+    return : list of lists of ZipInfo
+        the groups, largest group first
+    """
+    buckets = [[0, []] for _ in range(max(1, min(groups, len(members))))]
+    for member in sorted(members, key=lambda m: m.compress_size, reverse=True):
+        lightest = min(buckets, key=lambda b: b[0])
+        lightest[0] += member.compress_size
+        lightest[1].append(member)
+    return [b[1] for b in sorted(buckets, key=lambda b: b[0], reverse=True) if b[1]]
+
+
+def extract_7z(src, dest, *, member_filter=None, backend=None, limits=None):
+    """
+    Unzips the 7z archive into the existing destination directory. The in-process
+    py7zr backend only unzips the members accepted by the filter; archives it cannot
+    decode fall back to the patched 7z command, whose rejected members are deleted
+    after the fact. Password protected archives are never unzipped. Errors are
+    propagated through exceptions. py7zr counts members against the limits as they
+    are written, the 7z command only once it is done.
+    src : string
+        path to the 7z archive
+    dest : string
+        existing directory to unzip the members into
+    member_filter : function(member_relpath) -> return bool
+        only members accepted by the filter are kept, None keeps all
+    backend : string
+        "py7zr" or "patool", None uses SEVEN_ZIP_BACKEND
+    limits : ExtractionLimits
+        limits on the unzipped bytes, None uses the default limits
+    """
+    backend = SEVEN_ZIP_BACKEND if backend is None else backend
+    assert backend in ("py7zr", "patool"), "Unknown 7z backend: " + backend
+    limits = ExtractionLimits() if limits is None else limits
+    meter = limits.meter(src)
+    
+    if backend == "py7zr":
+        try:
+            sevenzip.extract(src, dest, member_filter=member_filter, check=meter.add)
+            return
+        except sevenzip.Unsupported as e:
+            logging.warning("Falling back to 7z command: %s", e)
+            delete_directory(dest)
+            os.makedirs(dest)
+    
+    patoolib.extract_archive(src, outdir=dest)
+    if member_filter is not None:
+        prune_files(dest, member_filter)
+    
+    def count_file(path):
+        """ Counts the unzipped file against the limits """
+        nbytes = os.path.getsize(path)
+        meter.add(os.path.relpath(path, dest), nbytes, nbytes)
+    
+    recursive_walk(dest, count_file)
+
+
+def prune_files(src, member_filter):
+    """
+    Deletes the files under the directory that the filter rejects, leaving directories.
+    src : string
+        directory to prune
+    member_filter : function(member_relpath) -> return bool
+        files whose path relative to `src` is rejected are deleted
+    """
+    def prune_file(path):
+        """ Deletes the file if the filter rejects it """
+        if not member_filter(os.path.relpath(path, src)):
+            delete_file(path)
+    
+    recursive_walk(src, prune_file)
+
+
+def extract_tar(tar_file, dest_dir, *, member_filter=None, limits=None):
+    """
+    Extracts the tar archive into the destination directory in a single streaming
+    pass. Compressed tarballs (.tgz, .tar.gz) are decompressed on the fly while the
+    members are written, so no intermediate .tar is ever placed on disk. Permissions
+    and owners are not kept. Members that would land outside of `dest_dir`, symbolic
+    links and special files are skipped. Errors are propagated through exceptions.
+    Regular files are counted against the limits as they are written. Hard links to a
+    file left out by the filter are written as copies of it, read in a second pass once
+    the first one is done, since the file's data was streamed past by then.
+    tar_file : string
+        path to the tar archive, optionally gzip compressed
+    dest_dir : string
+        path to the directory to extract the members into
+    member_filter : function(member_relpath) -> return bool
+        only file members accepted by the filter are extracted, None extracts all
+    limits : ExtractionLimits
+        limits on the unzipped bytes, None uses the default limits
+    """
+    limits = ExtractionLimits() if limits is None else limits
+    meter = limits.meter(tar_file)
+    filtered = set()                # files left out by the filter
+    copies = {}                     # file left out -> links to it, written as copies of it
+    with ratelimit.open_input(tar_file) as raw_fd, \
+            tarfile.open(fileobj=raw_fd, mode="r|*") as tar:
+        for member in tar:
+            name = archive.normalize_member_name(member.name)
+            if name == "" or member.issym() or not (member.isfile() or member.isdir() or member.islnk()):
+                logging.debug("Skipping tar member: %s", member.name)
+                continue
+            if member.islnk() and archive.normalize_member_name(member.linkname) == "":
+                logging.debug("Skipping tar member: %s", member.name)
+                continue
+            if member_filter is not None and not member.isdir() and not member_filter(name):
+                if member.isfile():
+                    filtered.add(name)
+                continue
+            
+            member.name = name
+            if member.islnk():
+                member.linkname = archive.normalize_member_name(member.linkname)
+            if member.islnk() and member.linkname in filtered:
+                copies.setdefault(member.linkname, []).append(name)
+            elif member.isfile():
+                target = os.path.join(dest_dir, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with tar.extractfile(member) as in_fd:
+                    meter.copy(in_fd, target, name)
+            else:
+                tar.extract(member, dest_dir, set_attrs=False)
+    
+    if len(copies) != 0:
+        extract_tar_link_copies(tar_file, dest_dir, copies, meter)
+
+
+def extract_tar_link_copies(tar_file, dest_dir, copies, meter):
+    """
+    Writes the hard links to files the filter left out, reading the tar archive again
+    for the data of those files. The first link to a file gets a copy of it, the other
+    links to the same file are linked to that copy.
+    tar_file : string
+        path to the tar archive, optionally gzip compressed
+    dest_dir : string
+        path to the directory the members were extracted into
+    copies : dict of string -> list of string
+        normalized name of each file left out -> normalized names of the links to it
+    meter : ArchiveMeter
+        meter of the extraction, counting the copies
+    """
+    with ratelimit.open_input(tar_file) as raw_fd, \
+            tarfile.open(fileobj=raw_fd, mode="r|*") as tar:
+        for member in tar:
+            name = archive.normalize_member_name(member.name)
+            if not member.isfile() or name not in copies:
+                continue
+            
+            (first, *others) = [os.path.join(dest_dir, link) for link in copies.pop(name)]
+            os.makedirs(os.path.dirname(first), exist_ok=True)
+            with tar.extractfile(member) as in_fd:
+                meter.copy(in_fd, first, name)
+            for target in others:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.link(first, target)
+            if len(copies) == 0:
+                break
+
+
+def is_compound_tar(path):
+    """
+    Returns whether the path names a compressed tarball that is extracted in a single
+    pass, either a `.tgz` or a `.tar` under a `.gz` such as `logs.tar.gz`.
+    path : string
+        path that is being checked
+    return : bool
+        True if the path is a compressed tarball
+    """
+    (prior, extension) = os.path.splitext(path)
+    if extension == ".tgz":
+        return True
+    return extension == ".gz" and os.path.splitext(prior)[1] == ".tar"
+
+
 def delete_file(path):
     """
     Attempts to delete a file. If there is a problem halt the program.
@@ -345,10 +906,11 @@ def delete_directory(path):
     """
     path = os.path.abspath(path)
     
-    if not try_fs_operation(path, lambda p: shutil.rmtree(p)):
+    if not try_fs_operation(path, lambda p: shutil.rmtree(p, onerror=retry_with_lifted_permissions)):
         logging.critical("Directory deletion failed, skipping directory; %s", path)
         return False
     
+    forget_lifted_permissions(path)
     return True
 
 
@@ -383,3 +945,18 @@ def strip_zip_ext(path):
     else:
         return path
 
+
+
+def is_single_file_gzip(path):
+    """
+    Returns whether the path names a gzip archive holding a single plain file,
+    such as a rotated `syslog.2.gz`. Compound archives like `logs.tar.gz` are not.
+    path : string
+        path that is being checked
+    return : bool
+        True if the path is a gzip archive of a single plain file
+    """
+    if os.path.splitext(path)[1] != ".gz":
+        return False
+    
+    return os.path.splitext(strip_zip_ext(path))[1] not in SUPPORTED_FILE_TYPES